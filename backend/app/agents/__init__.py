@@ -1,11 +1,12 @@
 # Multi-Agent System
 # 前台 Q&A Agent + 各专业部门 Agents
 
-from .qa import QAAgent
+from .qa import AgentRequestContext, QAAgent
 from .return_planner import ReturnPlannerAgent
 from .order_agent import OrderAgent
 
 __all__ = [
+    "AgentRequestContext",
     "QAAgent",
     "ReturnPlannerAgent",
     "OrderAgent",
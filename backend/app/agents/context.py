@@ -0,0 +1,177 @@
+"""
+Token-budgeted conversation context.
+
+The newest messages are sent verbatim as long as they fit in
+AGENT_CONTEXT_TOKEN_BUDGET; everything older is represented by a rolling
+per-conversation summary stored on the conversations row. The summary is
+extended in a background task, never on the request path.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.db.repo import Repository
+from app.llm import kimi
+from app.llm.models import estimate_tokens
+from app.llm.usage import use_background_llm_context
+
+ORDER_ID_PATTERN = re.compile(r"ORD[-_A-Z0-9]{3,}", re.IGNORECASE)
+
+# 每条消息的固定开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 进程内摘要缓存的会话数上限
+SUMMARY_CACHE_SIZE = 2000
+
+SUMMARY_SYSTEM_PROMPT = """你负责为电商客服对话维护滚动摘要。
+必须保留：订单号、金额、商品名称、用户诉求、客服已经给出的处理结果或承诺、仍未解决的问题。
+去掉寒暄和重复内容，用中文陈述句书写，不超过 {max_chars} 字。只输出摘要正文。"""
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_start(messages: List[Dict], budget: int) -> int:
+    """Index of the oldest message that still fits in budget (the newest message is always kept)."""
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        cost = message_tokens(messages[index])
+        if used + cost > budget and start < len(messages):
+            break
+        used += cost
+        start = index
+    return start
+
+
+def trim_to_budget(messages: List[Dict], budget: Optional[int] = None) -> List[Dict]:
+    budget = budget or settings.agent_context_token_budget
+    return messages[fit_start(messages, budget):]
+
+
+class ConversationContextBuilder:
+    """Builds the message list sent to the LLM and maintains per-conversation summaries."""
+
+    def __init__(self, token_budget: Optional[int] = None):
+        self.token_budget = token_budget or settings.agent_context_token_budget
+        self._summaries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def build(self, conversation_id: str, messages: List[Dict], repo: Repository) -> List[Dict]:
+        """
+        Return history ready for the LLM: [summary system message] + newest verbatim messages.
+
+        `messages` is the full history in chronological order ({"role", "content"} dicts).
+        """
+        if fit_start(messages, self.token_budget) == 0:
+            return list(messages)
+
+        # 超出预算：较早的消息由摘要代替，摘要本身也占用预算
+        start = fit_start(messages, max(self.token_budget - settings.agent_summary_max_tokens, 1))
+        summary, covered = await self._get_summary(conversation_id, repo)
+        covered = min(covered, len(messages))
+
+        gap = messages[covered:start]
+        if gap:
+            # 摘要尚未覆盖到窗口起点：后台补齐，并多覆盖半个窗口，避免每轮都触发
+            upto = start + (len(messages) - start) // 2
+            self._schedule_refresh(conversation_id, messages[covered:upto], summary, upto, repo)
+
+        parts = []
+        if summary:
+            parts.append(summary)
+        gap_order_ids = sorted({match.upper() for msg in gap for match in ORDER_ID_PATTERN.findall(str(msg.get("content") or ""))})
+        if gap_order_ids:
+            parts.append(f"较早对话中提到的订单号：{', '.join(gap_order_ids)}")
+
+        context = list(messages[start:])
+        if parts:
+            context.insert(0, {"role": "system", "content": "【之前对话的摘要】\n" + "\n".join(parts)})
+        print(f"[context] conversation={conversation_id} kept={len(context)} of {len(messages)} summary_covered={covered}")
+        return context
+
+    async def _get_summary(self, conversation_id: str, repo: Repository) -> Tuple[str, int]:
+        cached = self._summaries.get(conversation_id)
+        if cached is not None:
+            self._summaries.move_to_end(conversation_id)
+            return cached
+        row = await run_blocking(repo.get_conversation_summary, conversation_id)
+        value = (row["summary"], int(row["message_count"])) if row else ("", 0)
+        self._remember(conversation_id, value)
+        return value
+
+    def _remember(self, conversation_id: str, value: Tuple[str, int]) -> None:
+        self._summaries[conversation_id] = value
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > SUMMARY_CACHE_SIZE:
+            self._summaries.popitem(last=False)
+
+    def _schedule_refresh(
+        self,
+        conversation_id: str,
+        new_messages: List[Dict],
+        summary: str,
+        upto: int,
+        repo: Repository,
+    ) -> None:
+        if conversation_id in self._refreshing or not new_messages:
+            return
+        self._refreshing.add(conversation_id)
+        task = asyncio.create_task(self._refresh(conversation_id, new_messages, summary, upto, repo))
+        self._tasks.add(task)
+
+        def done(finished: asyncio.Task) -> None:
+            self._tasks.discard(finished)
+            self._refreshing.discard(conversation_id)
+
+        task.add_done_callback(done)
+
+    async def _refresh(
+        self,
+        conversation_id: str,
+        new_messages: List[Dict],
+        summary: str,
+        upto: int,
+        repo: Repository,
+    ) -> None:
+        transcript = "\n".join(
+            f"{'用户' if msg.get('role') == 'user' else '客服'}: {msg.get('content') or ''}"
+            for msg in new_messages
+            if msg.get("role") in {"user", "assistant", "agent"}
+        )
+        max_tokens = settings.agent_summary_max_tokens
+        prompt = [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(max_chars=max_tokens)},
+            {
+                "role": "user",
+                "content": f"已有摘要：\n{summary or '（无）'}\n\n新增对话：\n{transcript}\n\n请输出更新后的完整摘要。",
+            },
+        ]
+        # 摘要不在请求关键路径上：走 background 通道，不占用用户请求的截止时间
+        use_background_llm_context()
+        try:
+            response = await kimi.chat_completion(
+                prompt,
+                temperature=0.3,
+                max_tokens=max_tokens,
+                enable_tools=False,
+                call_site="context.summary",
+            )
+            updated = (response.content or "").strip()
+            if not updated:
+                return
+            await run_blocking(repo.update_conversation_summary, conversation_id, updated, upto)
+            self._remember(conversation_id, (updated, upto))
+            print(f"[context] summary refreshed conversation={conversation_id} covered={upto}")
+        except Exception as exc:
+            print(f"[context] summary refresh failed conversation={conversation_id}: {exc}")
+
+
+context_builder = ConversationContextBuilder()
@@ -0,0 +1,192 @@
+"""
+Local intent rules in front of the LLM router.
+
+Messages such as "查订单 ORD123" or "转人工" are classified here with keyword
+and order-ID rules, without a Kimi round trip. Everything else goes to
+RouterAgent through an LRU/TTL cache keyed on normalized text.
+"""
+from __future__ import annotations
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import register_metrics
+
+ORDER_ID_PATTERN = re.compile(r"ORD[-_A-Z0-9]{3,}")
+
+TRANSFER_KEYWORDS = [
+    "转人工",
+    "人工客服",
+    "真人客服",
+    "转接人工",
+    "找人工",
+    "找人",
+    "真人",
+    "人工服务",
+]
+
+NEGATIVE_KEYWORDS = [
+    "垃圾",
+    "骗子",
+    "太差",
+    "差劲",
+    "失望",
+    "生气",
+    "愤怒",
+    "投诉",
+    "差评",
+    "举报",
+    "告你",
+    "维权",
+    "无语",
+    "糟糕",
+    "破公司",
+]
+
+# 意图词表：只收录含义明确的词，拿不准的交给 LLM
+INTENT_LEXICON = {
+    "return_request": ["退货", "退款", "退钱", "退掉", "申请退", "不想要了", "return", "refund"],
+    "exchange_request": ["换货", "换一个", "换个尺码", "换尺码", "换颜色", "exchange"],
+    "order_status": ["查订单", "我的订单", "订单状态", "物流", "快递", "发货", "到哪了", "运单", "签收", "配送", "tracking"],
+}
+
+# 否定/犹豫表达会让关键词规则失效
+NEGATION_PATTERN = re.compile(r"(不|别|没|无需|不用|不想|不要)(再)?(退|换|查)")
+
+
+def extract_order_id(text: str) -> Optional[str]:
+    """从用户消息中提取订单号。"""
+    match = ORDER_ID_PATTERN.search(text.upper())
+    if match:
+        return match.group(0)
+    return None
+
+
+def detect_transfer_reason(message: str) -> Optional[str]:
+    text = message.strip()
+    if not text:
+        return None
+
+    if any(keyword in text for keyword in TRANSFER_KEYWORDS):
+        return "用户主动要求转人工"
+
+    exclamations = text.count("!") + text.count("！")
+    if exclamations >= 3 or any(keyword in text for keyword in NEGATIVE_KEYWORDS):
+        return "用户情绪激动或负面"
+
+    return None
+
+
+def normalize_text(text: str) -> str:
+    """Cache key: NFKC (full-width -> half-width), lower case, collapsed whitespace, order IDs masked."""
+    text = unicodedata.normalize("NFKC", text or "").strip()
+    text = ORDER_ID_PATTERN.sub("<order_id>", text.upper()).lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip("。.!！?？~～ ")
+
+
+def classify_locally(message: str) -> Optional[Dict]:
+    """
+    High-confidence rule classification in RouterAgent.analyze_intent format.
+
+    Returns None when the rules are not confident enough; the caller then asks the LLM.
+    """
+    text = unicodedata.normalize("NFKC", message or "").strip()
+    if not text:
+        return None
+
+    transfer_reason = detect_transfer_reason(text)
+    if transfer_reason == "用户主动要求转人工":
+        return _analysis("human_request", 0.95, "neutral", True, transfer_reason)
+    if transfer_reason:
+        return _analysis("complaint", 0.9, "angry", True, transfer_reason)
+
+    if NEGATION_PATTERN.search(text):
+        return None
+
+    lowered = text.lower()
+    matched = [
+        intent
+        for intent, keywords in INTENT_LEXICON.items()
+        if any(keyword in lowered for keyword in keywords)
+    ]
+    order_id = extract_order_id(text)
+
+    if matched == ["return_request"]:
+        return _analysis("return_request", 0.9, "neutral", False, "关键词匹配：退货/退款")
+    if matched == ["exchange_request"]:
+        return _analysis("exchange_request", 0.9, "neutral", False, "关键词匹配：换货")
+    if matched == ["order_status"]:
+        return _analysis("order_status", 0.9, "neutral", False, "关键词匹配：订单/物流查询")
+    if not matched and order_id and len(text) <= len(order_id) + 6:
+        # 只发了一个订单号（可能带"查"之类的短词）
+        return _analysis("order_status", 0.85, "neutral", False, "消息仅包含订单号")
+    return None
+
+
+def _analysis(intent: str, confidence: float, emotion: str, need_human: bool, reason: str) -> Dict:
+    return {
+        "intent": intent,
+        "confidence": confidence,
+        "emotion": emotion,
+        "need_human": need_human,
+        "reason": reason,
+        "source": "rules",
+    }
+
+
+class IntentCache:
+    """Small LRU cache with per-entry TTL for LLM intent classifications."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return dict(value)
+
+    def set(self, key: str, value: Dict) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+intent_cache = IntentCache(settings.intent_cache_size, settings.intent_cache_ttl)
+
+_stats = {"requests": 0, "rules": 0, "cache_hits": 0, "llm": 0}
+
+
+def record_intent_source(source: str) -> None:
+    _stats["requests"] += 1
+    _stats[source] += 1
+
+
+def _metrics() -> Dict:
+    requests = _stats["requests"]
+    return {
+        **_stats,
+        "cache_size": len(intent_cache),
+        "bypass_rate": round(_stats["rules"] / requests, 4) if requests else None,
+        "cache_hit_rate": round(_stats["cache_hits"] / requests, 4) if requests else None,
+        "llm_rate": round(_stats["llm"] / requests, 4) if requests else None,
+    }
+
+
+register_metrics("intent_router", _metrics)
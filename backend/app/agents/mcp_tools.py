@@ -222,3 +222,11 @@ ORDER_AGENT_TOOLS = [
         }
     }
 ]
+
+
+# 只读工具：不产生副作用，可以在流式生成过程中提前执行
+READ_ONLY_TOOLS = {
+    "call_order_department",
+    "call_logistics_department",
+    "transfer_to_human",
+}
@@ -7,22 +7,27 @@ from app.integrations.order import get_order_api
 
 
 class OrderAgent:
-    """Order department helper."""
-
-    def __init__(self, user_id: Optional[str] = None):
-        self.user_id = user_id
-        self.order_api = get_order_api()
-
-    def search_orders(self, order_id: Optional[str] = None, keyword: Optional[str] = None, list_all: bool = False) -> dict:
+    """Order department helper (stateless; the user is passed per call)."""
+
+    def __init__(self, order_api=None):
+        self.order_api = order_api or get_order_api()
+
+    def search_orders(
+        self,
+        order_id: Optional[str] = None,
+        keyword: Optional[str] = None,
+        list_all: bool = False,
+        user_id: Optional[str] = None,
+    ) -> dict:
         """Flexible search: by order_id, by keyword, or list all recent orders."""
         if order_id:
-            return self.get_order_details(order_id)
+            return self.get_order_details(order_id, user_id=user_id)
 
         if keyword:
-            orders = self.order_api.search_orders_by_keyword(keyword, user_id=self.user_id, limit=20)
+            orders = self.order_api.search_orders_by_keyword(keyword, user_id=user_id, limit=20)
         else:
             # default list recent orders
-            orders = self.order_api.list_user_orders(user_id=self.user_id, limit=20 if list_all else 10)
+            orders = self.order_api.list_user_orders(user_id=user_id, limit=20 if list_all else 10)
 
         return {
             "success": True,
@@ -30,8 +35,11 @@ class OrderAgent:
             "total": len(orders),
         }
 
-    def get_order_details(self, order_id: str) -> dict:
-        order = self.order_api.get_order(order_id, user_id=self.user_id)
+    def get_order_details(self, order_id: str, user_id: Optional[str] = None) -> dict:
+        return self.format_order_details(order_id, self.order_api.get_order(order_id, user_id=user_id))
+
+    def format_order_details(self, order_id: str, order: Optional[Dict]) -> dict:
+        """Build the get_order_details result from an already loaded order row (None = not found)."""
         if not order:
             return {
                 "success": False,
@@ -48,8 +56,10 @@ class OrderAgent:
             "total": 1,
         }
 
-    def get_logistics_info(self, order_id: str) -> dict:
-        logistics = self.order_api.get_logistics(order_id, user_id=self.user_id)
+    def get_logistics_info(self, order_id: str, user_id: Optional[str] = None) -> dict:
+        return self.format_logistics(order_id, self.order_api.get_logistics(order_id, user_id=user_id))
+
+    def format_logistics(self, order_id: str, logistics: Optional[Dict]) -> dict:
         if not logistics:
             return {
                 "success": False,
@@ -0,0 +1,97 @@
+"""
+Speculative order prefetch.
+
+When the user's message names an order (ORD...), the order-related tools are
+almost certain to follow. The order (with items) and its latest return are
+fetched on the tool pool while the first LLM call is still in flight; the
+order, logistics and return tools then take the prefetched rows instead of
+querying again. Prefetches that no tool ends up using are counted as waste.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.agents.intent import extract_order_id
+from app.core.executors import run_blocking
+from app.core.metrics import register_metrics
+
+_stats = {"started": 0, "used": 0, "wasted": 0, "hits": 0, "misses": 0, "errors": 0, "saved_ms": 0.0}
+
+
+class OrderPrefetch:
+    """Lookups for one order, started ahead of the tool call that will need them."""
+
+    def __init__(self, order_id: str, user_id: Optional[str], order_api, repo):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.started_at = time.perf_counter()
+        self.used = False
+        self._tasks: Dict[str, asyncio.Task] = {
+            "order": asyncio.create_task(run_blocking(order_api.get_order, order_id, user_id=user_id)),
+        }
+        if user_id and repo is not None:
+            self._tasks["latest_return"] = asyncio.create_task(
+                run_blocking(repo.get_latest_return, user_id, order_id)
+            )
+        self._finished_at: Dict[str, float] = {}
+        for kind, task in self._tasks.items():
+            task.add_done_callback(lambda _, kind=kind: self._finished_at.setdefault(kind, time.perf_counter()))
+        _stats["started"] += 1
+
+    def matches(self, order_id: Optional[str]) -> bool:
+        return bool(order_id) and order_id.strip().upper() == self.order_id
+
+    async def take(self, kind: str, order_id: Optional[str]) -> Tuple[bool, Any]:
+        """(True, value) when the prefetch covers this lookup, else (False, None) and the caller queries itself."""
+        task = self._tasks.get(kind)
+        if task is None or not self.matches(order_id):
+            _stats["misses"] += 1
+            return False, None
+        requested_at = time.perf_counter()
+        try:
+            value = await asyncio.shield(task)
+        except Exception as exc:
+            _stats["errors"] += 1
+            print(f"[prefetch] {kind} lookup for {self.order_id} failed, falling back: {exc}")
+            return False, None
+        _stats["hits"] += 1
+        self.used = True
+        # 节省的时间 = 查询与 LLM 调用重叠的部分
+        overlap_end = min(requested_at, self._finished_at.get(kind, requested_at))
+        _stats["saved_ms"] += (overlap_end - self.started_at) * 1000
+        return True, value
+
+    def finish(self) -> None:
+        """End of turn: account waste and make sure no task exception goes unobserved."""
+        if self.used:
+            _stats["used"] += 1
+        else:
+            _stats["wasted"] += 1
+        for task in self._tasks.values():
+            if task.done():
+                if not task.cancelled():
+                    task.exception()
+            else:
+                task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+def start_order_prefetch(message: Optional[str], user_id: Optional[str], order_api, repo) -> Optional[OrderPrefetch]:
+    order_id = extract_order_id(message or "")
+    if not order_id:
+        return None
+    return OrderPrefetch(order_id, user_id, order_api, repo)
+
+
+def _metrics() -> Dict[str, Any]:
+    started = _stats["started"]
+    return {
+        **_stats,
+        "saved_ms": round(_stats["saved_ms"], 1),
+        "hit_rate": round(_stats["used"] / started, 4) if started else None,
+        "waste_rate": round(_stats["wasted"] / started, 4) if started else None,
+    }
+
+
+register_metrics("order_prefetch", _metrics)
@@ -3,41 +3,117 @@ Q&A Agent - front desk support.
 完全依赖 AI 调用 tool_calls，无任何后备逻辑
 """
 
+import asyncio
 import json
-from typing import Dict, List, Optional, Any
+import time
+import uuid
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-import httpx
-
-from app.agents.mcp_tools import QA_AGENT_TOOLS
+from app.agents.context import trim_to_budget
+from app.agents.mcp_tools import QA_AGENT_TOOLS, READ_ONLY_TOOLS
 from app.agents.order_agent import OrderAgent
+from app.agents.prefetch import OrderPrefetch, start_order_prefetch
 from app.agents.return_planner import ReturnPlannerAgent
 from app.db.repo import Repository
 from app.core.config import settings
+from app.core.executors import get_tool_executor, run_blocking
 from app.core.prompts import QA_AGENT_PROMPT
+from app.llm.kimi import ToolCallAssembler, iter_chat_chunks
+from app.llm.models import ModelChoice, model_selector
+from app.llm.resilience import llm_policy
+from app.llm.transport import get_llm_transport
+from app.llm.usage import LLMCall
+
+
+@lru_cache(maxsize=4096)
+def render_qa_prompt(user_id: Optional[str]) -> str:
+    return QA_AGENT_PROMPT.replace("{{USER_ID}}", user_id or "用户")
+
+
+@dataclass(frozen=True)
+class AgentRequestContext:
+    """Per-request state for the (shared, stateless) agents."""
+
+    user_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    # 本轮的订单预取（见 app/agents/prefetch.py），不参与比较/哈希
+    prefetch: Optional[OrderPrefetch] = field(default=None, compare=False)
+
+    @property
+    def system_prompt(self) -> str:
+        return render_qa_prompt(self.user_id)
+
+
+def _log_detached_tool(tool_name: str, task: "asyncio.Future") -> None:
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        print(f"[QA Agent] background {tool_name} failed: {exc}")
+    else:
+        print(f"[QA Agent] background {tool_name} finished")
 
 
 class QAAgent:
-    """Front desk agent that can call internal tools."""
+    """
+    Front desk agent that can call internal tools.
+
+    One instance serves all requests (see app/agents/services.py); the user and
+    conversation come in through an AgentRequestContext on every call.
+    """
 
-    def __init__(self, user_id: Optional[str] = None, repo: Optional["Repository"] = None):
-        self.api_key = settings.kimi_api_key
-        self.api_base = "https://api.moonshot.cn/v1"
-        self.user_id = user_id
-        self.prompt = QA_AGENT_PROMPT.replace("{{USER_ID}}", user_id or "用户")
-        self.return_planner = ReturnPlannerAgent(user_id=user_id, repo=repo)
-        self.order_agent = OrderAgent(user_id=user_id)
+    def __init__(
+        self,
+        return_planner: Optional[ReturnPlannerAgent] = None,
+        order_agent: Optional[OrderAgent] = None,
+        repo: Optional["Repository"] = None,
+    ):
+        self.api_base = settings.kimi_api_base.rstrip("/")
+        self.return_planner = return_planner or ReturnPlannerAgent(repo=repo)
+        self.repo = repo or self.return_planner.repo
+        self.order_agent = order_agent or OrderAgent()
+
+    def _start_prefetch(self, ctx: AgentRequestContext, messages: List[Dict[str, str]]) -> AgentRequestContext:
+        """Kick off order lookups for an order id in the latest user message, overlapping the first LLM call."""
+        if ctx.prefetch is not None:
+            return ctx
+        last_user = next((m for m in reversed(messages) if m.get("role") == "user"), None)
+        if not last_user:
+            return ctx
+        prefetch = start_order_prefetch(
+            last_user.get("content"), ctx.user_id, self.order_agent.order_api, self.repo
+        )
+        return replace(ctx, prefetch=prefetch) if prefetch else ctx
 
-    async def chat(self, messages: List[Dict[str, str]], max_retries: int = 3) -> Dict:
+    async def chat(
+        self,
+        ctx: AgentRequestContext,
+        messages: List[Dict[str, str]],
+        max_retries: Optional[int] = None,
+    ) -> Dict:
         """Chat with Kimi and optionally call tools."""
+        ctx = self._start_prefetch(ctx, messages)
+        try:
+            return await self._chat(ctx, messages, max_retries)
+        finally:
+            if ctx.prefetch is not None:
+                ctx.prefetch.finish()
+
+    async def _chat(
+        self,
+        ctx: AgentRequestContext,
+        messages: List[Dict[str, str]],
+        max_retries: Optional[int] = None,
+    ) -> Dict:
         system_message = {
             "role": "system",
-            "content": self.prompt,
+            "content": ctx.system_prompt,
         }
 
-        max_messages = 30
-        if len(messages) > max_messages:
-            messages = messages[-max_messages:]
-            print(f"[QA Agent] message count > {max_messages}; trimming to latest {max_messages}")
+        # 调用方通常已用 context_builder 压缩过历史；这里只兜底按 token 预算截断
+        messages = trim_to_budget(messages)
 
         print(f"[QA Agent] sending request to Kimi, count={len(messages)}")
         
@@ -48,74 +124,40 @@ class QAAgent:
             content = msg.get("content", "")[:50]
             print(f"  [{i}] {role}: {content}...")
 
-        last_error: Optional[Exception] = None
-        response = None
-        for attempt in range(max_retries + 1):
-            try:
-                request_data = {
-                    "model": "moonshot-v1-128k",
-                    "messages": [system_message] + messages,
-                    "tools": QA_AGENT_TOOLS,
-                    "tool_choice": "auto",
-                    "temperature": 0.3,
-                }
-                
-                print(f"[QA Agent] Tools count: {len(QA_AGENT_TOOLS)}")
-                print(f"[QA Agent] Tool names: {[t['function']['name'] for t in QA_AGENT_TOOLS]}")
-                
-                if messages:
-                    last_msg = messages[-1] if messages[-1].get("role") == "user" else None
-                    if last_msg:
-                        print(f"[QA Agent] Last user message: {last_msg.get('content', '')[:100]}")
-
-                # 创建 httpx 客户端，增加更长的超时时间和禁用 SSL 验证（如果需要）
-                async with httpx.AsyncClient(
-                    timeout=httpx.Timeout(120.0, connect=60.0),
-                    verify=settings.kimi_verify_ssl,  # 可通过环境变量 KIMI_VERIFY_SSL=false 禁用
-                    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-                ) as client:
-                    response = await client.post(
-                        f"{self.api_base}/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json",
-                        },
-                        json=request_data,
-                    )
+        # 按 prompt 大小选模型：短对话走小上下文模型，长对话才用 128k
+        model_choice = model_selector.select([system_message] + messages, QA_AGENT_TOOLS)
+        request_data = {
+            "model": model_choice.model,
+            "messages": [system_message] + messages,
+            "tools": QA_AGENT_TOOLS,
+            "tool_choice": "auto",
+            "temperature": 0.3,
+        }
+
+        print(f"[QA Agent] Tools count: {len(QA_AGENT_TOOLS)}")
+        print(f"[QA Agent] Tool names: {[t['function']['name'] for t in QA_AGENT_TOOLS]}")
+
+        if messages:
+            last_msg = messages[-1] if messages[-1].get("role") == "user" else None
+            if last_msg:
+                print(f"[QA Agent] Last user message: {last_msg.get('content', '')[:100]}")
+
+        llm_call = LLMCall("qa.tools", model_choice.model, choice=model_choice)
+        try:
+            # 共享连接池（见 app/llm/transport.py）；重试/对冲/熔断/截止时间见 app/llm/resilience.py
+            result = await llm_policy.call(
+                lambda timeout: get_llm_transport().post_json(
+                    f"{self.api_base}/chat/completions", request_data, timeout=timeout
+                ),
+                "qa.tools",
+                llm_call=llm_call,
+                max_attempts=max_retries + 1 if max_retries is not None else None,
+            )
+        except Exception as exc:
+            llm_call.finish(error=exc)
+            raise
+        llm_call.finish(result)
 
-                print(f"[QA Agent] Kimi status {response.status_code}")
-                response.raise_for_status()
-                break
-            except httpx.ConnectError as exc:
-                last_error = exc
-                if attempt < max_retries:
-                    wait_time = 2 ** attempt  # 指数退避：1s, 2s, 4s
-                    print(f"[QA Agent] 网络连接失败，{wait_time}秒后重试 {attempt + 1}/{max_retries}: {exc}")
-                    import asyncio
-                    await asyncio.sleep(wait_time)
-                else:
-                    print(f"[QA Agent] 网络连接失败，已达最大重试次数: {exc}")
-                    raise Exception(f"无法连接到 Kimi API，请检查网络连接: {str(exc)}")
-            except httpx.TimeoutException as exc:
-                last_error = exc
-                if attempt < max_retries:
-                    print(f"[QA Agent] 请求超时，重试 {attempt + 1}/{max_retries}")
-                    import asyncio
-                    await asyncio.sleep(2)
-                else:
-                    print(f"[QA Agent] 请求超时，已达最大重试次数")
-                    raise Exception(f"Kimi API 请求超时: {str(exc)}")
-            except Exception as exc:
-                last_error = exc
-                if attempt < max_retries:
-                    print(f"[QA Agent] 请求失败，重试 {attempt + 1}/{max_retries}: {exc}")
-                    import asyncio
-                    await asyncio.sleep(1)
-                else:
-                    print(f"[QA Agent] 请求失败: {exc}")
-                    raise last_error
-
-        result = response.json()
         finish_reason = result["choices"][0]["finish_reason"]
         print(f"[QA Agent] Kimi finish_reason={finish_reason}")
 
@@ -127,8 +169,9 @@ class QAAgent:
         if tool_calls:
             print(f"[QA Agent] ✅ TOOL CALLS: {[t['function']['name'] for t in tool_calls]}")
 
-            tool_results, tool_data = await self._execute_tools(tool_calls)
+            tool_results, tool_data = await self._execute_tools(ctx, tool_calls)
             final_response = await self._get_final_response(
+                ctx,
                 messages=messages,
                 assistant_message=assistant_message,
                 tool_results=tool_results,
@@ -152,69 +195,335 @@ class QAAgent:
             "finish_reason": finish_reason,
         }
 
-    async def _execute_tools(self, tool_calls: List[Dict]) -> tuple[List[Dict], Dict[str, Any]]:
-        """Execute tool calls and return tool messages and structured data."""
+    async def chat_stream(
+        self,
+        ctx: AgentRequestContext,
+        messages: List[Dict[str, str]],
+        max_retries: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Streaming variant of chat().
+
+        Yields events as they happen:
+          {"type": "content", "data": "..."}    text delta from Kimi
+          {"type": "tool_data", "data": {...}}  structured tool results, before the final answer text
+          {"type": "done", "message": ..., "tool_calls": ..., "tool_data": ..., "finish_reason": ...}
+        """
+        ctx = self._start_prefetch(ctx, messages)
+        try:
+            async for event in self._chat_stream(ctx, messages, max_retries):
+                yield event
+        finally:
+            if ctx.prefetch is not None:
+                ctx.prefetch.finish()
+
+    async def _chat_stream(
+        self,
+        ctx: AgentRequestContext,
+        messages: List[Dict[str, str]],
+        max_retries: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        system_message = {
+            "role": "system",
+            "content": ctx.system_prompt,
+        }
+
+        messages = trim_to_budget(messages)
+
+        model_choice = model_selector.select([system_message] + messages, QA_AGENT_TOOLS)
+        request_data = {
+            "model": model_choice.model,
+            "messages": [system_message] + messages,
+            "tools": QA_AGENT_TOOLS,
+            "tool_choice": "auto",
+            "temperature": 0.3,
+            "stream": True,
+        }
+
+        content = ""
+        assembler = ToolCallAssembler()
+        # 本轮所有工具（提前执行的和流结束后执行的）共用一个并发上限
+        tool_semaphore = self._tool_semaphore()
+        early_tasks: Dict[str, asyncio.Task] = {}
+        finish_reason = None
+        try:
+            async for chunk in self._stream_completion(
+                request_data, max_retries=max_retries, call_site="qa.tools.stream", choice=model_choice
+            ):
+                delta_choice = (chunk.get("choices") or [{}])[0]
+                delta = delta_choice.get("delta") or {}
+                if delta.get("content"):
+                    content += delta["content"]
+                    yield {"type": "content", "data": delta["content"]}
+                # 只读工具的参数一完整就开始执行，与剩余生成并行
+                for call in assembler.feed(delta.get("tool_calls")):
+                    if call["function"]["name"] in READ_ONLY_TOOLS:
+                        early_tasks[call["id"]] = asyncio.create_task(self._run_tool(ctx, call, tool_semaphore))
+                if delta_choice.get("finish_reason"):
+                    finish_reason = delta_choice["finish_reason"]
+            assembler.finish()
+        except BaseException:
+            for task in early_tasks.values():
+                task.cancel()
+            raise
+
+        tool_calls = assembler.tool_calls
+        print(f"[QA Agent] stream finish_reason={finish_reason}")
+
+        if not tool_calls:
+            yield {
+                "type": "done",
+                "message": content,
+                "tool_calls": None,
+                "tool_data": {},
+                "finish_reason": finish_reason,
+            }
+            return
+
+        print(f"[QA Agent] ✅ TOOL CALLS: {[t['function']['name'] for t in tool_calls]}")
+        tool_results, tool_data = await self._execute_tools(ctx, tool_calls, tool_semaphore, early_tasks)
+        yield {"type": "tool_data", "data": tool_data}
+
+        assistant_message = {"role": "assistant", "content": content, "tool_calls": tool_calls}
+        final_text = ""
+        async for piece in self._stream_final_response(ctx, messages, assistant_message, tool_results):
+            final_text += piece
+            yield {"type": "content", "data": piece}
+
+        yield {
+            "type": "done",
+            "message": content + final_text,
+            "tool_calls": tool_calls,
+            "tool_results": tool_results,
+            "tool_data": tool_data,
+            "finish_reason": "stop",
+        }
+
+    async def _stream_completion(
+        self,
+        request_data: Dict,
+        max_retries: Optional[int] = None,
+        call_site: str = "qa.stream",
+        choice: Optional[ModelChoice] = None,
+    ) -> AsyncIterator[Dict]:
+        """Stream raw chunks; retries and hedging only happen before the first chunk (see llm_policy.stream)."""
+        llm_call = LLMCall(call_site, request_data["model"], stream=True, choice=choice)
+        try:
+            chunks = llm_policy.stream(
+                lambda timeout: iter_chat_chunks(
+                    f"{self.api_base}/chat/completions",
+                    request_data,
+                    timeout=timeout,
+                    llm_call=llm_call,
+                ),
+                call_site,
+                llm_call=llm_call,
+                max_attempts=max_retries + 1 if max_retries is not None else None,
+            )
+            async for chunk in chunks:
+                yield chunk
+        except BaseException as exc:
+            llm_call.finish(error=exc)
+            raise
+        llm_call.finish()
+
+    @staticmethod
+    def _tool_semaphore() -> asyncio.Semaphore:
+        return asyncio.Semaphore(max(1, settings.agent_tool_concurrency))
+
+    async def _run_tool(
+        self,
+        ctx: AgentRequestContext,
+        tool_call: Dict,
+        semaphore: asyncio.Semaphore,
+    ) -> tuple[Dict, Dict[str, Any], Dict[str, Any]]:
+        async with semaphore:
+            return await self._execute_tool(ctx, tool_call)
+
+    async def _execute_tools(
+        self,
+        ctx: AgentRequestContext,
+        tool_calls: List[Dict],
+        semaphore: Optional[asyncio.Semaphore] = None,
+        early_tasks: Optional[Dict[str, "asyncio.Task"]] = None,
+    ) -> tuple[List[Dict], Dict[str, Any]]:
+        """
+        Execute tool calls concurrently and return tool messages and structured data.
+
+        At most AGENT_TOOL_CONCURRENCY tools run at once per turn: calls already
+        started from the stream (early_tasks, keyed by tool_call_id) share the
+        same semaphore and are awaited here, so the turn's timings are logged as
+        one batch. Results keep the order of tool_calls so every tool_call_id
+        lines up with the assistant message.
+        """
+        semaphore = semaphore or self._tool_semaphore()
+        early_tasks = early_tasks or {}
+        outcomes = await asyncio.gather(
+            *(
+                early_tasks[tool_call["id"]] if tool_call["id"] in early_tasks else self._run_tool(ctx, tool_call, semaphore)
+                for tool_call in tool_calls
+            )
+        )
+
         results: List[Dict] = []
         tool_data: Dict[str, Any] = {}  # 用于存储结构化数据，前端可以渲染卡片
+        timings: List[Dict[str, Any]] = []
+        for tool_call, (result, data, timing) in zip(tool_calls, outcomes):
+            tool_data.update(data)
+            timings.append(timing)
+            results.append({
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "name": tool_call["function"]["name"],
+                "content": json.dumps(result, ensure_ascii=False),
+            })
 
-        for tool_call in tool_calls:
-            tool_name = tool_call["function"]["name"]
-            tool_args_str = tool_call["function"]["arguments"]
-            tool_id = tool_call["id"]
-            
-            try:
-                tool_args = json.loads(tool_args_str) if tool_args_str else {}
-            except json.JSONDecodeError:
-                tool_args = {}
-            
-            print(f"[QA Agent] Executing tool: {tool_name}, args: {tool_args}")
-
-            if tool_name == "call_return_department":
-                result = await self.return_planner.handle_return_request(
-                    order_id=tool_args.get("order_id"),
-                    reason=tool_args.get("reason", "user_requested"),
-                )
-                tool_data["return_result"] = result
-                if result.get("action") == "transfer_to_human" or result.get("need_human"):
-                    tool_data["transfer"] = {
-                        "transferred": True,
-                        "reason": result.get("reason") or result.get("message") or "AI无法处理退款",
-                        "message": "需要人工客服继续处理退款问题。",
-                    }
-            elif tool_name == "call_order_department":
-                result = self.order_agent.search_orders(
-                    order_id=tool_args.get("order_id"),
+        self._log_tool_timings(ctx, timings)
+        return results, tool_data
+
+    async def _execute_tool(
+        self,
+        ctx: AgentRequestContext,
+        tool_call: Dict,
+    ) -> tuple[Dict, Dict[str, Any], Dict[str, Any]]:
+        """Run one tool under the per-tool timeout; returns (result, tool_data, timing)."""
+        tool_name = tool_call["function"]["name"]
+        tool_args_str = tool_call["function"]["arguments"]
+
+        try:
+            tool_args = json.loads(tool_args_str) if tool_args_str else {}
+        except json.JSONDecodeError:
+            tool_args = {}
+
+        print(f"[QA Agent] Executing tool: {tool_name}, args: {tool_args}")
+
+        work = self._dispatch_tool(ctx, tool_name, tool_args)
+        detached = None
+        if tool_name not in READ_ONLY_TOOLS:
+            # 退款等有副作用的工具超时或客户端断开后继续在后台完成，不能被中途取消
+            detached = asyncio.ensure_future(work)
+            work = asyncio.shield(detached)
+
+        started = time.perf_counter()
+        status = "ok"
+        tool_data: Dict[str, Any] = {}
+        try:
+            result, tool_data = await asyncio.wait_for(work, timeout=settings.agent_tool_timeout)
+        except asyncio.TimeoutError:
+            status = "timeout"
+            result = {"error": f"Tool {tool_name} timed out after {settings.agent_tool_timeout:.0f}s"}
+            if detached is not None and not detached.done():
+                print(f"[QA Agent] {tool_name} timed out, letting it finish in the background")
+                detached.add_done_callback(lambda task, name=tool_name: _log_detached_tool(name, task))
+        except asyncio.CancelledError:
+            if detached is not None and not detached.done():
+                print(f"[QA Agent] turn cancelled, letting {tool_name} finish in the background")
+                detached.add_done_callback(lambda task, name=tool_name: _log_detached_tool(name, task))
+            raise
+        except Exception as exc:
+            status = "error"
+            result = {"error": f"Tool {tool_name} failed: {exc}"}
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        print(f"[QA Agent] Tool {tool_name} ({status}, {duration_ms}ms) result: {str(result)[:200]}...")
+
+        timing = {
+            "tool": tool_name,
+            "tool_call_id": tool_call["id"],
+            "status": status,
+            "duration_ms": duration_ms,
+        }
+        return result, tool_data, timing
+
+    async def _dispatch_tool(
+        self,
+        ctx: AgentRequestContext,
+        tool_name: str,
+        tool_args: Dict[str, Any],
+    ) -> tuple[Dict, Dict[str, Any]]:
+        tool_data: Dict[str, Any] = {}
+        if tool_name == "call_return_department":
+            result = await self.return_planner.handle_return_request(
+                order_id=tool_args.get("order_id"),
+                reason=tool_args.get("reason", "user_requested"),
+                user_id=ctx.user_id,
+                prefetch=ctx.prefetch,
+            )
+            tool_data["return_result"] = result
+            if result.get("action") == "transfer_to_human" or result.get("need_human"):
+                tool_data["transfer"] = {
+                    "transferred": True,
+                    "reason": result.get("reason") or result.get("message") or "AI无法处理退款",
+                    "message": "需要人工客服继续处理退款问题。",
+                }
+        elif tool_name == "call_order_department":
+            order_id = tool_args.get("order_id")
+            hit, order = await self._take_prefetched(ctx, "order", order_id)
+            if hit:
+                result = self.order_agent.format_order_details(order_id, order)
+            else:
+                result = await run_blocking(
+                    self.order_agent.search_orders,
+                    order_id=order_id,
                     keyword=tool_args.get("keyword"),
                     list_all=tool_args.get("list_all", True),
+                    user_id=ctx.user_id,
                 )
-                # 保存订单数据用于卡片展示
-                tool_data["orders"] = result.get("orders", [])
-            elif tool_name == "call_logistics_department":
-                result = self.order_agent.get_logistics_info(order_id=tool_args.get("order_id"))
-                tool_data["logistics"] = result
-            elif tool_name == "transfer_to_human":
-                result = {
-                    "transferred": True,
-                    "reason": tool_args.get("reason", "user_requested"),
-                    "message": "Connecting to a human agent.",
-                }
-                tool_data["transfer"] = result
+            # 保存订单数据用于卡片展示
+            tool_data["orders"] = result.get("orders", [])
+        elif tool_name == "call_logistics_department":
+            order_id = tool_args.get("order_id")
+            hit, order = await self._take_prefetched(ctx, "order", order_id)
+            if hit:
+                logistics = self.order_agent.order_api.logistics_from_order(order)
+                result = self.order_agent.format_logistics(order_id, logistics)
             else:
-                result = {"error": f"Unknown tool: {tool_name}"}
-            
-            print(f"[QA Agent] Tool {tool_name} result: {str(result)[:200]}...")
+                result = await run_blocking(
+                    self.order_agent.get_logistics_info,
+                    order_id=order_id,
+                    user_id=ctx.user_id,
+                )
+            tool_data["logistics"] = result
+        elif tool_name == "transfer_to_human":
+            result = {
+                "transferred": True,
+                "reason": tool_args.get("reason", "user_requested"),
+                "message": "Connecting to a human agent.",
+            }
+            tool_data["transfer"] = result
+        else:
+            result = {"error": f"Unknown tool: {tool_name}"}
+        return result, tool_data
 
-            results.append({
-                "role": "tool",
-                "tool_call_id": tool_id,
-                "name": tool_name,
-                "content": json.dumps(result, ensure_ascii=False),
-            })
+    async def _take_prefetched(self, ctx: AgentRequestContext, kind: str, order_id: Optional[str]) -> tuple[bool, Any]:
+        if ctx.prefetch is None or not order_id:
+            return False, None
+        return await ctx.prefetch.take(kind, order_id)
 
-        return results, tool_data
+    def _log_tool_timings(self, ctx: AgentRequestContext, timings: List[Dict[str, Any]]) -> None:
+        """Record per-tool timings in agent_events without blocking the turn."""
+        if not timings or not ctx.user_id or not self.repo:
+            return
+        trace_id = str(uuid.uuid4())
+
+        def write() -> None:
+            for timing in timings:
+                try:
+                    self.repo.log_event(
+                        trace_id=trace_id,
+                        event_type="TOOL_TIMING",
+                        payload={**timing, "batch_size": len(timings)},
+                        conversation_id=ctx.conversation_id,
+                        user_id=ctx.user_id,
+                    )
+                except Exception as exc:
+                    print(f"[QA Agent] failed to log tool timing: {exc}")
+
+        get_tool_executor().submit(write)
 
     async def _get_final_response(
         self,
+        ctx: AgentRequestContext,
         messages: List[Dict],
         assistant_message: Dict,
         tool_results: List[Dict],
@@ -222,66 +531,56 @@ class QAAgent:
         """Send tool results back to the model to get a final reply."""
         system_message = {
             "role": "system",
-            "content": self.prompt,
+            "content": ctx.system_prompt,
         }
 
         new_messages = [system_message] + messages + [assistant_message] + tool_results
         
         print(f"[QA Agent] Sending tool results back to Kimi, tool count: {len(tool_results)}")
 
-        # 增加重试机制
-        max_retries = 3
-        last_error = None
-        
-        for attempt in range(max_retries):
-            try:
-                async with httpx.AsyncClient(
-                    timeout=httpx.Timeout(120.0, connect=60.0),
-                    verify=settings.kimi_verify_ssl,
-                    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-                ) as client:
-                    response = await client.post(
-                        f"{self.api_base}/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json",
-                        },
-                        json={
-                            "model": "moonshot-v1-128k",
-                            "messages": new_messages,
-                            "temperature": 0.3,
-                        },
-                    )
+        choice = model_selector.select(new_messages)
+        llm_call = LLMCall("qa.final", choice.model, choice=choice)
+        try:
+            result = await llm_policy.call(
+                lambda timeout: get_llm_transport().post_json(
+                    f"{self.api_base}/chat/completions",
+                    {
+                        "model": choice.model,
+                        "messages": new_messages,
+                        "temperature": 0.3,
+                    },
+                    timeout=timeout,
+                ),
+                "qa.final",
+                llm_call=llm_call,
+            )
+        except Exception as exc:
+            llm_call.finish(error=exc)
+            raise
+        llm_call.finish(result)
+        return result["choices"][0]["message"]["content"]
 
-                    response.raise_for_status()
-                    result = response.json()
-                    return result["choices"][0]["message"]["content"]
-                    
-            except httpx.ConnectError as exc:
-                last_error = exc
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    print(f"[QA Agent] _get_final_response 连接失败，{wait_time}秒后重试 {attempt + 1}/{max_retries}: {exc}")
-                    import asyncio
-                    await asyncio.sleep(wait_time)
-                else:
-                    print(f"[QA Agent] _get_final_response 连接失败，已达最大重试次数")
-                    raise Exception(f"无法连接到 Kimi API: {str(exc)}")
-            except httpx.TimeoutException as exc:
-                last_error = exc
-                if attempt < max_retries - 1:
-                    print(f"[QA Agent] _get_final_response 超时，重试 {attempt + 1}/{max_retries}")
-                    import asyncio
-                    await asyncio.sleep(2)
-                else:
-                    raise Exception(f"Kimi API 请求超时: {str(exc)}")
-            except Exception as exc:
-                last_error = exc
-                if attempt < max_retries - 1:
-                    print(f"[QA Agent] _get_final_response 失败，重试 {attempt + 1}/{max_retries}: {exc}")
-                    import asyncio
-                    await asyncio.sleep(1)
-                else:
-                    raise last_error
-        
-        raise Exception(f"_get_final_response 失败: {str(last_error)}")
+    async def _stream_final_response(
+        self,
+        ctx: AgentRequestContext,
+        messages: List[Dict],
+        assistant_message: Dict,
+        tool_results: List[Dict],
+    ) -> AsyncIterator[str]:
+        """Streaming variant of _get_final_response(): yields text deltas."""
+        system_message = {
+            "role": "system",
+            "content": ctx.system_prompt,
+        }
+        new_messages = [system_message] + messages + [assistant_message] + tool_results
+        choice = model_selector.select(new_messages)
+        request_data = {
+            "model": choice.model,
+            "messages": new_messages,
+            "temperature": 0.3,
+            "stream": True,
+        }
+        async for chunk in self._stream_completion(request_data, call_site="qa.final", choice=choice):
+            delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+            if delta.get("content"):
+                yield delta["content"]
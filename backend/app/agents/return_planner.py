@@ -1,34 +1,44 @@
 ﻿from __future__ import annotations
 
 from datetime import datetime, timezone
-from typing import Optional
-import re
+from typing import Any, Dict, Optional
 import random
 import time
 
+from app.core.executors import run_blocking
 from app.db.repo import Repository
 from app.integrations.alipay import get_alipay_client
 from app.rag import bailian
+from app.rag.policy_snapshot import extract_auto_refund_threshold, return_policy_snapshot
 from app.integrations.order import get_order_api
 
 
 class ReturnPlannerAgent:
-    """Return policy helper."""
+    """Return policy helper (stateless; the user is passed per call)."""
 
     def __init__(
         self,
-        user_id: Optional[str] = None,
         repo: Optional[Repository] = None,
+        order_api=None,
+        alipay_client=None,
         rag_client=bailian,
     ):
-        self.user_id = user_id
-        self.order_api = get_order_api()
+        self.order_api = order_api or get_order_api()
         self.repo = repo or Repository.from_env()
-        self.alipay_client = get_alipay_client(use_mock=False)
+        self.alipay_client = alipay_client or get_alipay_client(use_mock=False)
         self.rag = rag_client
 
-    def check_return_policy(self, order_id: str) -> dict:
-        policy_hits = self.rag.search_policies("return policy, refund threshold")
+    async def check_return_policy(
+        self,
+        order_id: str,
+        user_id: Optional[str] = None,
+        prefetched: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        """prefetched may carry "order" and/or "latest_return" rows already loaded by OrderPrefetch."""
+        prefetched = prefetched or {}
+        # 退货期和退款门槛来自编译好的政策快照（知识库变化时才重建），不再每次检索
+        policy = await return_policy_snapshot.get()
+        policy_hits = policy.policy_hits
         if not policy_hits:
             return {
                 "eligible": False,
@@ -38,7 +48,10 @@ class ReturnPlannerAgent:
                 "policy_hits": [],
             }
 
-        order = self.order_api.get_order(order_id, user_id=self.user_id)
+        if "order" in prefetched:
+            order = prefetched["order"]
+        else:
+            order = await run_blocking(self.order_api.get_order, order_id, user_id=user_id)
         if not order:
             return {
                 "eligible": False,
@@ -47,9 +60,12 @@ class ReturnPlannerAgent:
                 "policy_hits": policy_hits,
             }
 
-        effective_user_id = self.user_id or order.get("user_id")
+        effective_user_id = user_id or order.get("user_id")
         if effective_user_id:
-            latest_return = self.repo.get_latest_return(effective_user_id, order_id)
+            if "latest_return" in prefetched and effective_user_id == user_id:
+                latest_return = prefetched["latest_return"]
+            else:
+                latest_return = await run_blocking(self.repo.get_latest_return, effective_user_id, order_id)
             if latest_return:
                 refund_status = (latest_return.get("refund_status") or "").lower()
                 status = (latest_return.get("status") or "").lower()
@@ -83,7 +99,7 @@ class ReturnPlannerAgent:
             }
 
         days_since = (datetime.now(timezone.utc) - created_dt).days
-        if days_since > 30:
+        if days_since > policy.return_window_days:
             return {
                 "eligible": False,
                 "reason": f"Return window expired ({days_since} days)",
@@ -94,7 +110,7 @@ class ReturnPlannerAgent:
 
         amount_cents = order.get("paid_amount") or 0
         amount_major = amount_cents / 100 if amount_cents else 0
-        threshold = self._extract_auto_refund_threshold(policy_hits) or 200.0
+        threshold = policy.auto_refund_threshold or 200.0
         if amount_major > threshold:
             return {
                 "eligible": True,
@@ -124,8 +140,20 @@ class ReturnPlannerAgent:
         today = datetime.now().strftime("%Y%m%d")
         return f"RMA{today}{random.randint(100, 999)}"
 
-    async def handle_return_request(self, order_id: str, reason: str = "user_requested") -> dict:
-        policy_check = self.check_return_policy(order_id)
+    async def handle_return_request(
+        self,
+        order_id: str,
+        reason: str = "user_requested",
+        user_id: Optional[str] = None,
+        prefetch=None,
+    ) -> dict:
+        prefetched: Dict[str, Any] = {}
+        if prefetch is not None:
+            for kind in ("order", "latest_return"):
+                hit, value = await prefetch.take(kind, order_id)
+                if hit:
+                    prefetched[kind] = value
+        policy_check = await self.check_return_policy(order_id, user_id=user_id, prefetched=prefetched)
         print(f"[return_planner] policy_hits={policy_check.get('policy_hits', [])}")
         if not policy_check.get("eligible"):
             if policy_check.get("already_refunded"):
@@ -137,11 +165,12 @@ class ReturnPlannerAgent:
                     "policy_hits": policy_check.get("policy_hits", []),
                 }
             order = policy_check.get("order") or {}
-            effective_user_id = self.user_id or order.get("user_id")
+            effective_user_id = user_id or order.get("user_id")
             amount_cents = order.get("paid_amount") or 0
             reason = policy_check.get("reason") or ""
             if effective_user_id:
-                self.repo.create_return(
+                await run_blocking(
+                    self.repo.create_return,
                     user_id=effective_user_id,
                     order_id=order_id,
                     sku="",
@@ -168,13 +197,14 @@ class ReturnPlannerAgent:
             }
 
         order = policy_check.get("order") or {}
-        effective_user_id = self.user_id or order.get("user_id")
+        effective_user_id = user_id or order.get("user_id")
         amount_cents = order.get("paid_amount") or 0
         amount_major = amount_cents / 100 if amount_cents else 0
 
         if policy_check.get("need_approval"):
             if effective_user_id:
-                self.repo.create_return(
+                await run_blocking(
+                    self.repo.create_return,
                     user_id=effective_user_id,
                     order_id=order_id,
                     sku="",
@@ -195,7 +225,8 @@ class ReturnPlannerAgent:
 
         return_record = None
         if effective_user_id:
-            return_record = self.repo.create_return(
+            return_record = await run_blocking(
+                self.repo.create_return,
                 user_id=effective_user_id,
                 order_id=order_id,
                 sku="",
@@ -230,7 +261,8 @@ class ReturnPlannerAgent:
 
         if effective_user_id and return_record:
             if refund_result.get("success"):
-                self.repo.update_return(
+                await run_blocking(
+                    self.repo.update_return,
                     user_id=effective_user_id,
                     return_id=return_record.get("id") or return_record.get("rma_id"),
                     updates={
@@ -241,7 +273,8 @@ class ReturnPlannerAgent:
                     },
                 )
             else:
-                self.repo.update_return(
+                await run_blocking(
+                    self.repo.update_return,
                     user_id=effective_user_id,
                     return_id=return_record.get("id") or return_record.get("rma_id"),
                     updates={
@@ -284,12 +317,4 @@ class ReturnPlannerAgent:
 
     @staticmethod
     def _extract_auto_refund_threshold(policy_hits: list[dict]) -> Optional[float]:
-        for hit in policy_hits:
-            content = str(hit.get("content", "")).lower()
-            match = re.search(r"under\s+(\d+(?:\.\d+)?)\s*cny", content)
-            if match:
-                try:
-                    return float(match.group(1))
-                except ValueError:
-                    continue
-        return None
+        return extract_auto_refund_threshold(policy_hits)
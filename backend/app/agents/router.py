@@ -6,6 +6,7 @@ import json
 from typing import Dict, List
 from ..llm.kimi import chat_completion
 from ..core.prompts import ROUTER_AGENT_PROMPT
+from .intent import classify_locally, intent_cache, normalize_text, record_intent_source
 
 
 class RouterAgent:
@@ -62,7 +63,7 @@ class RouterAgent:
         
         try:
             # router不需要工具调用,只做意图识别
-            response = await chat_completion(messages, enable_tools=False)
+            response = await chat_completion(messages, enable_tools=False, call_site="router.intent")
             
             # 解析 JSON 响应
             # Kimi 可能返回包含 ```json 代码块的格式，需要提取
@@ -132,6 +133,39 @@ class RouterAgent:
         return False
 
 
+# 路由智能体无状态，进程内复用同一个实例
+_router_agent = RouterAgent()
+
+
+async def classify_intent(message: str, history: List[Dict] = None) -> Dict:
+    """
+    意图识别入口：本地规则 → 缓存 → LLM
+
+    高置信度的消息（转人工、明确的退货/查单、单独的订单号）由规则直接判定；
+    其余消息按归一化文本查缓存，未命中才调用 RouterAgent。
+    带历史的请求结果依赖上下文，不进缓存。
+    """
+    analysis = classify_locally(message)
+    if analysis:
+        record_intent_source("rules")
+        return analysis
+
+    cache_key = normalize_text(message) if not history else None
+    if cache_key:
+        cached = intent_cache.get(cache_key)
+        if cached:
+            record_intent_source("cache_hits")
+            cached["source"] = "cache"
+            return cached
+
+    analysis = await _router_agent.analyze_intent(message, history)
+    record_intent_source("llm")
+    analysis["source"] = "llm"
+    if cache_key and analysis.get("intent") != "error" and analysis.get("confidence", 0) >= 0.5:
+        intent_cache.set(cache_key, analysis)
+    return analysis
+
+
 # 向后兼容：保留旧的函数接口
 async def detect_intent(message: str, history: List[Dict] = None) -> Dict[str, object]:
     """
@@ -144,8 +178,7 @@ async def detect_intent(message: str, history: List[Dict] = None) -> Dict[str, o
         "escalate_reason": ""
     }
     """
-    agent = RouterAgent()
-    analysis = await agent.analyze_intent(message, history)
+    analysis = await classify_intent(message, history)
     
     # 转换为旧格式
     intent_mapping = {
@@ -154,6 +187,7 @@ async def detect_intent(message: str, history: List[Dict] = None) -> Dict[str, o
         "order_status": "WISMO",
         "product_question": "FAQ",
         "complaint": "HUMAN",
+        "human_request": "HUMAN",
         "general_question": "FAQ",
         "other": "FAQ"
     }
@@ -164,5 +198,6 @@ async def detect_intent(message: str, history: List[Dict] = None) -> Dict[str, o
         "should_escalate": analysis["need_human"],
         "escalate_reason": analysis["reason"] if analysis["need_human"] else "",
         "emotion": analysis["emotion"],  # 新增字段
-        "raw_intent": analysis["intent"]  # 原始意图
+        "raw_intent": analysis["intent"],  # 原始意图
+        "source": analysis.get("source", "llm"),  # rules / cache / llm
     }
@@ -0,0 +1,48 @@
+"""
+Long-lived agent services.
+
+The agents only hold shared, thread-safe dependencies (repository, order API,
+Alipay client), so one set is built at startup and reused by every request.
+Per-request state (user, conversation) travels in an AgentRequestContext.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+from app.agents.order_agent import OrderAgent
+from app.agents.qa import AgentRequestContext, QAAgent
+from app.agents.return_planner import ReturnPlannerAgent
+from app.db.repo import Repository
+from app.integrations.alipay import get_alipay_client
+from app.integrations.order import get_order_api
+
+_qa_agent: Optional[QAAgent] = None
+
+
+def build_qa_agent() -> QAAgent:
+    repo = Repository.from_env()
+    order_api = get_order_api()
+    return_planner = ReturnPlannerAgent(
+        repo=repo,
+        order_api=order_api,
+        alipay_client=get_alipay_client(use_mock=False),
+    )
+    return QAAgent(return_planner=return_planner, order_agent=OrderAgent(order_api=order_api), repo=repo)
+
+
+def get_qa_agent() -> QAAgent:
+    global _qa_agent
+    if _qa_agent is None:
+        _qa_agent = build_qa_agent()
+    return _qa_agent
+
+
+def startup_agent_services() -> None:
+    """Build the shared agents at startup; if Supabase is not configured yet, the first request retries."""
+    try:
+        get_qa_agent()
+    except Exception as exc:
+        print(f"[agents] deferred agent setup: {exc}")
+
+
+__all__ = ["AgentRequestContext", "get_qa_agent", "startup_agent_services"]
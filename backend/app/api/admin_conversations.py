@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 
-from ..core.auth import User, require_admin
+from ..core.auth import User, admin_llm_lane, require_admin
 from ..core.supabase import get_supabase_admin_client
 from ..db.repo import Repository, get_repo
 
-router = APIRouter(tags=["admin_conversations"])
+router = APIRouter(tags=["admin_conversations"], dependencies=[Depends(admin_llm_lane)])
 
 
 @router.get("/admin/conversations")
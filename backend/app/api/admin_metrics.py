@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from ..core.auth import User, require_admin
+from ..core.metrics import collect_metrics
+from ..core.supabase import get_supabase_admin_client
+from ..llm.usage import aggregate_llm_calls
+
+router = APIRouter(tags=["admin_metrics"])
+
+
+@router.get("/admin/metrics")
+async def admin_metrics(user: User = Depends(require_admin)):
+    """Process-local runtime metrics (LLM pool, caches, queues)."""
+    return collect_metrics()
+
+
+@router.get("/admin/metrics/llm-calls")
+async def admin_llm_call_stats(
+    user: User = Depends(require_admin),
+    group_by: str = Query(default="route", pattern="^(conversation|route|call_site|model|hour)$"),
+    hours: int = Query(default=24, ge=1, le=720),
+    limit: int = Query(default=5000, ge=1, le=50000),
+):
+    """Token usage and latency of LLM_CALL events, grouped per conversation / route / hour."""
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    client = get_supabase_admin_client()
+    try:
+        res = (
+            client.table("agent_events")
+            .select("conversation_id, payload, created_at")
+            .eq("event_type", "LLM_CALL")
+            .gte("created_at", since)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute()
+        )
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    rows = res.data or []
+    return {
+        "group_by": group_by,
+        "since": since,
+        "events": len(rows),
+        "items": aggregate_llm_calls(rows, group_by),
+    }
@@ -3,12 +3,12 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
 from datetime import datetime
 
-from ..core.auth import User, require_admin
+from ..core.auth import User, admin_llm_lane, require_admin
 from ..core.supabase import get_supabase_admin_client
 from ..integrations.order import get_order_api
 from .admin_returns import _auto_refund_threshold
 
-router = APIRouter(tags=["admin_orders"])
+router = APIRouter(tags=["admin_orders"], dependencies=[Depends(admin_llm_lane)])
 
 
 def _parse_iso(value: Optional[str]) -> Optional[datetime]:
@@ -64,7 +64,7 @@ async def admin_list_orders(
     return {
         "items": orders,
         "returns": returns_map,
-        "meta": {"auto_refund_threshold": _auto_refund_threshold()},
+        "meta": {"auto_refund_threshold": await _auto_refund_threshold()},
     }
 
 
@@ -3,15 +3,14 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from datetime import datetime, timezone
 
-from ..core.auth import User, require_admin
+from ..core.auth import User, admin_llm_lane, require_admin
 from ..core.supabase import get_supabase_admin_client
 from ..db.repo import Repository
-from ..rag import bailian
-from ..agents.return_planner import ReturnPlannerAgent
+from ..rag.policy_snapshot import return_policy_snapshot
 from ..integrations.alipay import get_alipay_client
 import asyncio
 
-router = APIRouter(tags=["admin_returns"])
+router = APIRouter(tags=["admin_returns"], dependencies=[Depends(admin_llm_lane)])
 
 
 def _days_since(value: Optional[str]) -> Optional[int]:
@@ -24,19 +23,19 @@ def _days_since(value: Optional[str]) -> Optional[int]:
     return (datetime.now(timezone.utc) - dt).days
 
 
-def _auto_refund_threshold() -> float:
-    hits = bailian.search_policies("return policy, refund threshold")
-    threshold = ReturnPlannerAgent._extract_auto_refund_threshold(hits) or 200.0
-    return threshold
+async def _auto_refund_threshold() -> float:
+    policy = await return_policy_snapshot.get()
+    return policy.auto_refund_threshold or 200.0
 
 
-def _enforce_refund_policy(order: dict, amount_cents: int) -> None:
+async def _enforce_refund_policy(order: dict, amount_cents: int) -> None:
     days_since = _days_since(order.get("created_at"))
     if days_since is None:
         raise HTTPException(status_code=400, detail="Order date missing")
-    if days_since > 30:
-        raise HTTPException(status_code=400, detail="Return window expired (>30 days)")
-    threshold = _auto_refund_threshold()
+    policy = await return_policy_snapshot.get()
+    if days_since > policy.return_window_days:
+        raise HTTPException(status_code=400, detail=f"Return window expired (>{policy.return_window_days} days)")
+    threshold = policy.auto_refund_threshold or 200.0
     amount_major = amount_cents / 100 if amount_cents else 0
     if amount_major <= threshold:
         raise HTTPException(status_code=400, detail="Auto-refund amount; admin action not required")
@@ -91,7 +90,7 @@ async def admin_list_returns(
                 item["order_created_at"] = order_map[order_id_val].get("created_at")
     return {
         "items": items,
-        "meta": {"auto_refund_threshold": _auto_refund_threshold()},
+        "meta": {"auto_refund_threshold": await _auto_refund_threshold()},
     }
 
 
@@ -137,7 +136,7 @@ async def admin_refund_return(
         print(f"[admin_refund_return] invalid amount order_id={order_id} amount={amount_cents}")
         raise HTTPException(status_code=400, detail="Invalid refund amount")
 
-    _enforce_refund_policy(order, amount_cents)
+    await _enforce_refund_policy(order, amount_cents)
 
     refund_id = return_row.get("refund_id") or return_id
     alipay = get_alipay_client(use_mock=False)
@@ -203,7 +202,7 @@ async def admin_refund_order(
         print(f"[admin_refund_order] invalid amount order_id={order_id} amount={amount_cents}")
         raise HTTPException(status_code=400, detail="Invalid order amount")
 
-    _enforce_refund_policy(order, amount_cents)
+    await _enforce_refund_policy(order, amount_cents)
 
     repo = Repository.from_env()
     return_row = None
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 
 from ..core.auth import User, get_current_user
 from ..db.repo import Repository, get_repo
+from ..llm.usage import set_llm_context
 
 router = APIRouter(tags=["approvals"])
 
@@ -24,6 +25,8 @@ async def approve(
     user: User = Depends(get_current_user),
     repo: Repository = Depends(get_repo),
 ):
+    # 审批决定了退款是否继续，排在普通聊天之前
+    set_llm_context(user_id=user.user_id, route="/approvals/approve", lane="admin")
     try:
         task = repo.update_approval_status(user.user_id, task_id, "approved")
     except ValueError as exc:
@@ -38,6 +41,7 @@ async def reject(
     user: User = Depends(get_current_user),
     repo: Repository = Depends(get_repo),
 ):
+    set_llm_context(user_id=user.user_id, route="/approvals/reject", lane="admin")
     try:
         task = repo.update_approval_status(
             user.user_id, task_id, "rejected", reason=payload.reason
@@ -1,20 +1,25 @@
 ﻿import asyncio
 import json
-import re
 import uuid
 from typing import AsyncGenerator, Dict, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 from ..agents import qa as qa_module, router as router_module
-from ..agents.qa import QAAgent
+from ..agents.context import context_builder
+from ..agents.intent import detect_transfer_reason, extract_order_id  # noqa: F401  (re-exported)
+from ..agents.services import AgentRequestContext, get_qa_agent
 from ..core.auth import User, get_current_user
 from ..core.supabase import get_supabase_admin_client
 from ..db.repo import Repository, get_repo
 from ..llm import kimi
+from ..llm.resilience import LLMUnavailableError
+from ..llm.usage import set_llm_context
 from ..rag import bailian
+from .streaming import cancel_on_disconnect
+from .turns import turn_coalescer
 from ..workflows.return_flow import ReturnFlow
 
 router = APIRouter(tags=["chat"])
@@ -28,15 +33,6 @@ class ChatRequest(BaseModel):
     assistant_message_id: Optional[str] = None
 
 
-def extract_order_id(text: str) -> Optional[str]:
-    """从用户消息中提取订单号。"""
-    pattern = r"ORD[-_A-Z0-9]{3,}"
-    match = re.search(pattern, text.upper())
-    if match:
-        return match.group(0)
-    return None
-
-
 def chunk_text(text: str, chunk_size: int = 80):
     for i in range(0, len(text), chunk_size):
         yield text[i : i + chunk_size]
@@ -48,46 +44,40 @@ async def stream_sse(text: str) -> AsyncGenerator[str, None]:
         await asyncio.sleep(0)
 
 
-def detect_transfer_reason(message: str) -> Optional[str]:
-    text = message.strip()
-    if not text:
-        return None
-
-    transfer_keywords = [
-        "转人工",
-        "人工客服",
-        "真人客服",
-        "转接人工",
-        "找人工",
-        "找人",
-        "真人",
-        "人工服务",
-    ]
-    if any(keyword in text for keyword in transfer_keywords):
-        return "用户主动要求转人工"
-
-    negative_keywords = [
-        "垃圾",
-        "骗子",
-        "太差",
-        "差劲",
-        "失望",
-        "生气",
-        "愤怒",
-        "投诉",
-        "差评",
-        "举报",
-        "告你",
-        "维权",
-        "无语",
-        "糟糕",
-        "破公司",
-    ]
-    exclamations = text.count("!") + text.count("！")
-    if exclamations >= 3 or any(keyword in text for keyword in negative_keywords):
-        return "用户情绪激动或负面"
-
-    return None
+TRANSFER_TOOL_NAMES = {"transfer_to_human", "transfer_to_agent"}
+
+
+def mark_pending_agent(conversation_id: str) -> None:
+    """把会话置为等待人工（已经是人工接管的会话保持不变）。"""
+    client = get_supabase_admin_client()
+    conv_res = (
+        client.table("conversations")
+        .select("status")
+        .eq("id", conversation_id)
+        .limit(1)
+        .execute()
+    )
+    current_status = conv_res.data[0].get("status") if conv_res.data else None
+    if current_status != "agent":
+        client.table("conversations").update({"status": "pending_agent"}).eq(
+            "id", conversation_id
+        ).execute()
+
+
+LLM_UNAVAILABLE_REPLY = "抱歉，智能客服暂时繁忙，正在为您转接人工客服，请稍候~"
+
+
+def handoff_llm_unavailable(conversation_id: str, user_id: str, exc: LLMUnavailableError) -> None:
+    """LLM 熔断或超出截止时间：直接转人工，而不是让用户继续等待。"""
+    mark_pending_agent(conversation_id)
+    get_supabase_admin_client().table("messages").insert(
+        {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "role": "system",
+            "content": f"TRANSFER_TO_HUMAN: AI 服务暂不可用（{exc.reason}）",
+        }
+    ).execute()
 
 
 async def stream_text_reply(text: str) -> AsyncGenerator[str, None]:
@@ -136,8 +126,9 @@ async def chat_endpoint(
 
     repo.add_message(conversation_id, user.user_id, "user", payload.message)
     trace_id = str(uuid.uuid4())
+    set_llm_context(conversation_id=conversation_id, user_id=user.user_id, route="/chat")
 
-    route = router_module.detect_intent(payload.message)
+    route = await router_module.detect_intent(payload.message)
     repo.log_event(
         trace_id=trace_id,
         event_type="ROUTE_DECISION",
@@ -197,6 +188,7 @@ async def chat_endpoint(
 @router.post("/chat/kimi")
 async def chat_with_kimi(
     payload: ChatRequest,
+    request: Request,
     user: User = Depends(get_current_user),
     repo: Repository = Depends(get_repo),
 ):
@@ -246,49 +238,68 @@ async def chat_with_kimi(
     except Exception:
         pass
 
+    set_llm_context(conversation_id=conversation_id, user_id=user.user_id, route="/chat/kimi")
     history = repo.list_messages(conversation_id, user.user_id)
-    messages = [
-        {
-            "role": "system",
-            "content": "你是一名电商客服，帮助用户解决订单、物流、退换货相关问题。回答要简洁、友好，并用中文回复。",
-        }
-    ]
+    history_messages = []
     for item in history:
         role = "assistant" if item["role"] == "assistant" else "user"
         content = item.get("transcript") or item["content"]
         if content.startswith("VOICE|"):
             parts = content.split("|")
             content = parts[2] if len(parts) > 2 and parts[2] else "用户发送了语音消息"
-        messages.append({"role": role, "content": content})
+        history_messages.append({"role": role, "content": content})
+    messages = [
+        {
+            "role": "system",
+            "content": "你是一名电商客服，帮助用户解决订单、物流、退换货相关问题。回答要简洁、友好，并用中文回复。",
+        }
+    ] + await context_builder.build(conversation_id, history_messages, repo)
 
     async def generate_kimi_stream():
         full_content = ""
-        tool_calls = []
+        transfer_call = None
+        transfer_task = None
 
         try:
             async for chunk in kimi.chat_completion_stream(messages):
                 if chunk["type"] == "content":
                     yield f"data: {json.dumps({'content': chunk['data']}, ensure_ascii=False)}\n\n"
                     full_content += chunk["data"]
-                elif chunk["type"] == "tool_calls":
-                    tool_calls = chunk["data"]
+                elif chunk["type"] == "tool_call_complete":
+                    call = chunk["data"]
+                    if call["function"]["name"] in TRANSFER_TOOL_NAMES and transfer_call is None:
+                        # 转人工调用一完整就开始更新会话状态，不等模型生成结束
+                        transfer_call = call
+                        transfer_task = asyncio.create_task(
+                            asyncio.to_thread(mark_pending_agent, conversation_id)
+                        )
                 elif chunk["type"] == "done":
                     full_content = chunk["content"]
-                    tool_calls = chunk.get("tool_calls", [])
+        except LLMUnavailableError as exc:
+            print(f"[Kimi] LLM unavailable ({exc.reason}), handing off to a human")
+            if transfer_task:
+                await transfer_task
+            suffix = ("\n\n" if full_content else "") + LLM_UNAVAILABLE_REPLY
+            yield f"data: {json.dumps({'content': suffix}, ensure_ascii=False)}\n\n"
+            try:
+                await asyncio.to_thread(handoff_llm_unavailable, conversation_id, user.user_id, exc)
+                await asyncio.to_thread(
+                    repo.add_message, conversation_id, user.user_id, "assistant", full_content + suffix
+                )
+            except Exception as db_exc:
+                print(f"[Kimi] failed to record handoff: {db_exc}")
+            yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
+            return
         except Exception as exc:
             import traceback
 
             traceback.print_exc()
+            if transfer_task:
+                await transfer_task
             yield f"data: {json.dumps({'error': str(exc)}, ensure_ascii=False)}\n\n"
             yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
             return
 
-        transfer_call = None
-        for call in tool_calls:
-            if call.get("function", {}).get("name") == "transfer_to_human":
-                transfer_call = call
-                break
-
         if transfer_call:
             try:
                 args = json.loads(transfer_call["function"]["arguments"])
@@ -296,21 +307,7 @@ async def chat_with_kimi(
             except Exception:
                 reason = "用户请求"
 
-            from ..core.supabase import get_supabase_admin_client
-
-            client = get_supabase_admin_client()
-            conv_res = (
-                client.table("conversations")
-                .select("status")
-                .eq("id", conversation_id)
-                .limit(1)
-                .execute()
-            )
-            current_status = conv_res.data[0].get("status") if conv_res.data else None
-            if current_status != "agent":
-                client.table("conversations").update({"status": "pending_agent"}).eq(
-                    "id", conversation_id
-                ).execute()
+            await transfer_task
 
             ai_reply = (
                 "您好，我正在为您联系人工客服，请稍候~\n"
@@ -328,7 +325,7 @@ async def chat_with_kimi(
         yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
 
     return StreamingResponse(
-        generate_kimi_stream(),
+        cancel_on_disconnect(request, generate_kimi_stream(), "/chat/kimi"),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -341,6 +338,7 @@ async def chat_with_kimi(
 @router.post("/chat/agent")
 async def chat_with_agent(
     payload: ChatRequest,
+    request: Request,
     user: User = Depends(get_current_user),
     repo: Repository = Depends(get_repo),
 ):
@@ -370,8 +368,12 @@ async def chat_with_agent(
                 media_type="text/event-stream",
             )
 
+    # 同一会话连发的多条消息合并成一轮回答；新消息会取代仍在去抖或生成中的旧轮次
+    turn = turn_coalescer.begin(conversation_id)
+
     transfer_reason = detect_transfer_reason(user_message)
     if transfer_reason:
+        turn.close()
         client.table("conversations").update({"status": "pending_agent"}).eq(
             "id", conversation_id
         ).execute()
@@ -388,12 +390,27 @@ async def chat_with_agent(
             media_type="text/event-stream",
         )
 
-    # 前端已经保存了用户消息，这里不再重复保存
-    # 直接获取历史消息
-    qa_agent = QAAgent(user_id=user.user_id, repo=repo)
+    # 生成器启动之前轮次由这里负责：读历史失败或请求被取消时生成器不会运行，它的 finally 也不会释放轮次，
+    # 不兜底的话这个会话之后的消息都会合并进一个已经死掉的轮次
+    try:
+        if not await turn.settle():
+            return StreamingResponse(
+                stream_skip("coalesced"),
+                media_type="text/event-stream",
+            )
 
-    history = repo.list_messages(conversation_id, user.user_id)
-    messages = [{"role": item["role"], "content": item["content"]} for item in history]
+        # 前端已经保存了用户消息，这里不再重复保存
+        # 去抖窗口之后再读历史，期间连发的消息都已在里面
+        qa_agent = get_qa_agent()
+        agent_ctx = AgentRequestContext(user_id=user.user_id, conversation_id=conversation_id)
+        set_llm_context(conversation_id=conversation_id, user_id=user.user_id, route="/chat/agent")
+
+        history = repo.list_messages(conversation_id, user.user_id)
+        messages = [{"role": item["role"], "content": item["content"]} for item in history]
+        messages = await context_builder.build(conversation_id, messages, repo)
+    except BaseException:
+        turn.close()
+        raise
 
     async def generate_agent_stream():
         from ..core.supabase import get_supabase_admin_client
@@ -401,13 +418,23 @@ async def chat_with_agent(
         db_client = get_supabase_admin_client()
 
         try:
-            result = await qa_agent.chat(messages)
-
-            assistant_reply = result["message"]
-            tool_calls = result.get("tool_calls")
-            tool_data = result.get("tool_data", {})  # 结构化数据
+            assistant_reply = ""
+            tool_calls = None
+            tool_data = {}  # 结构化数据
             transfer_reason = None
 
+            # 边生成边推送：Kimi 的 token 一到就转发，工具结果卡片在最终回复文本之前发送
+            async for event in qa_agent.chat_stream(agent_ctx, messages):
+                if event["type"] == "content":
+                    assistant_reply += event["data"]
+                    yield f"data: {json.dumps({'content': event['data']}, ensure_ascii=False)}\n\n"
+                elif event["type"] == "tool_data":
+                    tool_data = event["data"] or {}
+                    if tool_data:
+                        yield f"data: {json.dumps({'tool_data': tool_data}, ensure_ascii=False)}\n\n"
+                elif event["type"] == "done":
+                    tool_calls = event.get("tool_calls")
+
             print(f"[Agent] AI reply: {assistant_reply[:100]}...")
             print(f"[Agent] tool calls: {tool_calls}")
 
@@ -465,14 +492,16 @@ async def chat_with_agent(
                 ).execute()
 
                 print("[Agent] conversation status set to pending_agent")
+                # 回复已经流式发出，这里只补发转人工提示
+                suffix = ""
                 if assistant_reply:
                     if "人工" not in assistant_reply:
-                        assistant_reply = (
-                            f"{assistant_reply}\n\n"
-                            f"很抱歉，原因：{transfer_reason}。我将为您联系人工客服，请稍候~"
-                        )
+                        suffix = f"\n\n很抱歉，原因：{transfer_reason}。我将为您联系人工客服，请稍候~"
                 else:
-                    assistant_reply = f"很抱歉，原因：{transfer_reason}。我将为您联系人工客服，请稍候~"
+                    suffix = f"很抱歉，原因：{transfer_reason}。我将为您联系人工客服，请稍候~"
+                if suffix:
+                    assistant_reply += suffix
+                    yield f"data: {json.dumps({'content': suffix}, ensure_ascii=False)}\n\n"
 
             if assistant_reply:
                 message_payload = {
@@ -491,14 +520,26 @@ async def chat_with_agent(
                 except Exception as exc:
                     print(f"[Agent] failed to persist assistant reply: {exc}")
 
-            # 先发送结构化数据（如果有订单数据）
-            if tool_data:
-                yield f"data: {json.dumps({'tool_data': tool_data}, ensure_ascii=False)}\n\n"
-
-            for char in assistant_reply:
-                yield f"data: {json.dumps({'content': char}, ensure_ascii=False)}\n\n"
-                await asyncio.sleep(0.02)
+            yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
 
+        except LLMUnavailableError as exc:
+            print(f"[Agent] LLM unavailable ({exc.reason}), handing off to a human")
+            suffix = ("\n\n" if assistant_reply else "") + LLM_UNAVAILABLE_REPLY
+            yield f"data: {json.dumps({'content': suffix}, ensure_ascii=False)}\n\n"
+            message_payload = {
+                "conversation_id": conversation_id,
+                "user_id": user.user_id,
+                "role": "assistant",
+                "content": assistant_reply + suffix,
+            }
+            if payload.assistant_message_id:
+                message_payload["id"] = payload.assistant_message_id
+                message_payload["client_message_id"] = payload.assistant_message_id
+            try:
+                await asyncio.to_thread(handoff_llm_unavailable, conversation_id, user.user_id, exc)
+                await asyncio.to_thread(lambda: db_client.table("messages").upsert(message_payload).execute())
+            except Exception as db_exc:
+                print(f"[Agent] failed to record handoff: {db_exc}")
             yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
 
         except Exception as exc:
@@ -508,7 +549,15 @@ async def chat_with_agent(
             error_message = f"System error: {exc}"
             yield f"data: {json.dumps({'error': error_message}, ensure_ascii=False)}\n\n"
 
-    return StreamingResponse(
-        generate_agent_stream(),
-        media_type="text/event-stream",
-    )
+        finally:
+            turn.close()
+
+    try:
+        return StreamingResponse(
+            cancel_on_disconnect(request, generate_agent_stream(), "/chat/agent", superseded=turn.superseded),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    except BaseException:
+        turn.close()
+        raise
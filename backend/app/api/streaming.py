@@ -0,0 +1,122 @@
+"""
+Client-disconnect handling for the SSE chat endpoints.
+
+The chat generator runs in its own producer task and hands chunks over a small
+queue; the response side forwards them and a watcher polls
+request.is_disconnected(). When the browser goes away (or Starlette cancels
+the response) the producer task is cancelled: the in-flight Kimi stream is
+closed, read-only tools are cancelled with it, and nothing after the point of
+disconnect (follow-up LLM calls, message persistence) runs. Side-effecting
+tools such as refunds are shielded in QAAgent._execute_tool and still run to
+completion.
+
+The same cancellation is used when a newer message supersedes the turn (see
+app/api/turns.py); the client then gets a skip event and drops the bubble.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import Request
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+from ..llm.usage import llm_cancellation_totals
+
+# 生产者最多领先客户端的 chunk 数
+_BUFFER_CHUNKS = 16
+
+_DONE = object()
+
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(settings.sse_disconnect_poll_interval)
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    stream: AsyncIterator[str],
+    route: str,
+    superseded: Optional[asyncio.Event] = None,
+) -> AsyncIterator[str]:
+    """Forward an SSE generator, cancelling its upstream work as soon as the client disconnects (or superseded is set)."""
+    stats = _stats.setdefault(route, {"streams": 0, "completed": 0, "disconnects": 0, "superseded": 0})
+    stats["streams"] += 1
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_BUFFER_CHUNKS)
+
+    async def produce() -> None:
+        try:
+            async for chunk in stream:
+                await queue.put(chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            await queue.put(_Failure(exc))
+            return
+        await queue.put(_DONE)
+
+    producer = asyncio.create_task(produce())
+    watchers = {asyncio.create_task(_wait_for_disconnect(request))}
+    if superseded is not None:
+        watchers.add(asyncio.create_task(superseded.wait()))
+    finished = False
+    was_superseded = False
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, *watchers}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                was_superseded = superseded is not None and superseded.is_set()
+                break
+            item = getter.result()
+            if item is _DONE:
+                finished = True
+                break
+            if isinstance(item, _Failure):
+                finished = True
+                raise item.exc
+            yield item
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        if finished:
+            stats["completed"] += 1
+        elif was_superseded:
+            stats["superseded"] += 1
+            producer.cancel()
+            print(f"[SSE] {route} turn superseded by a newer message, cancelling upstream work")
+        else:
+            # 客户端已断开（或响应被 Starlette 取消）：取消上游的 LLM 调用和只读工具
+            stats["disconnects"] += 1
+            producer.cancel()
+            print(f"[SSE] client disconnected from {route}, cancelling upstream work")
+
+    if was_superseded:
+        yield f"data: {json.dumps({'skip': True, 'reason': 'superseded'}, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
+
+
+def _metrics() -> Dict[str, Any]:
+    streams = sum(route["streams"] for route in _stats.values())
+    disconnects = sum(route["disconnects"] for route in _stats.values())
+    return {
+        "streams": streams,
+        "disconnects": disconnects,
+        "disconnect_rate": round(disconnects / streams, 4) if streams else None,
+        "routes": {route: dict(values) for route, values in _stats.items()},
+        **llm_cancellation_totals(),
+    }
+
+
+register_metrics("sse_disconnects", _metrics)
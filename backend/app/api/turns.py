@@ -0,0 +1,93 @@
+"""
+Per-conversation turn coalescing for /chat/agent.
+
+Customers often send several short messages in a row ("在吗", "我的订单",
+"ORD123"). The frontend saves each message and then POSTs /chat/agent, so
+every POST would start its own agent turn over overlapping history. Instead,
+each POST opens a Turn for its conversation:
+
+- a newer Turn supersedes the previous one: a turn still in its debounce
+  window gives up, and a turn already streaming is cancelled (see
+  cancel_on_disconnect) and tells the client to drop its bubble;
+- the surviving turn waits CHAT_COALESCE_WINDOW seconds of quiet and then
+  answers everything at once, because history is read from the database after
+  the window and already contains all the new messages.
+
+State is process-local (like the admission queue); with several workers the
+coalescing only applies to requests that land on the same worker.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Dict
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+
+_stats = {"turns": 0, "answered": 0, "coalesced": 0, "superseded_in_flight": 0}
+
+
+class Turn:
+    def __init__(self, coalescer: "TurnCoalescer", conversation_id: str):
+        self._coalescer = coalescer
+        self.conversation_id = conversation_id
+        self.superseded = asyncio.Event()
+        self.started = False
+
+    async def settle(self) -> bool:
+        """Wait out the debounce window; False when a newer message took over in the meantime."""
+        window = max(0.0, settings.chat_coalesce_window)
+        if window:
+            try:
+                await asyncio.wait_for(self.superseded.wait(), timeout=window)
+            except asyncio.TimeoutError:
+                pass
+        if self.superseded.is_set():
+            _stats["coalesced"] += 1
+            self.close()
+            return False
+        self.started = True
+        _stats["answered"] += 1
+        return True
+
+    def supersede(self) -> None:
+        if self.superseded.is_set():
+            return
+        if self.started:
+            _stats["superseded_in_flight"] += 1
+        self.superseded.set()
+
+    def close(self) -> None:
+        self._coalescer.release(self)
+
+
+class TurnCoalescer:
+    def __init__(self):
+        self._current: Dict[str, Turn] = {}
+
+    def begin(self, conversation_id: str) -> Turn:
+        """Open the newest turn for a conversation, superseding whatever turn was there."""
+        turn = Turn(self, conversation_id)
+        previous = self._current.get(conversation_id)
+        if previous is not None:
+            previous.supersede()
+        self._current[conversation_id] = turn
+        _stats["turns"] += 1
+        return turn
+
+    def release(self, turn: Turn) -> None:
+        if self._current.get(turn.conversation_id) is turn:
+            del self._current[turn.conversation_id]
+
+    def metrics(self) -> Dict[str, Any]:
+        turns = _stats["turns"]
+        return {
+            **_stats,
+            "active_conversations": len(self._current),
+            # 每条消息平均节省的 agent 轮次
+            "coalesce_rate": round((_stats["coalesced"] + _stats["superseded_in_flight"]) / turns, 4) if turns else None,
+        }
+
+
+turn_coalescer = TurnCoalescer()
+register_metrics("chat_turns", turn_coalescer.metrics)
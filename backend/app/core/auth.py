@@ -3,11 +3,12 @@ from dataclasses import dataclass
 from typing import Any, Dict, Optional
 
 import jwt
-from fastapi import Depends, HTTPException, Security, status
+from fastapi import Depends, HTTPException, Request, Security, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 from .config import settings
 from .supabase import get_supabase_admin_client, get_supabase_client
+from ..llm.usage import set_llm_context
 
 bearer_scheme = HTTPBearer(auto_error=False)
 
@@ -135,3 +136,9 @@ async def require_admin(user: User = Depends(get_current_user)) -> User:
     if role != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
     return user
+
+
+async def admin_llm_lane(request: Request, user: User = Depends(require_admin)) -> User:
+    """require_admin, plus: LLM calls made while serving this request queue in the "admin" admission lane."""
+    set_llm_context(user_id=user.user_id, route=request.url.path, lane="admin")
+    return user
@@ -21,6 +21,8 @@ class Settings(BaseSettings):
     supabase_jwks_url: str = ""
     supabase_service_role_key: str = ""
     kimi_api_key: str = ""
+    # OpenAI-compatible base URL; point at kimi_standin.py for offline runs and load tests.
+    kimi_api_base: str = Field("https://api.moonshot.cn/v1", env="KIMI_API_BASE")
     bailian_endpoint: str = ""
     bailian_token: str = ""
     dashscope_api_key: str = Field("", env="DASHSCOPE_API_KEY")
@@ -38,6 +40,80 @@ class Settings(BaseSettings):
     alipay_public_key: str = ""
     # SSL verification toggle (debug-only; keep true in production).
     kimi_verify_ssl: bool = Field(True, env="KIMI_VERIFY_SSL")
+    # Shared LLM connection pool (HTTP/2 needs the optional 'h2' package).
+    kimi_http2: bool = Field(False, env="KIMI_HTTP2")
+    kimi_max_connections: int = Field(50, env="KIMI_MAX_CONNECTIONS")
+    kimi_max_keepalive_connections: int = Field(20, env="KIMI_MAX_KEEPALIVE_CONNECTIONS")
+    kimi_keepalive_expiry: float = Field(60.0, env="KIMI_KEEPALIVE_EXPIRY")
+    # Agent tool execution: parallel tool calls per turn, per-tool timeout, blocking-IO thread pool size.
+    agent_tool_concurrency: int = Field(4, env="AGENT_TOOL_CONCURRENCY")
+    agent_tool_timeout: float = Field(20.0, env="AGENT_TOOL_TIMEOUT")
+    agent_tool_workers: int = Field(16, env="AGENT_TOOL_WORKERS")
+    # Conversation history sent to the LLM: token budget for verbatim turns + rolling summary.
+    agent_context_token_budget: int = Field(3000, env="AGENT_CONTEXT_TOKEN_BUDGET")
+    agent_summary_max_tokens: int = Field(400, env="AGENT_SUMMARY_MAX_TOKENS")
+    # Model tiers, smallest context first; each call takes the smallest healthy tier that fits the prompt.
+    kimi_agent_models: str = Field("moonshot-v1-8k,moonshot-v1-32k,moonshot-v1-128k", env="KIMI_AGENT_MODELS")
+    kimi_light_models: str = Field("kimi-k2-turbo-preview", env="KIMI_LIGHT_MODELS")
+    kimi_completion_reserve: int = Field(1024, env="KIMI_COMPLETION_RESERVE")
+    # A tier is skipped while its recent error rate or p90 latency (TTFT for streams) exceeds these.
+    kimi_model_error_threshold: float = Field(0.3, env="KIMI_MODEL_ERROR_THRESHOLD")
+    kimi_model_latency_slo_ms: float = Field(8000.0, env="KIMI_MODEL_LATENCY_SLO_MS")
+    # LLM resilience: overall per-request budget, per-attempt timeout and retries, hedging, circuit breaker.
+    llm_request_deadline: float = Field(60.0, env="LLM_REQUEST_DEADLINE")
+    llm_attempt_timeout: float = Field(45.0, env="LLM_ATTEMPT_TIMEOUT")
+    llm_max_attempts: int = Field(3, env="LLM_MAX_ATTEMPTS")
+    llm_hedge_enabled: bool = Field(True, env="LLM_HEDGE_ENABLED")
+    llm_hedge_percentile: float = Field(95.0, env="LLM_HEDGE_PERCENTILE")
+    llm_hedge_min_delay: float = Field(1.0, env="LLM_HEDGE_MIN_DELAY")
+    llm_breaker_failure_threshold: int = Field(5, env="LLM_BREAKER_FAILURE_THRESHOLD")
+    llm_breaker_reset_seconds: float = Field(30.0, env="LLM_BREAKER_RESET_SECONDS")
+    # Once a stream has produced its first chunk, the deadline no longer applies; only this gap between chunks does.
+    llm_stream_idle_timeout: float = Field(30.0, env="LLM_STREAM_IDLE_TIMEOUT")
+    # Admission control: global cap on in-flight LLM requests and max time a call may queue for a slot.
+    llm_max_concurrency: int = Field(32, env="LLM_MAX_CONCURRENCY")
+    llm_queue_timeout: float = Field(10.0, env="LLM_QUEUE_TIMEOUT")
+    # Intent router cache for LLM classifications (rule-matched messages never reach it).
+    intent_cache_size: int = Field(2048, env="INTENT_CACHE_SIZE")
+    intent_cache_ttl: float = Field(3600.0, env="INTENT_CACHE_TTL")
+    # How often SSE chat streams check whether the client is still connected (seconds).
+    sse_disconnect_poll_interval: float = Field(1.0, env="SSE_DISCONNECT_POLL_INTERVAL")
+    # /chat/agent waits this long for follow-up messages before answering them as one turn (0 = no debounce).
+    chat_coalesce_window: float = Field(1.2, env="CHAT_COALESCE_WINDOW")
+    # In-memory RAG vector index: incremental sync period and full reload period (picks up deletes), seconds.
+    rag_index_refresh_interval: float = Field(60.0, env="RAG_INDEX_REFRESH_INTERVAL")
+    rag_index_full_sync_interval: float = Field(3600.0, env="RAG_INDEX_FULL_SYNC_INTERVAL")
+    # Hybrid policy search: RRF weight of the vector list (BM25 = 1) and the cosine floor for vector hits.
+    rag_hybrid_vector_weight: float = Field(0.5, env="RAG_HYBRID_VECTOR_WEIGHT")
+    rag_hybrid_min_vector_score: float = Field(0.4, env="RAG_HYBRID_MIN_VECTOR_SCORE")
+    # IVF ANN index: used from this many embedded rows, lists probed per query, rebuild threshold, on-disk location.
+    # Defaults from rag_ann_bench.py with held-out queries: below ~50k rows exact search is fast enough to keep exact
+    # recall; nprobe=64 keeps ~0.99 recall@10 on clustered data at 50k and is still ~4x faster than exact at 100k.
+    rag_ann_min_docs: int = Field(50000, env="RAG_ANN_MIN_DOCS")
+    rag_ann_nprobe: int = Field(64, env="RAG_ANN_NPROBE")
+    rag_ann_rebuild_fraction: float = Field(0.1, env="RAG_ANN_REBUILD_FRACTION")
+    rag_ann_index_path: str = Field(str(BACKEND_ROOT / ".cache" / "rag_ann"), env="RAG_ANN_INDEX_PATH")
+    # IVF vector storage: float32 or int8 (per-vector scale). int8 shrinks the search-resident vector array ~4x
+    # (ids, documents and BM25 are unchanged); its float32 source is kept on disk next to the saved index for rebuilds.
+    rag_ann_storage: str = Field("int8", env="RAG_ANN_STORAGE")
+    # Query-embedding cache: in-memory LRU size and SQLite file for the persistent tier (empty = memory only).
+    rag_embedding_cache_size: int = Field(1024, env="RAG_EMBEDDING_CACHE_SIZE")
+    rag_embedding_cache_path: str = Field(
+        str(BACKEND_ROOT / ".cache" / "query_embeddings.sqlite3"), env="RAG_EMBEDDING_CACHE_PATH"
+    )
+    # DashScope query embeddings arriving within this window share one request (max texts per request).
+    rag_embedding_batch_window_ms: float = Field(5.0, env="RAG_EMBEDDING_BATCH_WINDOW_MS")
+    rag_embedding_max_batch: int = Field(25, env="RAG_EMBEDDING_MAX_BATCH")
+    # Ingestion chunking (rag_ingest.py): max chars per chunk, overlap when a long paragraph is split.
+    rag_chunk_max_chars: int = Field(800, env="RAG_CHUNK_MAX_CHARS")
+    rag_chunk_overlap: int = Field(100, env="RAG_CHUNK_OVERLAP")
+    # Embedding backfill (rag_backfill.py): rows per page, requests in flight, requests per second, resume checkpoint.
+    rag_backfill_page_size: int = Field(500, env="RAG_BACKFILL_PAGE_SIZE")
+    rag_backfill_concurrency: int = Field(4, env="RAG_BACKFILL_CONCURRENCY")
+    rag_backfill_rps: float = Field(10.0, env="RAG_BACKFILL_RPS")
+    rag_backfill_checkpoint_path: str = Field(
+        str(BACKEND_ROOT / ".cache" / "rag_backfill.json"), env="RAG_BACKFILL_CHECKPOINT_PATH"
+    )
     # Alipay SSL verification (use false only for local debugging issues).
     alipay_verify_ssl: bool = Field(True, env="ALIPAY_VERIFY_SSL")
     alipay_sandbox: bool = Field(True, env="ALIPAY_SANDBOX")
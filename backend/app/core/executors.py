@@ -0,0 +1,39 @@
+"""
+Dedicated thread pool for blocking integrations (Supabase queries, sync SDKs).
+
+Running them here instead of directly inside async handlers keeps the event
+loop free, and keeps them off the default executor used by FastAPI itself.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from .config import settings
+
+T = TypeVar("T")
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        _tool_executor = ThreadPoolExecutor(
+            max_workers=settings.agent_tool_workers,
+            thread_name_prefix="agent-tool",
+        )
+    return _tool_executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the tool thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_tool_executor() -> None:
+    global _tool_executor
+    if _tool_executor is not None:
+        _tool_executor.shutdown(wait=False)
+        _tool_executor = None
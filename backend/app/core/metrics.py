@@ -0,0 +1,23 @@
+"""
+Process-local metrics registry.
+
+Components register a zero-argument callable that returns a JSON-serializable
+snapshot; the admin metrics endpoint collects them all under their names.
+"""
+from typing import Any, Callable, Dict
+
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    _providers[name] = provider
+
+
+def collect_metrics() -> Dict[str, Any]:
+    snapshot: Dict[str, Any] = {}
+    for name, provider in _providers.items():
+        try:
+            snapshot[name] = provider()
+        except Exception as exc:
+            snapshot[name] = {"error": str(exc)}
+    return snapshot
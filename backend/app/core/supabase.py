@@ -36,3 +36,25 @@ def get_supabase_admin_client() -> Client:
         raise RuntimeError("SUPABASE_URL is missing in backend/.env")
     _ensure_not_example_placeholder("SUPABASE_SERVICE_ROLE_KEY", settings.supabase_service_role_key)
     return create_client(settings.supabase_url, settings.supabase_service_role_key)
+
+
+# PostgREST error codes for an unknown column: 42703 from Postgres (select / filter), PGRST204 from the schema cache.
+MISSING_COLUMN_CODES = {"42703", "PGRST204"}
+
+
+def is_missing_column(exc: Exception, column: str) -> bool:
+    """True only when exc is PostgREST reporting that `column` does not exist (not a timeout or network error)."""
+    code = str(getattr(exc, "code", "") or "")
+    message = str(getattr(exc, "message", "") or exc)
+    return code in MISSING_COLUMN_CODES and column in message
+
+
+# PostgREST error codes for an unknown RPC: PGRST202 from the schema cache, 42883 from Postgres.
+MISSING_FUNCTION_CODES = {"PGRST202", "42883"}
+
+
+def is_missing_function(exc: Exception, name: str) -> bool:
+    """True only when exc is PostgREST reporting that the RPC `name` does not exist."""
+    code = str(getattr(exc, "code", "") or "")
+    message = str(getattr(exc, "message", "") or exc)
+    return code in MISSING_FUNCTION_CODES and name in message
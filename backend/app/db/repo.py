@@ -106,6 +106,41 @@ class Repository:
             if convo["user_id"] == user_id
         ]
 
+    def get_conversation_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Rolling summary of older messages; None when missing or the columns are not migrated yet."""
+        if self.client:
+            try:
+                res = (
+                    self.client.table("conversations")
+                    .select("summary, summary_message_count")
+                    .eq("id", conversation_id)
+                    .limit(1)
+                    .execute()
+                )
+            except Exception:
+                return None
+            row = res.data[0] if res.data else None
+            if not row or not row.get("summary"):
+                return None
+            return {"summary": row["summary"], "message_count": row.get("summary_message_count") or 0}
+        convo = self.memory["conversations"].get(conversation_id) or {}
+        if not convo.get("summary"):
+            return None
+        return {"summary": convo["summary"], "message_count": convo.get("summary_message_count", 0)}
+
+    def update_conversation_summary(self, conversation_id: str, summary: str, message_count: int) -> None:
+        updates = {
+            "summary": summary,
+            "summary_message_count": message_count,
+            "summary_updated_at": self._now(),
+        }
+        if self.client:
+            self.client.table("conversations").update(updates).eq("id", conversation_id).execute()
+            return
+        convo = self.memory["conversations"].get(conversation_id)
+        if convo is not None:
+            convo.update(updates)
+
     def add_message(
         self, conversation_id: str, user_id: str, role: str, content: str
     ) -> Dict[str, Any]:
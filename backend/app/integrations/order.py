@@ -91,7 +91,10 @@ class SupabaseOrderAPI:
         return item_res.data or []
 
     def get_logistics(self, order_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
-        order = self.get_order(order_id, user_id=user_id)
+        return self.logistics_from_order(self.get_order(order_id, user_id=user_id))
+
+    @staticmethod
+    def logistics_from_order(order: Optional[Dict]) -> Optional[Dict]:
         if not order:
             return None
         return {
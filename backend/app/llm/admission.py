@@ -0,0 +1,152 @@
+"""
+Admission control for outbound LLM calls.
+
+At most LLM_MAX_CONCURRENCY Kimi requests are in flight at once. Callers beyond
+that wait in priority lanes ("admin" ahead of "chat" ahead of "anonymous"
+ahead of "background"); inside a lane users are served round-robin, so one
+chatty conversation cannot starve the others. The lane comes from
+set_llm_context: admin routes (app.core.auth.admin_llm_lane) and return
+approvals use "admin", signed-in chat "chat", chat without a user
+"anonymous", and work detached from a request "background". A caller that has waited
+LLM_QUEUE_TIMEOUT (or past its request deadline) gets LLMUnavailableError with
+reason "queue_timeout", which the chat endpoints turn into a "busy,
+transferring to a human" reply.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+
+LANES = ("admin", "chat", "anonymous", "background")
+
+# 排队等待时间直方图的桶上限（毫秒）
+WAIT_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class AdmissionController:
+    """Global concurrency cap with priority lanes and per-user round-robin inside each lane."""
+
+    def __init__(self, max_concurrency: int, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # lane -> user -> waiters（OrderedDict 的顺序即轮转顺序）
+        self._queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {lane: OrderedDict() for lane in LANES}
+        self._admitted = {lane: 0 for lane in LANES}
+        self._timeouts = {lane: 0 for lane in LANES}
+        self._histograms = {lane: [0] * (len(WAIT_BUCKETS_MS) + 1) for lane in LANES}
+        self._wait_total_ms = {lane: 0.0 for lane in LANES}
+        self.max_depth = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for queue in self._queues.values() for waiters in queue.values())
+
+    @asynccontextmanager
+    async def slot(self, user_key: str, lane: str, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        await self.acquire(user_key, lane, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_key: str, lane: str, timeout: Optional[float] = None) -> None:
+        lane = lane if lane in self._queues else "chat"
+        started = time.perf_counter()
+        if self.in_flight < self.max_concurrency and not self.waiting:
+            self.in_flight += 1
+            self._record_admit(lane, started)
+            return
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queues[lane].setdefault(user_key, deque()).append(future)
+        self.max_depth = max(self.max_depth, self.waiting)
+        wait = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=max(wait, 0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if future.done() and not future.cancelled():
+                # 超时/取消的同一时刻刚好被放行：把名额交还给下一个等待者
+                self.release()
+            else:
+                future.cancel()
+                self._discard(lane, user_key, future)
+            if isinstance(exc, asyncio.TimeoutError):
+                self._timeouts[lane] += 1
+                raise QueueTimeout(f"waited {wait:.1f}s for an LLM slot") from exc
+            raise
+        self._record_admit(lane, started)
+
+    def release(self) -> None:
+        """Free a slot, handing it straight to the next waiter if there is one."""
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue:
+                user_key, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                # 轮转：该用户移到队尾，空队列直接移除
+                queue.pop(user_key)
+                if waiters:
+                    queue[user_key] = waiters
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def _discard(self, lane: str, user_key: str, future: asyncio.Future) -> None:
+        waiters = self._queues[lane].get(user_key)
+        if not waiters:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            self._queues[lane].pop(user_key, None)
+
+    def _record_admit(self, lane: str, started: float) -> None:
+        waited_ms = (time.perf_counter() - started) * 1000
+        self._admitted[lane] += 1
+        self._wait_total_ms[lane] += waited_ms
+        histogram = self._histograms[lane]
+        for index, bound in enumerate(WAIT_BUCKETS_MS):
+            if waited_ms <= bound:
+                histogram[index] += 1
+                break
+        else:
+            histogram[-1] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        lanes: Dict[str, Any] = {}
+        for lane in LANES:
+            admitted = self._admitted[lane]
+            buckets: List[str] = [f"le_{bound}ms" for bound in WAIT_BUCKETS_MS] + ["gt_10000ms"]
+            lanes[lane] = {
+                "depth": sum(len(waiters) for waiters in self._queues[lane].values()),
+                "waiting_users": len(self._queues[lane]),
+                "admitted": admitted,
+                "queue_timeouts": self._timeouts[lane],
+                "wait_ms_avg": round(self._wait_total_ms[lane] / admitted, 1) if admitted else None,
+                "wait_ms_histogram": dict(zip(buckets, self._histograms[lane])),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "queue_depth_max": self.max_depth,
+            "lanes": lanes,
+        }
+
+
+admission = AdmissionController(settings.llm_max_concurrency, settings.llm_queue_timeout)
+register_metrics("llm_admission", admission.metrics)
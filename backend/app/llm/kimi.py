@@ -3,9 +3,13 @@ import json
 from typing import List, Dict, Optional
 
 from ..core.config import settings
+from .models import model_selector
+from .resilience import llm_policy
+from .transport import get_llm_transport
+from .usage import LLMCall
 
-KIMI_API_URL = "https://api.moonshot.cn/v1/chat/completions"
-KIMI_MODEL = "kimi-k2-turbo-preview"  # 使用最新的 Kimi K2 Turbo 模型
+KIMI_API_URL = f"{settings.kimi_api_base.rstrip('/')}/chat/completions"  # 由 KIMI_API_BASE 配置
+KIMI_MODEL = "kimi-k2-turbo-preview"  # 默认模型；实际模型由 model_selector 按 KIMI_LIGHT_MODELS 选择
 
 # 定义转人工工具
 TRANSFER_TO_AGENT_TOOL = {
@@ -49,35 +53,106 @@ class KimiResponse:
         return None
 
 
+class ToolCallAssembler:
+    """
+    流式 tool_calls 组装器
+
+    流式响应里同一个工具调用会被拆成多个 delta（按 index 区分，arguments 分片到达）。
+    feed() 按 index 合并分片，并在某个调用的 arguments 已是完整 JSON 时立即返回该调用，
+    调用方可以提前执行工具。不同 index 的分片可能交错到达，所以后续 index 开始
+    并不代表之前的调用已经传完；arguments 不完整的调用留给 finish()。
+    """
+
+    def __init__(self):
+        self._calls: Dict[int, Dict] = {}
+        self._emitted: set = set()
+
+    def feed(self, deltas: Optional[List[Dict]]) -> List[Dict]:
+        """合并一批 delta，返回本次新完成的工具调用"""
+        completed: List[Dict] = []
+        for delta in deltas or []:
+            index = delta.get("index")
+            if index is None:
+                index = max(self._calls) + 1 if self._calls else 0
+            call = self._calls.setdefault(
+                index,
+                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if delta.get("id"):
+                call["id"] = delta["id"]
+            if delta.get("type"):
+                call["type"] = delta["type"]
+            function = delta.get("function") or {}
+            if function.get("name") and not call["function"]["name"]:
+                call["function"]["name"] = function["name"]
+            if function.get("arguments"):
+                call["function"]["arguments"] += function["arguments"]
+
+            if index not in self._emitted and self._arguments_complete(call):
+                completed.append(self._emit(index))
+        return completed
+
+    def finish(self) -> List[Dict]:
+        """流结束时调用，返回尚未完成通知的工具调用"""
+        return [self._emit(index) for index in sorted(self._calls) if index not in self._emitted]
+
+    @property
+    def tool_calls(self) -> List[Dict]:
+        return [self._calls[index] for index in sorted(self._calls)]
+
+    def _emit(self, index: int) -> Dict:
+        self._emitted.add(index)
+        call = self._calls[index]
+        if not call["id"]:
+            call["id"] = f"call_{index}"
+        return call
+
+    @staticmethod
+    def _arguments_complete(call: Dict) -> bool:
+        arguments = call["function"]["arguments"].strip()
+        if not call["function"]["name"] or not arguments.endswith("}"):
+            return False
+        try:
+            return isinstance(json.loads(arguments), dict)
+        except json.JSONDecodeError:
+            return False
+
+
 async def chat_completion(
     messages: List[Dict[str, str]],
     temperature: float = 0.6,  # Kimi 推荐 0.6
     max_tokens: int = 1024,
     enable_tools: bool = True,  # 是否启用工具调用
+    call_site: str = "kimi.chat",  # 用于 LLM_CALL 统计的调用点标识
 ) -> KimiResponse:
     if not settings.kimi_api_key:
         raise KimiError("Kimi API key is not configured")
 
+    tools = [TRANSFER_TO_AGENT_TOOL] if enable_tools else None
+    choice = model_selector.select(messages, tools, max_tokens=max_tokens, profile="light")
     payload = {
-        "model": KIMI_MODEL,
+        "model": choice.model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
     
     # 添加工具定义
-    if enable_tools:
-        payload["tools"] = [TRANSFER_TO_AGENT_TOOL]
+    if tools:
+        payload["tools"] = tools
     
-    headers = {
-        "Authorization": f"Bearer {settings.kimi_api_key}",
-        "Content-Type": "application/json",
-    }
-
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(KIMI_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
+    llm_call = LLMCall(call_site, choice.model, choice=choice)
+    try:
+        # 重试、对冲、熔断和整体截止时间统一由 llm_policy 处理
+        data = await llm_policy.call(
+            lambda timeout: get_llm_transport().post_json(KIMI_API_URL, payload, timeout=timeout),
+            call_site,
+            llm_call=llm_call,
+        )
+    except Exception as exc:
+        llm_call.finish(error=exc)
+        raise
+    llm_call.finish(data)
 
     try:
         choice = data["choices"][0]
@@ -90,65 +165,88 @@ async def chat_completion(
         raise KimiError("Invalid response from Kimi API") from exc
 
 
+async def iter_chat_chunks(
+    url: str,
+    payload: Dict,
+    timeout: Optional[httpx.Timeout] = None,
+    llm_call: Optional[LLMCall] = None,
+):
+    """发起流式请求，逐个返回解析后的 SSE chunk（dict）；传入 llm_call 时记录首 token 时间和用量"""
+    async with get_llm_transport().stream(url, payload, timeout=timeout) as response:
+        async for line in response.aiter_lines():
+            line = line.strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                # 跳过解析错误的行
+                continue
+            if not isinstance(chunk, dict):
+                continue
+            if llm_call is not None:
+                delta = (chunk.get("choices") or [{}])[0].get("delta") or {}
+                if delta.get("content") or delta.get("tool_calls"):
+                    llm_call.mark_first_token()
+                llm_call.observe_chunk(chunk)
+            yield chunk
+
+
 async def chat_completion_stream(
     messages: List[Dict[str, str]],
     temperature: float = 0.6,
     max_tokens: int = 1024,
     enable_tools: bool = True,
+    call_site: str = "kimi.stream",
 ):
     """流式调用 Kimi API，逐步返回响应内容"""
     if not settings.kimi_api_key:
         raise KimiError("Kimi API key is not configured")
 
+    tools = [TRANSFER_TO_AGENT_TOOL] if enable_tools else None
+    choice = model_selector.select(messages, tools, max_tokens=max_tokens, profile="light")
     payload = {
-        "model": KIMI_MODEL,
+        "model": choice.model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
         "stream": True,  # 启用流式响应
     }
     
-    if enable_tools:
-        payload["tools"] = [TRANSFER_TO_AGENT_TOOL]
+    if tools:
+        payload["tools"] = tools
     
-    headers = {
-        "Authorization": f"Bearer {settings.kimi_api_key}",
-        "Content-Type": "application/json",
-    }
+    full_content = ""
+    assembler = ToolCallAssembler()
+    llm_call = LLMCall(call_site, choice.model, stream=True, choice=choice)
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        async with client.stream("POST", KIMI_API_URL, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            
-            full_content = ""
-            tool_calls = []
-            
-            async for line in response.aiter_lines():
-                if not line.strip() or line.strip() == "data: [DONE]":
-                    continue
-                
-                if line.startswith("data: "):
-                    try:
-                        data = line[6:]  # 去掉 "data: " 前缀
-                        chunk = json.loads(data) if data.startswith("{") else None
-                        if not chunk:
-                            continue
-                        
-                        delta = chunk.get("choices", [{}])[0].get("delta", {})
-                        content_chunk = delta.get("content", "")
-                        
-                        if content_chunk:
-                            full_content += content_chunk
-                            yield {"type": "content", "data": content_chunk}
-                        
-                        # 检查工具调用
-                        if "tool_calls" in delta:
-                            tool_calls = delta["tool_calls"]
-                            yield {"type": "tool_calls", "data": tool_calls}
-                    
-                    except Exception as e:
-                        # 跳过解析错误的行
-                        continue
-            
-            # 流式结束，返回完整内容和工具调用
-            yield {"type": "done", "content": full_content, "tool_calls": tool_calls}
+    try:
+        chunks = llm_policy.stream(
+            lambda timeout: iter_chat_chunks(KIMI_API_URL, payload, timeout=timeout, llm_call=llm_call),
+            call_site,
+            llm_call=llm_call,
+        )
+        async for chunk in chunks:
+            delta = (chunk.get("choices") or [{}])[0].get("delta", {})
+            content_chunk = delta.get("content", "")
+
+            if content_chunk:
+                full_content += content_chunk
+                yield {"type": "content", "data": content_chunk}
+
+            # 工具调用：某个调用的参数一旦完整就立即通知调用方
+            for call in assembler.feed(delta.get("tool_calls")):
+                yield {"type": "tool_call_complete", "data": call}
+    except BaseException as exc:
+        llm_call.finish(error=exc)
+        raise
+    llm_call.finish()
+
+    for call in assembler.finish():
+        yield {"type": "tool_call_complete", "data": call}
+
+    # 流式结束，返回完整内容和工具调用
+    yield {"type": "done", "content": full_content, "tool_calls": assembler.tool_calls}
@@ -0,0 +1,212 @@
+"""
+Model tiering for Kimi calls.
+
+Each call site asks the selector for a model instead of hardcoding one. The
+selector estimates the prompt size, keeps only the tiers whose context window
+fits prompt + completion, and takes the smallest (fastest) of those. Per-model
+latency and error rates are tracked from finished LLM calls; a model whose
+recent error rate or p90 latency crosses the limits is skipped in favour of the
+next tier until its samples age out of the window.
+"""
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+
+# 已知模型的上下文窗口（token）；未列出的模型按名称中的 "8k/32k/128k" 推断
+CONTEXT_WINDOWS = {
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+    "kimi-k2-turbo-preview": 262144,
+}
+DEFAULT_CONTEXT_WINDOW = 131072
+
+# 估算偏差的安全系数
+ESTIMATE_SAFETY_FACTOR = 1.15
+
+# 健康统计：每个模型保留最近的样本，超过窗口时长的样本不再参与判断
+HEALTH_WINDOW_SECONDS = 300.0
+HEALTH_MAX_SAMPLES = 100
+HEALTH_MIN_SAMPLES = 5
+
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: one token per CJK character, ~4 characters per token otherwise."""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]], tools: Optional[List[Dict]] = None) -> int:
+    """Estimate the prompt size of a chat request, including tool schemas and tool_call arguments."""
+    total = 0
+    for message in messages:
+        total += estimate_tokens(str(message.get("content") or "")) + _MESSAGE_OVERHEAD_TOKENS
+        if message.get("tool_calls"):
+            total += estimate_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    if tools:
+        total += estimate_tokens(json.dumps(tools, ensure_ascii=False))
+    return total
+
+
+def context_window(model: str) -> int:
+    if model in CONTEXT_WINDOWS:
+        return CONTEXT_WINDOWS[model]
+    match = re.search(r"(\d+)k\b", model)
+    return int(match.group(1)) * 1024 if match else DEFAULT_CONTEXT_WINDOW
+
+
+def _parse_tiers(value: str) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+@dataclass(frozen=True)
+class ModelChoice:
+    model: str
+    estimated_tokens: int
+    context_window: int
+    reason: str
+
+    def as_payload(self) -> Dict[str, Any]:
+        return {
+            "model_reason": self.reason,
+            "estimated_prompt_tokens": self.estimated_tokens,
+            "context_window": self.context_window,
+        }
+
+
+class ModelHealth:
+    """Sliding window of (timestamp, latency_ms, failed) samples for one model."""
+
+    def __init__(self):
+        self.samples: Deque[Tuple[float, float, bool]] = deque(maxlen=HEALTH_MAX_SAMPLES)
+        self.calls = 0
+        self.errors = 0
+        self.selected = 0
+
+    def add(self, latency_ms: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += 1 if failed else 0
+        self.samples.append((time.monotonic(), latency_ms, failed))
+
+    def recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - HEALTH_WINDOW_SECONDS
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return list(self.samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = self.recent()
+        latencies = sorted(sample[1] for sample in recent if not sample[2])
+        failures = sum(1 for sample in recent if sample[2])
+        return {
+            "samples": len(recent),
+            "error_rate": round(failures / len(recent), 4) if recent else None,
+            "latency_ms_p50": _pick(latencies, 0.5),
+            "latency_ms_p90": _pick(latencies, 0.9),
+        }
+
+
+def _pick(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+
+class ModelSelector:
+    """Chooses a model per call from a named tier list and tracks per-model health."""
+
+    def __init__(self):
+        self._health: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def tiers(self, profile: str) -> List[str]:
+        if profile == "agent":
+            return _parse_tiers(settings.kimi_agent_models) or ["moonshot-v1-128k"]
+        return _parse_tiers(settings.kimi_light_models) or ["kimi-k2-turbo-preview"]
+
+    def select(
+        self,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict]] = None,
+        max_tokens: Optional[int] = None,
+        profile: str = "agent",
+    ) -> ModelChoice:
+        """
+        Pick the smallest healthy tier whose context window fits the request.
+
+        profile: "agent" (QA agent turns, KIMI_AGENT_MODELS) or "light"
+        (router / summaries, KIMI_LIGHT_MODELS). Tiers are listed smallest first.
+        """
+        estimated = estimate_prompt_tokens(messages, tools)
+        needed = int(estimated * ESTIMATE_SAFETY_FACTOR) + (max_tokens or settings.kimi_completion_reserve)
+        tiers = self.tiers(profile)
+        fitting = [model for model in tiers if context_window(model) >= needed]
+
+        if not fitting:
+            # 估算超出所有模型：交给最大的模型，由上下文预算截断兜底
+            model = max(tiers, key=context_window)
+            choice = ModelChoice(model, estimated, context_window(model), "overflow")
+        else:
+            healthy = [model for model in fitting if not self.is_degraded(model)]
+            if not healthy:
+                model, reason = fitting[0], "all_degraded"
+            elif healthy[0] == fitting[0]:
+                model, reason = fitting[0], "smallest_fit"
+            else:
+                model = healthy[0]
+                skipped = fitting[:fitting.index(model)]
+                reason = f"skipped_degraded:{','.join(skipped)}"
+            choice = ModelChoice(model, estimated, context_window(model), reason)
+
+        with self._lock:
+            self._health.setdefault(choice.model, ModelHealth()).selected += 1
+        return choice
+
+    def observe(self, model: str, latency_ms: float, failed: bool) -> None:
+        """Feed one finished call (latency = TTFT for streams, total latency otherwise)."""
+        with self._lock:
+            self._health.setdefault(model, ModelHealth()).add(latency_ms, failed)
+
+    def is_degraded(self, model: str) -> bool:
+        with self._lock:
+            health = self._health.get(model)
+            if health is None:
+                return False
+            snapshot = health.snapshot()
+        if snapshot["samples"] < HEALTH_MIN_SAMPLES:
+            return False
+        if snapshot["error_rate"] is not None and snapshot["error_rate"] >= settings.kimi_model_error_threshold:
+            return True
+        p90 = snapshot["latency_ms_p90"]
+        return p90 is not None and p90 > settings.kimi_model_latency_slo_ms
+
+    def metrics(self) -> Dict[str, Any]:
+        snapshot = {}
+        with self._lock:
+            for model, health in self._health.items():
+                snapshot[model] = {
+                    "selected": health.selected,
+                    "calls": health.calls,
+                    "errors": health.errors,
+                    **health.snapshot(),
+                }
+        for model in snapshot:
+            snapshot[model]["degraded"] = self.is_degraded(model)
+        return snapshot
+
+
+model_selector = ModelSelector()
+register_metrics("llm_models", model_selector.metrics)
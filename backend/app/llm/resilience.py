@@ -0,0 +1,416 @@
+"""
+One retry / hedging / circuit-breaker policy for every Kimi call.
+
+- Deadline: each user request gets an overall LLM budget (LLM_REQUEST_DEADLINE,
+  bound in set_llm_context). Queueing, retries, per-attempt timeouts and a
+  stream's time to first chunk never run past it. Once a stream has produced
+  its first chunk the deadline no longer applies, so a long answer is not cut
+  off halfway; instead each following chunk must arrive within
+  LLM_STREAM_IDLE_TIMEOUT.
+- Retries: connection errors, timeouts, 429 and 5xx are retried with exponential
+  backoff (LLM_MAX_ATTEMPTS); other 4xx errors are raised immediately.
+- Hedging: when an attempt has not answered (or, for streams, produced its first
+  chunk) within the recent p95 latency of its call site, a duplicate request is
+  sent and whichever answers first wins; the other is cancelled.
+- Circuit breaker: after LLM_BREAKER_FAILURE_THRESHOLD consecutive upstream
+  failures calls fail fast with LLMUnavailableError for LLM_BREAKER_RESET_SECONDS,
+  then a single probe decides whether to close again. Callers turn that error
+  into a human handoff instead of making the user wait.
+- Admission: every logical call first takes a slot from the admission
+  controller (app/llm/admission.py) and holds it across retries and hedges.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+from .admission import QueueTimeout, admission
+from .usage import LLMCall, get_llm_context
+
+T = TypeVar("T")
+
+# 计算对冲阈值所需的最少样本数
+HEDGE_MIN_SAMPLES = 20
+LATENCY_SAMPLES = 200
+
+
+class LLMUnavailableError(Exception):
+    """The LLM cannot answer in time (breaker open or deadline spent); hand the user to a human."""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half_open (one probe) -> closed/open."""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probe_started = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            # 探测请求被取消时不会回报结果，超过 reset_seconds 视为丢失，允许下一次探测
+            stale = time.monotonic() - self._probe_started >= self.reset_seconds
+            if not self._probe_in_flight or stale:
+                self._probe_in_flight = True
+                self._probe_started = time.monotonic()
+                return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print("[LLM breaker] probe succeeded, closing")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                print(f"[LLM breaker] opening after {self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+class LLMPolicy:
+    """Runs LLM requests under the shared deadline / retry / hedge / breaker policy."""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            settings.llm_breaker_failure_threshold,
+            settings.llm_breaker_reset_seconds,
+        )
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+            "stream_stalls": 0,
+            "queue_timeouts": 0,
+        }
+
+    # ---- helpers -------------------------------------------------------
+
+    def _deadline(self) -> float:
+        deadline = get_llm_context().deadline
+        return deadline if deadline is not None else time.monotonic() + settings.llm_request_deadline
+
+    def _remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._stats["deadline_exceeded"] += 1
+            raise LLMUnavailableError("LLM request deadline exceeded", "deadline")
+        return remaining
+
+    def _attempt_timeout(self, remaining: float) -> httpx.Timeout:
+        total = min(settings.llm_attempt_timeout, remaining)
+        return httpx.Timeout(total, connect=min(10.0, total))
+
+    def _stream_timeout(self, remaining: float) -> httpx.Timeout:
+        # httpx 的 read 超时是单次读取的间隔；首个分片的总等待由 _hedged_first_chunk 按截止时间控制
+        return httpx.Timeout(settings.llm_stream_idle_timeout, connect=min(10.0, remaining))
+
+    @asynccontextmanager
+    async def _admitted(self, deadline: float) -> AsyncIterator[None]:
+        """Hold one admission slot for the whole logical call (retries and hedges included)."""
+        ctx = get_llm_context()
+        user_key = ctx.user_id or ctx.conversation_id or "anonymous"
+        try:
+            await admission.acquire(user_key, ctx.lane, timeout=self._remaining(deadline))
+        except QueueTimeout as exc:
+            self._stats["queue_timeouts"] += 1
+            raise LLMUnavailableError("LLM admission queue is full", "queue_timeout") from exc
+        try:
+            yield
+        finally:
+            admission.release()
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            raise LLMUnavailableError("LLM circuit breaker is open", "circuit_open")
+
+    def hedge_delay(self, call_site: str) -> Optional[float]:
+        """Recent latency percentile for call_site (seconds), or None while there is too little data."""
+        if not settings.llm_hedge_enabled or admission.waiting:
+            # 有请求在排队时不发对冲请求，避免进一步放大负载
+            return None
+        samples = self._latencies.get(call_site)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(settings.llm_hedge_percentile / 100 * len(ordered)))
+        return max(ordered[index], settings.llm_hedge_min_delay)
+
+    def _observe_latency(self, call_site: str, seconds: float) -> None:
+        self._latencies.setdefault(call_site, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    async def _backoff(self, attempt: int, deadline: float, exc: BaseException, call_site: str) -> None:
+        wait = min(2 ** (attempt - 1), max(deadline - time.monotonic() - 1.0, 0.0))
+        print(f"[LLM policy] {call_site} attempt {attempt} failed ({exc!r}), retrying in {wait:.1f}s")
+        self._stats["retries"] += 1
+        await asyncio.sleep(wait)
+
+    def _on_failure(self, exc: BaseException, attempt: int, max_attempts: int, deadline: float) -> bool:
+        """Record a failed attempt; True when another attempt is allowed."""
+        if isinstance(exc, LLMUnavailableError):
+            return False
+        if not is_retryable(exc):
+            # 上游有响应（如 400），说明服务可达
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        return attempt < max_attempts and deadline - time.monotonic() > 1.0 and self.breaker.state != "open"
+
+    # ---- request / response ---------------------------------------------
+
+    async def call(
+        self,
+        send: Callable[[httpx.Timeout], Awaitable[T]],
+        call_site: str,
+        llm_call: Optional[LLMCall] = None,
+        max_attempts: Optional[int] = None,
+    ) -> T:
+        """Run send(timeout) with retries and hedging; send must be safe to issue twice."""
+        max_attempts = max_attempts or settings.llm_max_attempts
+        deadline = self._deadline()
+        self._stats["calls"] += 1
+        async with self._admitted(deadline):
+            attempt = 0
+            while True:
+                attempt += 1
+                self._check_breaker()
+                remaining = self._remaining(deadline)
+                started = time.monotonic()
+                try:
+                    result = await self._hedged_call(send, call_site, remaining)
+                except Exception as exc:
+                    if not self._on_failure(exc, attempt, max_attempts, deadline):
+                        if isinstance(exc, asyncio.TimeoutError):
+                            self._stats["deadline_exceeded"] += 1
+                            raise LLMUnavailableError("LLM request deadline exceeded", "deadline") from exc
+                        raise
+                    if llm_call is not None:
+                        llm_call.mark_retry()
+                    await self._backoff(attempt, deadline, exc, call_site)
+                    continue
+                self.breaker.record_success()
+                self._observe_latency(call_site, time.monotonic() - started)
+                return result
+
+    async def _hedged_call(self, send: Callable[[httpx.Timeout], Awaitable[T]], call_site: str, remaining: float) -> T:
+        timeout = self._attempt_timeout(remaining)
+        delay = self.hedge_delay(call_site)
+        primary = asyncio.ensure_future(send(timeout))
+        if delay is None or delay >= remaining:
+            return await asyncio.wait_for(primary, remaining)
+
+        tasks = {primary}
+        backup = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self._stats["hedges"] += 1
+                backup = asyncio.ensure_future(send(self._attempt_timeout(remaining - delay)))
+                tasks.add(backup)
+            end = time.monotonic() + remaining - delay
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, timeout=max(end - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error  # type: ignore[misc]
+        finally:
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    # ---- streaming ------------------------------------------------------
+
+    async def stream(
+        self,
+        open_stream: Callable[[httpx.Timeout], AsyncIterator[Dict]],
+        call_site: str,
+        llm_call: Optional[LLMCall] = None,
+        max_attempts: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Yield chunks from open_stream(timeout).
+
+        Retries, hedging and the request deadline only apply before the first
+        chunk: once text has reached the user the stream is never restarted,
+        and it is only abandoned when no chunk arrives for
+        LLM_STREAM_IDLE_TIMEOUT.
+        """
+        max_attempts = max_attempts or settings.llm_max_attempts
+        deadline = self._deadline()
+        self._stats["calls"] += 1
+        async with self._admitted(deadline):
+            attempt = 0
+            while True:
+                attempt += 1
+                self._check_breaker()
+                remaining = self._remaining(deadline)
+                started = time.monotonic()
+                try:
+                    iterator, first = await self._hedged_first_chunk(open_stream, call_site, remaining)
+                except StopAsyncIteration:
+                    self.breaker.record_success()
+                    return
+                except Exception as exc:
+                    if not self._on_failure(exc, attempt, max_attempts, deadline):
+                        if isinstance(exc, asyncio.TimeoutError):
+                            self._stats["deadline_exceeded"] += 1
+                            raise LLMUnavailableError("LLM stream produced nothing before the deadline", "deadline") from exc
+                        raise
+                    if llm_call is not None:
+                        llm_call.mark_retry()
+                    await self._backoff(attempt, deadline, exc, call_site)
+                    continue
+                break
+
+            self.breaker.record_success()
+            self._observe_latency(call_site, time.monotonic() - started)
+            try:
+                yield first
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), settings.llm_stream_idle_timeout)
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.TimeoutError as exc:
+                        self._stats["stream_stalls"] += 1
+                        self.breaker.record_failure()
+                        raise LLMUnavailableError(
+                            f"LLM stream stalled for {settings.llm_stream_idle_timeout:.0f}s", "stream_stalled"
+                        ) from exc
+                    except Exception as exc:
+                        if is_retryable(exc):
+                            self.breaker.record_failure()
+                        raise
+                    yield chunk
+            finally:
+                await iterator.aclose()
+
+    async def _hedged_first_chunk(
+        self,
+        open_stream: Callable[[httpx.Timeout], AsyncIterator[Dict]],
+        call_site: str,
+        remaining: float,
+    ):
+        """Open the stream (and a hedge if it is slow); return (winning iterator, its first chunk)."""
+        streams = {}
+
+        def start(timeout: httpx.Timeout) -> asyncio.Future:
+            iterator = open_stream(timeout).__aiter__()
+            task = asyncio.ensure_future(iterator.__anext__())
+            streams[task] = iterator
+            return task
+
+        primary = start(self._stream_timeout(remaining))
+        delay = self.hedge_delay(call_site)
+        winner = None
+        try:
+            pending = {primary}
+            end = time.monotonic() + remaining
+            if delay is not None and delay < remaining:
+                done, pending = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self._stats["hedges"] += 1
+                    pending.add(start(self._stream_timeout(remaining - delay)))
+                else:
+                    pending = done
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(end - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is not primary:
+                            self._stats["hedge_wins"] += 1
+                        return streams[task], task.result()
+                    error = task.exception()
+            raise error  # type: ignore[misc]
+        finally:
+            for task, iterator in streams.items():
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except BaseException:
+                        pass
+                try:
+                    await iterator.aclose()
+                except Exception:
+                    pass
+
+    def metrics(self) -> Dict[str, Any]:
+        hedges = self._stats["hedges"]
+        return {
+            **self._stats,
+            "hedge_win_rate": round(self._stats["hedge_wins"] / hedges, 4) if hedges else None,
+            "breaker": self.breaker.snapshot(),
+            "hedge_delay_s": {
+                call_site: round(delay, 3)
+                for call_site in self._latencies
+                if (delay := self.hedge_delay(call_site)) is not None
+            },
+        }
+
+
+llm_policy = LLMPolicy()
+register_metrics("llm_resilience", llm_policy.metrics)
@@ -0,0 +1,231 @@
+"""
+Shared HTTP transport for all Kimi / Moonshot calls.
+
+One pooled httpx.AsyncClient lives for the whole process so every LLM call
+reuses warm keep-alive connections instead of paying DNS + TCP + TLS per turn.
+The client is opened on FastAPI startup and closed on shutdown; scripts that
+never run the app get a lazily created client on first use.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from ..core.config import settings
+from ..core.metrics import register_metrics
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _RequestTrace:
+    """httpcore trace hook: tells whether a request opened a new connection and how long it waited for one."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.acquired_at: Optional[float] = None
+        self.new_connection = False
+
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        if self.acquired_at is None:
+            self.acquired_at = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            self.new_connection = True
+
+    @property
+    def queue_wait(self) -> float:
+        if self.acquired_at is None:
+            return 0.0
+        return self.acquired_at - self.started_at
+
+
+class LLMTransport:
+    """Pooled async client plus connection-pool metrics."""
+
+    def __init__(
+        self,
+        verify: bool = True,
+        http2: bool = False,
+        max_connections: int = 50,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        timeout: float = 120.0,
+        connect_timeout: float = 10.0,
+    ):
+        self.verify = verify
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            print("[llm transport] KIMI_HTTP2 requested but 'h2' is not installed; using HTTP/1.1")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.requests_total = 0
+        self.errors_total = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                verify=self.verify,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    async def start(self) -> None:
+        _ = self.client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    @staticmethod
+    def _headers() -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {settings.kimi_api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def _begin(self) -> _RequestTrace:
+        self.requests_total += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return _RequestTrace()
+
+    def _finish(self, trace: _RequestTrace, failed: bool) -> None:
+        self.in_flight -= 1
+        if failed:
+            self.errors_total += 1
+        if trace.acquired_at is None:
+            return
+        if trace.new_connection:
+            self.new_connections += 1
+        else:
+            self.reused_connections += 1
+        wait = trace.queue_wait
+        self.queue_wait_total += wait
+        self.queue_wait_max = max(self.queue_wait_max, wait)
+
+    async def post_json(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        timeout: Optional[httpx.Timeout] = None,
+    ) -> Dict[str, Any]:
+        """POST a JSON payload and return the decoded JSON body (raises on HTTP errors)."""
+        trace = self._begin()
+        failed = True
+        try:
+            response = await self.client.post(
+                url,
+                headers=self._headers(),
+                json=payload,
+                timeout=timeout or self.timeout,
+                extensions={"trace": trace},
+            )
+            response.raise_for_status()
+            data = response.json()
+            failed = False
+            return data
+        finally:
+            self._finish(trace, failed)
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        timeout: Optional[httpx.Timeout] = None,
+    ) -> AsyncIterator[httpx.Response]:
+        """Open a streaming POST; the connection returns to the pool when the block exits."""
+        trace = self._begin()
+        failed = True
+        try:
+            request = self.client.build_request(
+                "POST",
+                url,
+                headers=self._headers(),
+                json=payload,
+                timeout=timeout or self.timeout,
+                extensions={"trace": trace},
+            )
+            response = await self.client.send(request, stream=True)
+            try:
+                response.raise_for_status()
+                yield response
+                failed = False
+            finally:
+                await response.aclose()
+        finally:
+            self._finish(trace, failed)
+
+    def _pool_connections(self) -> Optional[int]:
+        # httpx does not expose pool state publicly; best effort through httpcore.
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        return len(connections) if connections is not None else None
+
+    def metrics(self) -> Dict[str, Any]:
+        acquired = self.new_connections + self.reused_connections
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "pool_connections": self._pool_connections(),
+            "in_use": self.in_flight,
+            "max_in_use": self.max_in_flight,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_ratio": round(self.reused_connections / acquired, 4) if acquired else None,
+            "queue_wait_avg_ms": round(self.queue_wait_total / acquired * 1000, 3) if acquired else None,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 3),
+        }
+
+
+_transport: Optional[LLMTransport] = None
+
+
+def get_llm_transport() -> LLMTransport:
+    global _transport
+    if _transport is None:
+        _transport = LLMTransport(
+            verify=settings.kimi_verify_ssl,
+            http2=settings.kimi_http2,
+            max_connections=settings.kimi_max_connections,
+            max_keepalive_connections=settings.kimi_max_keepalive_connections,
+            keepalive_expiry=settings.kimi_keepalive_expiry,
+        )
+        register_metrics("llm_transport", _transport.metrics)
+    return _transport
+
+
+async def startup_llm_transport() -> None:
+    await get_llm_transport().start()
+
+
+async def shutdown_llm_transport() -> None:
+    if _transport is not None:
+        await _transport.aclose()
@@ -0,0 +1,327 @@
+"""
+Per-call LLM accounting.
+
+Every Kimi call is wrapped in an LLMCall which records model, token usage,
+time to first token, total latency, retry count and finish reason as an
+LLM_CALL row in agent_events. The conversation / user / API route come from a
+context variable set once per request, so call sites deep inside agents do not
+need them threaded through.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.executors import get_tool_executor
+from ..core.metrics import register_metrics
+from .models import ModelChoice, estimate_tokens, model_selector
+
+
+@dataclass(frozen=True)
+class LLMRequestContext:
+    conversation_id: Optional[str] = None
+    user_id: Optional[str] = None
+    route: str = "unknown"
+    trace_id: str = ""
+    # time.monotonic() 时刻；该请求内所有 LLM 调用（含重试）都不超过它
+    deadline: Optional[float] = None
+    # 准入队列的优先级通道（见 app/llm/admission.py）；请求之外的调用默认走 background
+    lane: str = "background"
+
+
+_request_context: ContextVar[LLMRequestContext] = ContextVar("llm_request_context", default=LLMRequestContext())
+
+_totals: Dict[str, Dict[str, float]] = {}
+_repo = None
+
+
+def set_llm_context(
+    conversation_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    route: str = "unknown",
+    deadline_seconds: Optional[float] = None,
+    lane: Optional[str] = None,
+) -> None:
+    """Bind the current request (and tasks it spawns) to a conversation for LLM accounting, deadlines and admission."""
+    _request_context.set(
+        LLMRequestContext(
+            conversation_id=conversation_id,
+            user_id=user_id,
+            route=route,
+            trace_id=str(uuid.uuid4()),
+            deadline=time.monotonic() + (deadline_seconds or settings.llm_request_deadline),
+            lane=lane or ("chat" if user_id else "anonymous"),
+        )
+    )
+
+
+def use_background_llm_context() -> None:
+    """Inside a background task: keep accounting on the request's conversation, but queue as background with a fresh deadline."""
+    _request_context.set(
+        replace(
+            _request_context.get(),
+            lane="background",
+            deadline=time.monotonic() + settings.llm_request_deadline,
+        )
+    )
+
+
+def get_llm_context() -> LLMRequestContext:
+    return _request_context.get()
+
+
+def extract_usage(data: Optional[Dict[str, Any]]) -> Dict[str, Optional[int]]:
+    """Read token usage from a completion body or final stream chunk (Moonshot puts it on the choice)."""
+    if not data:
+        return {}
+    usage = data.get("usage")
+    if not usage:
+        choices = data.get("choices") or []
+        usage = choices[0].get("usage") if choices and isinstance(choices[0], dict) else None
+    if not usage:
+        return {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+    }
+
+
+class LLMCall:
+    """Timer for one logical LLM call (including its retries)."""
+
+    def __init__(self, call_site: str, model: str, stream: bool = False, choice: Optional[ModelChoice] = None):
+        self.call_site = call_site
+        self.model = model
+        self.stream = stream
+        self.choice = choice
+        self.context = get_llm_context()
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.retries = 0
+        self.usage: Dict[str, Optional[int]] = {}
+        self.finish_reason: Optional[str] = None
+        # 已流式收到的文本（内容 + 工具参数），用于估算取消时省下的 completion tokens
+        self.streamed_chars: List[str] = []
+        self._finished = False
+
+    def mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def mark_retry(self) -> None:
+        self.retries += 1
+
+    def observe_chunk(self, chunk: Dict[str, Any]) -> None:
+        """Feed a streamed chunk: picks up usage and finish_reason when they appear."""
+        usage = extract_usage(chunk)
+        if usage:
+            self.usage = usage
+        choices = chunk.get("choices") or []
+        delta = (choices[0].get("delta") or {}) if choices else {}
+        if delta.get("content"):
+            self.streamed_chars.append(delta["content"])
+        for call in delta.get("tool_calls") or []:
+            self.streamed_chars.append((call.get("function") or {}).get("arguments") or "")
+        if choices and choices[0].get("finish_reason"):
+            self.finish_reason = choices[0]["finish_reason"]
+
+    def finish(
+        self,
+        data: Optional[Dict[str, Any]] = None,
+        finish_reason: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        if data:
+            self.usage = extract_usage(data) or self.usage
+            choices = data.get("choices") or []
+            if choices and not finish_reason:
+                finish_reason = choices[0].get("finish_reason")
+        if finish_reason:
+            self.finish_reason = finish_reason
+
+        ended_at = time.perf_counter()
+        payload = {
+            "call_site": self.call_site,
+            "route": self.context.route,
+            "model": self.model,
+            "stream": self.stream,
+            "prompt_tokens": self.usage.get("prompt_tokens"),
+            "completion_tokens": self.usage.get("completion_tokens"),
+            "total_tokens": self.usage.get("total_tokens"),
+            "ttft_ms": round((self.first_token_at - self.started_at) * 1000, 1) if self.first_token_at else None,
+            "latency_ms": round((ended_at - self.started_at) * 1000, 1),
+            "retries": self.retries,
+            "finish_reason": self.finish_reason,
+            "error": str(error)[:300] if error else None,
+        }
+        if self.choice is not None:
+            payload.update(self.choice.as_payload())
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # 客户端断开导致的取消：按该调用点的平均 completion 长度估算没生成的部分
+            payload["cancelled"] = True
+            payload["saved_tokens_est"] = max(
+                0, _avg_completion_tokens(self.call_site) - estimate_tokens("".join(self.streamed_chars))
+            )
+        else:
+            # 流式调用以首 token 时间衡量模型快慢，非流式用总耗时
+            model_latency = payload["ttft_ms"] if self.stream and payload["ttft_ms"] is not None else payload["latency_ms"]
+            model_selector.observe(self.model, model_latency, error is not None)
+        _accumulate(payload)
+        _write_event(self.context, payload)
+
+
+def _avg_completion_tokens(call_site: str) -> int:
+    totals = _totals.get(call_site)
+    if not totals or not totals["usage_calls"]:
+        return 0
+    return int(totals["completion_tokens"] / totals["usage_calls"])
+
+
+def _accumulate(payload: Dict[str, Any]) -> None:
+    totals = _totals.setdefault(
+        payload["call_site"],
+        {
+            "calls": 0,
+            "errors": 0,
+            "cancelled": 0,
+            "usage_calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "saved_tokens_est": 0,
+            "latency_ms": 0.0,
+            "retries": 0,
+        },
+    )
+    totals["calls"] += 1
+    totals["errors"] += 1 if payload["error"] and not payload.get("cancelled") else 0
+    totals["cancelled"] += 1 if payload.get("cancelled") else 0
+    totals["usage_calls"] += 1 if payload["completion_tokens"] is not None else 0
+    totals["prompt_tokens"] += payload["prompt_tokens"] or 0
+    totals["completion_tokens"] += payload["completion_tokens"] or 0
+    totals["saved_tokens_est"] += payload.get("saved_tokens_est") or 0
+    totals["latency_ms"] += payload["latency_ms"]
+    totals["retries"] += payload["retries"]
+
+
+def _write_event(context: LLMRequestContext, payload: Dict[str, Any]) -> None:
+    # agent_events.user_id is NOT NULL; calls outside a user request only feed the in-process totals.
+    if not context.user_id:
+        return
+
+    def write() -> None:
+        global _repo
+        try:
+            if _repo is None:
+                from ..db.repo import Repository
+
+                _repo = Repository.from_env()
+            _repo.log_event(
+                trace_id=context.trace_id or str(uuid.uuid4()),
+                event_type="LLM_CALL",
+                payload=payload,
+                conversation_id=context.conversation_id,
+                user_id=context.user_id,
+            )
+        except Exception as exc:
+            print(f"[llm usage] failed to log LLM_CALL: {exc}")
+
+    get_tool_executor().submit(write)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 1)
+
+
+def aggregate_llm_calls(rows: List[Dict[str, Any]], group_by: str) -> List[Dict[str, Any]]:
+    """
+    Aggregate LLM_CALL agent_events rows.
+
+    group_by: "conversation", "route", "call_site", "model" or "hour" (UTC, by created_at).
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        payload = row.get("payload") or {}
+        if group_by == "conversation":
+            key = row.get("conversation_id") or "-"
+        elif group_by == "hour":
+            key = str(row.get("created_at") or "")[:13] + ":00"
+        else:
+            key = payload.get(group_by) or "-"
+        group = groups.setdefault(
+            key,
+            {
+                "calls": 0,
+                "errors": 0,
+                "cancelled": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "saved_tokens_est": 0,
+                "_latency": [],
+                "_ttft": [],
+            },
+        )
+        group["calls"] += 1
+        group["errors"] += 1 if payload.get("error") else 0
+        group["cancelled"] += 1 if payload.get("cancelled") else 0
+        group["saved_tokens_est"] += payload.get("saved_tokens_est") or 0
+        group["retries"] += payload.get("retries") or 0
+        group["prompt_tokens"] += payload.get("prompt_tokens") or 0
+        group["completion_tokens"] += payload.get("completion_tokens") or 0
+        if payload.get("latency_ms") is not None:
+            group["_latency"].append(float(payload["latency_ms"]))
+        if payload.get("ttft_ms") is not None:
+            group["_ttft"].append(float(payload["ttft_ms"]))
+
+    items = []
+    for key, group in groups.items():
+        latency = group.pop("_latency")
+        ttft = group.pop("_ttft")
+        items.append(
+            {
+                group_by: key,
+                **group,
+                "latency_ms_avg": round(sum(latency) / len(latency), 1) if latency else None,
+                "latency_ms_p95": _percentile(latency, 95),
+                "ttft_ms_avg": round(sum(ttft) / len(ttft), 1) if ttft else None,
+                "ttft_ms_p95": _percentile(ttft, 95),
+            }
+        )
+    items.sort(key=lambda item: item[group_by], reverse=group_by == "hour")
+    return items
+
+
+def llm_cancellation_totals() -> Dict[str, int]:
+    """LLM calls cut short by client disconnects, and the completion tokens that saved (estimate)."""
+    return {
+        "llm_calls_cancelled": sum(totals["cancelled"] for totals in _totals.values()),
+        "saved_tokens_est": sum(totals["saved_tokens_est"] for totals in _totals.values()),
+    }
+
+
+def _metrics() -> Dict[str, Any]:
+    snapshot = {}
+    for call_site, totals in _totals.items():
+        calls = totals["calls"] or 1
+        snapshot[call_site] = {
+            **totals,
+            "latency_ms": round(totals["latency_ms"], 1),
+            "avg_latency_ms": round(totals["latency_ms"] / calls, 1),
+        }
+    return snapshot
+
+
+register_metrics("llm_calls", _metrics)
@@ -1,10 +1,14 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 
-from .api import approvals, chat, conversations, orders, admin_invites, invites, register, account, admin_conversations, transcribe, users, admin_returns, admin_orders
+from .api import approvals, chat, conversations, orders, admin_invites, invites, register, account, admin_conversations, transcribe, users, admin_returns, admin_orders, admin_metrics
+from .agents.services import startup_agent_services
 from .core.auth import User, get_current_user
 from .core.config import settings
+from .core.executors import shutdown_tool_executor
 from .core.supabase import get_supabase_admin_client
+from .llm.transport import shutdown_llm_transport, startup_llm_transport
+from .rag.embeddings import shutdown_embedding_service
 
 app = FastAPI(title="DTC Customer Service Agent API", version="0.1.0")
 
@@ -31,6 +35,20 @@ app.include_router(admin_returns.router, prefix="/api")
 app.include_router(admin_orders.router, prefix="/api")
 app.include_router(transcribe.router)
 app.include_router(users.router, prefix="/api")
+app.include_router(admin_metrics.router, prefix="/api")
+
+
+@app.on_event("startup")
+async def on_startup():
+    await startup_llm_transport()
+    startup_agent_services()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await shutdown_llm_transport()
+    await shutdown_embedding_service()
+    shutdown_tool_executor()
 
 
 @app.get("/api/health")
@@ -0,0 +1,356 @@
+"""
+Resumable embedding backfill for rag_documents.
+
+Rows whose embedding is null are paged through in id order; tombstoned
+chunks (deleted_at set) are skipped. Keyset pagination means a row that
+keeps failing does not stall the run. Each page is split into API-sized
+chunks (RAG_EMBEDDING_MAX_BATCH). Chunks are embedded with at most
+RAG_BACKFILL_CONCURRENCY requests in flight and RAG_BACKFILL_RPS requests
+per second. 429 / 5xx / network errors are retried
+with backoff. Results are written back WRITE_BATCH rows at a time.
+
+After every fully written page, the last id is checkpointed to
+RAG_BACKFILL_CHECKPOINT_PATH, so a crashed run resumes after it. The
+checkpoint is removed once the table is exhausted; rows that failed are
+retried by the next run. The next page is fetched while the current one is
+being embedded.
+
+Only the embedding column is written, and only while the row's updated_at
+is still the one read with the text: a row edited while its chunk was being
+embedded is left alone (counted as stale) instead of having the edit
+reverted or a vector of the old text attached to it. Each WRITE_BATCH is one
+statement, the backfill_rag_embeddings RPC
+(migrations/add_rag_backfill_embeddings.sql). Without that function rows are
+updated one by one with the same guard, and without the updated_at column
+(migrations/add_rag_documents_updated_at.sql) they are keyed on id alone.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.core.supabase import get_supabase_admin_client, is_missing_column, is_missing_function
+from app.rag.embeddings import embedding_service
+from app.rag.index import policy_index
+from app.rag.lexical import document_text
+
+SELECT_COLUMNS = "id, title, content"
+WRITE_BATCH = 100
+WRITE_RPC = "backfill_rag_embeddings"
+MAX_ATTEMPTS = 4
+
+
+@dataclass
+class BackfillProgress:
+    total: Optional[int] = None  # 本次开始时待回填的行数（count 失败时为 None）
+    embedded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    stale: int = 0  # 嵌入期间文本被修改、未写回的行
+    pages: int = 0
+    requests: int = 0
+    retries: int = 0
+    last_id: Any = None
+    resumed: bool = False
+    finished: bool = False
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.embedded + self.failed + self.skipped + self.stale
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        if self.total is None or not self.rate:
+            return None
+        return max(0, self.total - self.processed) / self.rate
+
+    def summary(self) -> str:
+        total = "?" if self.total is None else self.total
+        eta = self.eta_seconds
+        return (
+            f"{self.processed}/{total} rows (embedded={self.embedded} failed={self.failed} skipped={self.skipped} "
+            f"stale={self.stale}) "
+            f"{self.rate:.1f} rows/s, eta={'?' if eta is None else f'{eta:.0f}s'}, "
+            f"requests={self.requests} retries={self.retries}"
+        )
+
+
+class _RateLimiter:
+    """Spaces request starts at least 1/rps seconds apart (rps <= 0 disables it)."""
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return True
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    if not path:
+        return None
+    try:
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    # 换了 embedding 模型时旧进度作废
+    if data.get("model") != settings.dashscope_embedding_model:
+        return None
+    return data
+
+
+def save_checkpoint(path: str, progress: BackfillProgress) -> None:
+    if not path:
+        return
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(
+            {
+                "model": settings.dashscope_embedding_model,
+                "last_id": progress.last_id,
+                "embedded": progress.embedded,
+                "failed": progress.failed,
+                "saved_at": time.time(),
+            },
+            fh,
+        )
+    os.replace(tmp, path)
+
+
+def clear_checkpoint(path: str) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class EmbeddingBackfill:
+    def __init__(
+        self,
+        page_size: int,
+        concurrency: int,
+        rps: float,
+        checkpoint_path: str,
+        on_progress: Optional[Callable[[BackfillProgress], None]] = None,
+    ):
+        self.page_size = max(1, page_size)
+        self.checkpoint_path = checkpoint_path
+        self.on_progress = on_progress
+        self.progress = BackfillProgress()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._limiter = _RateLimiter(rps)
+        self._versioned = True  # rag_documents 有 updated_at 列，写回时据此判断文本是否被改过
+        self._tombstones = True  # rag_documents 有 deleted_at 列，墓碑分块不回填
+        self._bulk = True  # 库里有 WRITE_RPC，每批一条语句写回
+
+    def _pending(self, columns: str, after: Any, count: Optional[str] = None):
+        """Rows still missing an embedding (tombstoned chunks excluded), after the given id."""
+        query = (
+            get_supabase_admin_client()
+            .table("rag_documents")
+            .select(columns, count=count)
+            .filter("embedding", "is", "null")
+        )
+        if self._tombstones:
+            query = query.filter("deleted_at", "is", "null")
+        if after is not None:
+            query = query.gt("id", after)
+        return query
+
+    def _downgrade(self, exc: Exception) -> bool:
+        """Drop the optional column PostgREST says is missing; False for any other error (re-raise it)."""
+        if self._tombstones and is_missing_column(exc, "deleted_at"):
+            print(f"[rag backfill] deleted_at unavailable, tombstoned rows are not skipped: {exc}")
+            self._tombstones = False
+            return True
+        if self._versioned and is_missing_column(exc, "updated_at"):
+            print(f"[rag backfill] updated_at unavailable, writes are not guarded against concurrent edits: {exc}")
+            self._versioned = False
+            return True
+        return False
+
+    def _count(self, after: Any) -> Optional[int]:
+        try:
+            return self._pending("id", after, count="exact").limit(1).execute().count
+        except Exception as exc:
+            if self._downgrade(exc):
+                return self._count(after)
+            print(f"[rag backfill] count failed, no ETA: {exc}")
+            return None
+
+    def _fetch_page(self, after: Any, size: int) -> List[Dict]:
+        columns = SELECT_COLUMNS + (", updated_at" if self._versioned else "")
+        try:
+            return self._pending(columns, after).order("id").limit(size).execute().data or []
+        except Exception as exc:
+            # 超时、断线等临时错误直接抛出：这一页不记检查点，重跑时接着来
+            if self._downgrade(exc):
+                return self._fetch_page(after, size)
+            raise
+
+    def _write(self, updates: List[Dict]) -> int:
+        """Write the batch's embeddings; returns how many rows were still unchanged and got written."""
+        client = get_supabase_admin_client()
+        if self._versioned and self._bulk:
+            try:
+                # 一条 UPDATE ... FROM 写完整批，updated_at 条件在库里判断
+                return int(client.rpc(WRITE_RPC, {"p_rows": updates}).execute().data or 0)
+            except Exception as exc:
+                if not is_missing_function(exc, WRITE_RPC):
+                    raise
+                print(f"[rag backfill] {WRITE_RPC} is missing, writing row by row: {exc}")
+                self._bulk = False
+        table = client.table("rag_documents")
+        written = 0
+        for update in updates:
+            query = table.update({"embedding": update["embedding"]}).eq("id", update["id"])
+            if self._versioned:
+                query = query.eq("updated_at", update["updated_at"])
+            if query.execute().data:
+                written += 1
+        return written
+
+    async def _embed_chunk(self, rows: List[Dict]) -> List[Optional[List[float]]]:
+        texts = [document_text(row) for row in rows]
+        error: Optional[Exception] = None
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                self.progress.retries += 1
+                await asyncio.sleep(min(30.0, 2.0**attempt))
+            async with self._semaphore:
+                await self._limiter.wait()
+                self.progress.requests += 1
+                try:
+                    return await embedding_service.embed_batch(texts)
+                except Exception as exc:
+                    error = exc
+            if not _retryable(error):
+                break
+        print(f"[rag backfill] chunk starting at id={rows[0].get('id')} failed: {error}")
+        return [None] * len(rows)
+
+    async def _process_page(self, rows: List[Dict]) -> None:
+        pending = [row for row in rows if (row.get("title") or "").strip() or (row.get("content") or "").strip()]
+        self.progress.skipped += len(rows) - len(pending)
+        step = embedding_service.max_batch
+        chunks = [pending[start : start + step] for start in range(0, len(pending), step)]
+        results = await asyncio.gather(*(self._embed_chunk(chunk) for chunk in chunks))
+
+        updates: List[Dict] = []
+        for chunk, vectors in zip(chunks, results):
+            for row, vector in zip(chunk, vectors):
+                if vector:
+                    updates.append({"id": row["id"], "updated_at": row.get("updated_at"), "embedding": vector})
+                else:
+                    self.progress.failed += 1
+        # 写库失败直接抛出：这一页不记检查点，重跑时从上一页之后继续
+        written = 0
+        for start in range(0, len(updates), WRITE_BATCH):
+            written += await run_blocking(self._write, updates[start : start + WRITE_BATCH])
+        self.progress.embedded += written
+        self.progress.stale += len(updates) - written
+
+    async def run(self, limit: Optional[int] = None, restart: bool = False) -> BackfillProgress:
+        progress = self.progress
+        if restart:
+            clear_checkpoint(self.checkpoint_path)
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        if checkpoint:
+            progress.last_id = checkpoint.get("last_id")
+            progress.resumed = True
+            print(f"[rag backfill] resuming after id={progress.last_id}")
+        total = await run_blocking(self._count, progress.last_id)
+        progress.total = min(total, limit) if total is not None and limit else total
+
+        remaining = limit
+        size = min(self.page_size, remaining or self.page_size)
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(
+            run_blocking(self._fetch_page, progress.last_id, size)
+        )
+        try:
+            while next_page is not None:
+                rows = await next_page
+                next_page = None
+                if not rows:
+                    progress.finished = True
+                    break
+                last_id = rows[-1]["id"]
+                progress.finished = len(rows) < size
+                if remaining is not None:
+                    remaining -= len(rows)
+                if not progress.finished and (remaining is None or remaining > 0):
+                    # 处理这一页的同时预取下一页
+                    size = min(self.page_size, remaining or self.page_size)
+                    next_page = asyncio.ensure_future(run_blocking(self._fetch_page, last_id, size))
+
+                await self._process_page(rows)
+                progress.pages += 1
+                progress.last_id = last_id
+                save_checkpoint(self.checkpoint_path, progress)
+                if self.on_progress:
+                    self.on_progress(progress)
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+        if progress.finished:
+            clear_checkpoint(self.checkpoint_path)
+        if progress.embedded:
+            policy_index.invalidate()
+        return progress
+
+
+async def run_backfill(
+    limit: Optional[int] = None,
+    restart: bool = False,
+    page_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    rps: Optional[float] = None,
+    on_progress: Optional[Callable[[BackfillProgress], None]] = None,
+) -> BackfillProgress:
+    if not settings.dashscope_api_key:
+        print("[rag backfill] DASHSCOPE_API_KEY is not set")
+        return BackfillProgress(total=0)
+    backfill = EmbeddingBackfill(
+        page_size or settings.rag_backfill_page_size,
+        concurrency or settings.rag_backfill_concurrency,
+        settings.rag_backfill_rps if rps is None else rps,
+        settings.rag_backfill_checkpoint_path,
+        on_progress,
+    )
+    return await backfill.run(limit=limit, restart=restart)
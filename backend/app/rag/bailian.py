@@ -1,12 +1,11 @@
-from typing import List, Dict
-import json
-import math
-import re
-
-import httpx
+from typing import Any, List, Dict, Tuple
 
 from app.core.config import settings
-from app.core.supabase import get_supabase_admin_client
+from app.core.executors import run_blocking
+from app.rag.backfill import run_backfill
+from app.rag.embeddings import embedding_service
+from app.rag.index import policy_index
+from app.rag.lexical import hybrid_fusion
 
 # Minimal KB fallback when Supabase has no data.
 MOCK_KB = [
@@ -31,131 +30,56 @@ MOCK_KB = [
 ]
 
 
-def _tokenize(query: str) -> List[str]:
-    return [token for token in re.split(r"[\s,，]+", query.lower()) if token]
-
+async def backfill_embeddings(limit: int = 200) -> int:
+    """Embed up to `limit` rows missing an embedding; see app/rag/backfill.py for the full pipeline."""
+    progress = await run_backfill(limit=limit)
+    return progress.embedded
 
-def _cosine_similarity(left: List[float], right: List[float]) -> float:
-    dot = sum(a * b for a, b in zip(left, right))
-    left_norm = math.sqrt(sum(a * a for a in left))
-    right_norm = math.sqrt(sum(b * b for b in right))
-    if left_norm == 0.0 or right_norm == 0.0:
-        return 0.0
-    return dot / (left_norm * right_norm)
 
-
-def _embed_texts(texts: List[str]) -> List[List[float]]:
-    if not settings.dashscope_api_key:
-        return []
-    payload = {
-        "model": settings.dashscope_embedding_model,
-        "input": {"texts": texts},
-    }
-    headers = {
-        "Authorization": f"Bearer {settings.dashscope_api_key}",
-        "Content-Type": "application/json",
+def _as_hit(doc: Dict, score: float, digits: int) -> Dict[str, object]:
+    return {
+        "title": doc.get("title"),
+        "content": doc.get("content"),
+        "category": doc.get("category"),
+        "source_id": doc.get("source_id"),
+        "metadata": doc.get("metadata") or {},
+        "score": round(score, digits),
     }
-    try:
-        with httpx.Client(timeout=30.0) as client:
-            resp = client.post(
-                "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding",
-                headers=headers,
-                json=payload,
-            )
-        resp.raise_for_status()
-        data = resp.json()
-        embeddings = data.get("output", {}).get("embeddings", [])
-        embeddings.sort(key=lambda item: item.get("text_index", 0))
-        return [item.get("embedding", []) for item in embeddings]
-    except Exception:
-        return []
-
-
-def backfill_embeddings(limit: int = 200) -> int:
-    client = get_supabase_admin_client()
-    res = (
-        client.table("rag_documents")
-        .select("id, title, content, embedding")
-        .filter("embedding", "is", "null")
-        .limit(limit)
-        .execute()
-    )
-    docs = res.data or []
-    if not docs:
-        return 0
 
-    texts = [f"{doc.get('title', '')}\n{doc.get('content', '')}" for doc in docs]
-    vectors = _embed_texts(texts)
-    if not vectors or len(vectors) != len(docs):
-        return 0
 
-    updated = 0
-    for doc, embedding in zip(docs, vectors):
-        if not embedding:
-            continue
-        client.table("rag_documents").update({"embedding": embedding}).eq("id", doc["id"]).execute()
-        updated += 1
-    return updated
-
-
-def search_policies(query: str, top_k: int = 3) -> List[Dict[str, object]]:
-    client = get_supabase_admin_client()
+async def search_policies(query: str, top_k: int = 3) -> List[Dict[str, object]]:
     print(f"[rag] search_policies query={query} top_k={top_k}")
-    res = (
-        client.table("rag_documents")
-        .select("title, content, category, source_id, metadata, embedding")
-        .limit(200)
-        .execute()
-    )
-    docs = res.data or []
+    # 文档和向量常驻内存（见 app/rag/index.py），按周期增量同步，不再每次查库
+    if policy_index.needs_sync():
+        snapshot = await run_blocking(policy_index.ensure_fresh)
+    else:
+        snapshot = policy_index.snapshot
+    docs = list(snapshot.docs.values())
     if not docs:
         print("[rag] no documents in rag_documents; using MOCK_KB")
         return MOCK_KB[:top_k]
 
-    query_embedding = _embed_texts([query])
-    if query_embedding and docs and all(doc.get("embedding") for doc in docs):
-        scored = []
-        for doc in docs:
-            embedding = doc.get("embedding") or []
-            if isinstance(embedding, str):
-                try:
-                    embedding = json.loads(embedding)
-                except json.JSONDecodeError:
-                    embedding = []
-            score = _cosine_similarity(query_embedding[0], embedding) if embedding else 0.0
-            scored.append(
-                {
-                    "title": doc.get("title"),
-                    "content": doc.get("content"),
-                    "category": doc.get("category"),
-                    "source_id": doc.get("source_id"),
-                    "metadata": doc.get("metadata") or {},
-                    "score": round(score, 4),
-                }
-            )
-        scored.sort(key=lambda item: item["score"], reverse=True)
-        hits = scored[:top_k]
-        print(f"[rag] vector_hits={[(h.get('title'), h.get('score')) for h in hits]}")
-        return hits
-
-    tokens = _tokenize(query)
-    scored = []
-    for doc in docs:
-        text = f"{doc.get('title', '')} {doc.get('content', '')}".lower()
-        hits = sum(1 for token in tokens if token and token in text)
-        score = hits / max(len(tokens), 1)
-        scored.append(
-            {
-                "title": doc.get("title"),
-                "content": doc.get("content"),
-                "category": doc.get("category"),
-                "source_id": doc.get("source_id"),
-                "metadata": doc.get("metadata") or {},
-                "score": round(score, 3),
-            }
-        )
-
-    scored.sort(key=lambda item: item["score"], reverse=True)
-    hits = scored[:top_k]
-    print(f"[rag] keyword_hits={[(h.get('title'), h.get('score')) for h in hits]}")
+    # 混合检索：BM25（中文按字 / 二元组切分）和向量各取一批候选，再用加权 RRF 融合；
+    # 相似度低于下限的向量结果不参与，避免把关键词精确命中挤出前几名
+    candidates = max(top_k * 4, 20)
+    bm25_hits = snapshot.lexical.search(query, candidates)
+    vector_hits: List[Tuple[Any, float]] = []
+    if snapshot.has_vectors:
+        # 查询向量走缓存 + 微批（见 app/rag/embeddings.py），不阻塞事件循环
+        query_embedding = await embedding_service.embed_query(query)
+        if query_embedding:
+            vector_hits = policy_index.search(snapshot, query_embedding, candidates)
+
+    fused = hybrid_fusion(
+        bm25_hits, vector_hits, settings.rag_hybrid_vector_weight, settings.rag_hybrid_min_vector_score
+    )
+    if fused:
+        hits = [_as_hit(snapshot.docs[doc_id], score, 4) for doc_id, score in fused[:top_k]]
+    else:
+        # 既没有词命中也没有向量：和以前一样返回前几条，调用方把空结果当作知识库不可用
+        hits = [_as_hit(doc, 0.0, 4) for doc in docs[:top_k]]
+    print(
+        f"[rag] hybrid_hits vector={len(vector_hits)} bm25={len(bm25_hits)} "
+        f"top={[(h.get('title'), h.get('score')) for h in hits]}"
+    )
     return hits
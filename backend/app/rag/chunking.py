@@ -0,0 +1,228 @@
+"""
+Split policy documents (Markdown, HTML, plain text) into retrieval chunks.
+
+Documents are parsed into sections (heading path + paragraphs). Paragraphs
+are packed into chunks of at most max_chars. Paragraphs longer than that
+are cut into windows that overlap by `overlap` chars, preferring sentence
+ends. A chunk boundary falls after a paragraph whose hash hits 1 in
+BOUNDARY_MODULUS, once the chunk has min_chars. Boundaries therefore depend
+on local content rather than on offsets, and an edit only moves the chunks
+around it.
+
+Chunk ids are "<source_id>#<section key>-<anchor>". The section key is a
+hash of the heading path. The anchor is a hash of the chunk's first piece,
+which is the text right after the previous boundary. Ids therefore do not
+shift when a paragraph is inserted or removed earlier in the section. An
+edit changes the id and text of the chunks whose pieces it touches (and
+the next chunk if it moves a boundary); every other chunk keeps both.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+BOUNDARY_MODULUS = 4
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_END_RE = re.compile(r"[。！？；!?;.\n]")
+
+FORMATS = {
+    ".md": "markdown",
+    ".markdown": "markdown",
+    ".html": "html",
+    ".htm": "html",
+    ".txt": "text",
+}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    chunk_id: str
+    index: int
+    headings: Tuple[str, ...]
+    text: str
+
+
+def detect_format(path: str) -> Optional[str]:
+    return FORMATS.get(Path(path).suffix.lower())
+
+
+class _HTMLToMarkdown(HTMLParser):
+    """Just enough HTML -> Markdown for policy pages: headings, blocks, list items."""
+
+    BLOCKS = {"p", "div", "section", "article", "ul", "ol", "table", "tr", "br", "hr", "blockquote", "pre"}
+    SKIP = {"script", "style", "head", "nav", "footer"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.title = ""
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == "title":
+            self._in_title = True
+        elif re.fullmatch(r"h[1-6]", tag):
+            self.parts.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag in {"td", "th"}:
+            self.parts.append(" ")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag == "title":
+            self._in_title = False
+        elif re.fullmatch(r"h[1-6]", tag) or tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data.strip()
+        elif not self._skip:
+            # 标签内的换行只是排版，不是段落边界
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+
+def html_to_markdown(html: str) -> Tuple[str, str]:
+    """(markdown text, <title>)"""
+    parser = _HTMLToMarkdown()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.parts)
+    text = "\n".join(line.strip() for line in text.splitlines())
+    return re.sub(r"\n{3,}", "\n\n", text).strip(), parser.title
+
+
+def parse_sections(text: str, fmt: str) -> List[Tuple[Tuple[str, ...], List[str]]]:
+    """[(heading path, paragraphs)] in document order; plain text is one untitled section."""
+    if fmt == "html":
+        text, _ = html_to_markdown(text)
+    sections: List[Tuple[Tuple[str, ...], List[str]]] = [((), [])]
+    stack: List[Tuple[int, str]] = []
+    paragraph: List[str] = []
+    in_fence = False
+
+    def flush() -> None:
+        body = "\n".join(paragraph).strip()
+        if body:
+            sections[-1][1].append(body)
+        paragraph.clear()
+
+    for line in (text or "").replace("\r\n", "\n").split("\n"):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            paragraph.append(line)
+            continue
+        heading = None if in_fence or fmt == "text" else _HEADING_RE.match(line)
+        if heading:
+            flush()
+            level = len(heading.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, heading.group(2).strip()))
+            sections.append((tuple(name for _, name in stack), []))
+        elif not line.strip() and not in_fence:
+            flush()
+        else:
+            paragraph.append(line.rstrip())
+    flush()
+    return [(headings, paragraphs) for headings, paragraphs in sections if paragraphs]
+
+
+def document_title(text: str, fmt: str) -> Optional[str]:
+    if fmt == "html":
+        markdown, title = html_to_markdown(text)
+        if title:
+            return title
+        text = markdown
+    if fmt in {"html", "markdown"}:
+        for line in (text or "").splitlines():
+            heading = _HEADING_RE.match(line)
+            if heading and len(heading.group(1)) == 1:
+                return heading.group(2).strip()
+    return None
+
+
+def _windows(paragraph: str, max_chars: int, overlap: int) -> List[str]:
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    overlap = max(0, min(overlap, max_chars // 2))
+    windows: List[str] = []
+    start = 0
+    while start < len(paragraph):
+        end = min(len(paragraph), start + max_chars)
+        if end < len(paragraph):
+            # 尽量在句末切开（只在窗口后 30% 里找）
+            floor = start + int(max_chars * 0.7)
+            cuts = [m.end() for m in _SENTENCE_END_RE.finditer(paragraph, floor, end)]
+            if cuts:
+                end = cuts[-1]
+        windows.append(paragraph[start:end].strip())
+        if end >= len(paragraph):
+            break
+        start = max(start + 1, end - overlap)
+    return [window for window in windows if window]
+
+
+def _is_boundary(piece: str) -> bool:
+    digest = hashlib.sha1(piece.encode("utf-8")).digest()
+    return digest[0] % BOUNDARY_MODULUS == 0
+
+
+def _section_key(headings: Tuple[str, ...], occurrence: int) -> str:
+    raw = "\x1f".join(headings) + (f"\x1e{occurrence}" if occurrence else "")
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:10]
+
+
+def _anchor(piece: str) -> str:
+    return hashlib.sha1(piece.encode("utf-8")).hexdigest()[:10]
+
+
+def chunk_document(text: str, fmt: str, source_id: str, max_chars: int = 800, overlap: int = 100) -> List[Chunk]:
+    max_chars = max(100, max_chars)
+    min_chars = max_chars // 4
+    chunks: List[Chunk] = []
+    seen: Dict[Tuple[str, ...], int] = {}
+    for headings, paragraphs in parse_sections(text, fmt):
+        # 同一路径的标题出现多次（例如两个“注意事项”）时按出现次序区分
+        occurrence = seen.get(headings, 0)
+        seen[headings] = occurrence + 1
+        key = _section_key(headings, occurrence)
+        pieces = [window for paragraph in paragraphs for window in _windows(paragraph, max_chars, overlap)]
+        current: List[str] = []
+        size = 0
+        anchors: Dict[str, int] = {}
+
+        def emit() -> None:
+            nonlocal size
+            if current:
+                anchor = _anchor(current[0])
+                # 同一章节里以相同文本开头的分块（重复段落）按出现次序区分
+                repeat = anchors.get(anchor, 0)
+                anchors[anchor] = repeat + 1
+                chunk_id = f"{source_id}#{key}-{anchor}" + (f"-{repeat}" if repeat else "")
+                chunks.append(Chunk(chunk_id, len(chunks), headings, "\n\n".join(current)))
+                current.clear()
+                size = 0
+
+        for piece in pieces:
+            if current and size + len(piece) > max_chars:
+                emit()
+            current.append(piece)
+            size += len(piece)
+            if size >= min_chars and _is_boundary(piece):
+                emit()
+        emit()
+    return chunks
@@ -0,0 +1,152 @@
+"""
+Query-embedding cache.
+
+Policy lookups embed the same few query strings over and over ("return
+policy, refund threshold"). Vectors are cached under (embedding model,
+normalized text) in two tiers: an in-memory LRU and a SQLite file that
+survives restarts (RAG_EMBEDDING_CACHE_PATH, empty disables the disk tier).
+Both tiers keep vectors as float32 (a numpy array in memory, raw bytes on
+disk) rather than Python float lists, about 8x less memory per entry. Hit
+ratio and the DashScope time saved (misses' average latency x hits) are
+exported as "rag_embedding_cache".
+
+get_memory() is cheap enough for the event loop; get()/put() may touch SQLite
+and are run on the tool pool by app/rag/embeddings.py.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import register_metrics
+
+
+def normalize_query(text: str) -> str:
+    """NFKC (full-width -> half-width), collapse whitespace, strip."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int, path: str):
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_failed = False
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "miss_ms": 0.0}
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is not None or self._db_failed or not self.path:
+            return self._db
+        try:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+        except Exception as exc:
+            # 磁盘层不可用时只用内存层
+            print(f"[embedding cache] disk tier disabled ({self.path}): {exc}")
+            self._db_failed = True
+        return self._db
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    @property
+    def disk_enabled(self) -> bool:
+        return bool(self.path) and not self._db_failed
+
+    def get_memory(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is None:
+                return None
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return vector.tolist()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return vector.tolist()
+            db = self._connect()
+            if db is not None:
+                row = db.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self._stats["disk_hits"] += 1
+                    return vector.tolist()
+        return None
+
+    def put(self, model: str, text: str, vector: List[float]) -> None:
+        key = cache_key(model, text)
+        compact = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, compact)
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, model, text, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, normalize_query(text), compact.tobytes(), time.time()),
+                )
+                db.commit()
+            except Exception as exc:
+                print(f"[embedding cache] failed to persist vector: {exc}")
+
+    def record_miss(self, elapsed_ms: float) -> None:
+        """A lookup that had to go to DashScope; elapsed_ms feeds the saved-time estimate."""
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["miss_ms"] += elapsed_ms
+
+    def metrics(self) -> Dict[str, Any]:
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+        misses = self._stats["misses"]
+        lookups = hits + misses
+        avg_miss_ms = self._stats["miss_ms"] / misses if misses else None
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": sum(vector.nbytes for vector in list(self._memory.values())),
+            "disk_enabled": self._db is not None,
+            "memory_hits": self._stats["memory_hits"],
+            "disk_hits": self._stats["disk_hits"],
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "avg_miss_ms": round(avg_miss_ms, 1) if avg_miss_ms is not None else None,
+            "saved_ms_est": round(hits * avg_miss_ms, 1) if avg_miss_ms is not None else None,
+        }
+
+
+embedding_cache = EmbeddingCache(settings.rag_embedding_cache_size, settings.rag_embedding_cache_path)
+register_metrics("rag_embedding_cache", embedding_cache.metrics)
@@ -0,0 +1,162 @@
+"""
+Async DashScope embedding client.
+
+Query embeddings are micro-batched: calls arriving within
+RAG_EMBEDDING_BATCH_WINDOW_MS of each other are sent as one DashScope request
+(at most RAG_EMBEDDING_MAX_BATCH texts, the API's per-request limit), and each
+caller gets its own vector back. Identical texts waiting in the same window
+share one slot. Lookups go through the query-embedding cache first, so only
+cache misses are batched. One pooled httpx.AsyncClient is shared by all calls;
+nothing here blocks the event loop (SQLite cache access runs on the tool pool).
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.core.metrics import register_metrics
+from app.rag.embedding_cache import embedding_cache, normalize_query
+
+DASHSCOPE_EMBEDDING_URL = (
+    "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding"
+)
+
+
+class EmbeddingService:
+    def __init__(self, batch_window_ms: float, max_batch: int):
+        self.batch_window = max(0.0, batch_window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._stats = {"requests": 0, "texts": 0, "errors": 0, "batched_queries": 0, "coalesced_queries": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """One DashScope request for at most max_batch texts (no cache); raises on HTTP errors."""
+        if len(texts) > self.max_batch:
+            raise ValueError(f"embed_batch got {len(texts)} texts, the limit is {self.max_batch}")
+        return await self._request(texts)
+
+    async def embed_documents(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed texts directly (no cache), split into API-sized batches; failed batches give None."""
+        vectors: List[Optional[List[float]]] = []
+        for start in range(0, len(texts), self.max_batch):
+            batch = texts[start : start + self.max_batch]
+            try:
+                vectors.extend(await self.embed_batch(batch))
+            except Exception as exc:
+                print(f"[embeddings] document batch failed: {exc}")
+                vectors.extend([None] * len(batch))
+        return vectors
+
+    async def embed_query(self, text: str) -> Optional[List[float]]:
+        """Cached query vector, or one slot in the next micro-batch."""
+        if not settings.dashscope_api_key:
+            return None
+        model = settings.dashscope_embedding_model
+        vector = embedding_cache.get_memory(model, text)
+        if vector is None and embedding_cache.disk_enabled:
+            vector = await run_blocking(embedding_cache.get, model, text)
+        if vector is not None:
+            return vector
+
+        started = time.perf_counter()
+        # shield：同一批里别的调用方被取消时不影响这个共享结果
+        vector = await asyncio.shield(self._enqueue(normalize_query(text)))
+        embedding_cache.record_miss((time.perf_counter() - started) * 1000)
+        if vector:
+            await run_blocking(embedding_cache.put, model, text, vector)
+        return vector
+
+    def _enqueue(self, text: str) -> asyncio.Future:
+        self._stats["batched_queries"] += 1
+        future = self._pending.get(text)
+        if future is not None:
+            self._stats["coalesced_queries"] += 1
+            return future
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[text] = future
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: Dict[str, asyncio.Future]) -> None:
+        texts = list(batch)
+        try:
+            vectors = await self._request(texts)
+        except Exception as exc:
+            print(f"[embeddings] query batch of {len(texts)} failed: {exc}")
+            vectors = [None] * len(texts)
+        for text, vector in zip(texts, vectors):
+            future = batch[text]
+            if not future.done():
+                future.set_result(vector)
+
+    async def _request(self, texts: List[str]) -> List[Optional[List[float]]]:
+        payload = {
+            "model": settings.dashscope_embedding_model,
+            "input": {"texts": texts},
+        }
+        headers = {
+            "Authorization": f"Bearer {settings.dashscope_api_key}",
+            "Content-Type": "application/json",
+        }
+        self._stats["requests"] += 1
+        self._stats["texts"] += len(texts)
+        try:
+            resp = await self._get_client().post(DASHSCOPE_EMBEDDING_URL, headers=headers, json=payload)
+            resp.raise_for_status()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for item in resp.json().get("output", {}).get("embeddings", []):
+            index = item.get("text_index", 0)
+            if 0 <= index < len(texts):
+                vectors[index] = item.get("embedding") or None
+        return vectors
+
+    def metrics(self) -> Dict[str, Any]:
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            "avg_batch_size": round(self._stats["texts"] / requests, 2) if requests else None,
+            "pending": len(self._pending),
+        }
+
+
+embedding_service = EmbeddingService(settings.rag_embedding_batch_window_ms, settings.rag_embedding_max_batch)
+register_metrics("rag_embeddings", embedding_service.metrics)
+
+
+async def shutdown_embedding_service() -> None:
+    await embedding_service.aclose()
@@ -0,0 +1,378 @@
+"""
+Process-local retrieval index over rag_documents.
+
+Document rows (without embeddings) are held in memory together with a BM25
+LexicalIndex (app/rag/lexical.py) and a vector store (app/rag/ann.py): an
+exact float32 matrix for small knowledge bases, an IVF index persisted under
+RAG_ANN_INDEX_PATH once there are RAG_ANN_MIN_DOCS embedded rows.
+
+The index syncs from Supabase at most every RAG_INDEX_REFRESH_INTERVAL
+seconds and then only pulls rows whose updated_at moved since the last sync
+(needs migrations/add_rag_documents_updated_at.sql; without the column every
+sync is a full reload including embeddings). Rows already applied at the
+cursor timestamp are skipped, so a refresh with nothing new keeps the current
+snapshot instead of publishing an identical one. A sync never touches the
+published snapshot: it works on copies of the document dict and the BM25
+index and swaps the finished snapshot in at the end, so a sync that fails
+halfway leaves searches on the old, consistent snapshot. A full reload of the document
+rows every RAG_INDEX_FULL_SYNC_INTERVAL seconds drops deleted rows; once
+vectors are in memory (or loaded from the persisted ANN index) full reloads
+skip the embedding column. Rows tombstoned by app/rag/ingest.py (deleted_at
+set) are dropped from the index as soon as an incremental sync sees them.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import register_metrics
+from app.core.supabase import get_supabase_admin_client, is_missing_column
+from app.rag.ann import ANNVectors, ExactVectors, IVFIndex, normalize_query
+from app.rag.lexical import LexicalIndex, document_text
+
+DOC_COLUMNS = "id, title, content, category, source_id, metadata"
+PAGE_SIZE = 1000
+
+VectorStore = Union[ExactVectors, ANNVectors]
+
+
+def parse_embedding(value: Any) -> Optional[np.ndarray]:
+    """Embeddings come back as a list, or as a JSON / pgvector string ("[0.1,0.2,...]").
+
+    Malformed values (bad JSON, nested or empty arrays, NaN / inf) give None,
+    so the row is served by BM25 only; _apply drops vectors of the wrong length.
+    """
+    if value is None or len(value) == 0:
+        return None
+    try:
+        # 严格按 JSON 解析：坏数据整行返回 None，不会被截断成更短的向量
+        vector = np.array(json.loads(value) if isinstance(value, str) else value, dtype=np.float32)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return None
+    if vector.ndim != 1 or not vector.size or not np.isfinite(vector).all():
+        return None
+    return vector
+
+
+def _store_ids(vectors: VectorStore) -> Set[Any]:
+    if isinstance(vectors, ANNVectors):
+        return (set(vectors.base.ids) - vectors.tombstones) | set(vectors.delta.ids)
+    return set(vectors.ids)
+
+
+def _store_bytes(vectors: VectorStore) -> int:
+    if isinstance(vectors, ANNVectors):
+        return vectors.base.nbytes + _store_bytes(vectors.delta)
+    return int(vectors.matrix.nbytes) if vectors.matrix is not None else 0
+
+
+class _Snapshot:
+    """Immutable view used by searches; a refresh builds a new one and swaps it in."""
+
+    def __init__(self, docs: Dict[Any, Dict], vectors: VectorStore, lexical: LexicalIndex):
+        self.docs = docs
+        self.vectors = vectors
+        self.lexical = lexical
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self.vectors.dim
+
+    @property
+    def has_vectors(self) -> bool:
+        return len(self.vectors) > 0
+
+
+class PolicyIndex:
+    def __init__(self):
+        self._snapshot = _Snapshot({}, ExactVectors.empty(), LexicalIndex())
+        self._lock = threading.Lock()
+        self._synced_at: Optional[str] = None
+        # 已应用过、updated_at 恰好等于 _synced_at 的行；gte 会再次返回它们
+        self._cursor_ids: Set[Any] = set()
+        self._last_check = 0.0
+        self._last_full_sync = 0.0
+        self._incremental = True
+        self._tombstones = True
+        self._persisted_checked = False
+        self._stats = {
+            "full_syncs": 0,
+            "incremental_syncs": 0,
+            "rows_synced": 0,
+            "ann_builds": 0,
+            "searches": 0,
+            "search_us": 0.0,
+        }
+
+    def invalidate(self) -> None:
+        """Make the next query sync (e.g. right after a backfill wrote new embeddings)."""
+        self._last_check = 0.0
+
+    @property
+    def snapshot(self) -> _Snapshot:
+        return self._snapshot
+
+    def needs_sync(self) -> bool:
+        return time.monotonic() - self._last_check >= settings.rag_index_refresh_interval
+
+    def ensure_fresh(self) -> _Snapshot:
+        now = time.monotonic()
+        if now - self._last_check >= settings.rag_index_refresh_interval:
+            with self._lock:
+                if now - self._last_check >= settings.rag_index_refresh_interval:
+                    try:
+                        self._sync(now)
+                    except Exception as exc:
+                        # 同步失败时继续用旧快照，下个周期再试
+                        print(f"[rag index] sync failed: {exc}")
+                    self._last_check = now
+        return self._snapshot
+
+    def _load_persisted(self) -> Optional[ANNVectors]:
+        if not settings.rag_ann_index_path:
+            return None
+        base = IVFIndex.load(settings.rag_ann_index_path)
+        if base is None:
+            return None
+        if base.meta.get("model") != settings.dashscope_embedding_model or not base.meta.get("synced_at"):
+            print("[rag index] persisted ANN index was built for another embedding model, ignoring it")
+            return None
+        self._synced_at = base.meta["synced_at"]
+        self._cursor_ids = set()
+        print(f"[rag index] mmapped ANN index: {len(base)} vectors, synced_at={self._synced_at}")
+        return ANNVectors(base, ExactVectors.empty(), frozenset(), settings.rag_ann_nprobe)
+
+    def _sync(self, now: float) -> None:
+        vectors: VectorStore = self._snapshot.vectors
+        if not self._persisted_checked:
+            self._persisted_checked = True
+            vectors = self._load_persisted() or vectors
+
+        # 已有可复用的向量（上次同步或磁盘上的 ANN 索引）时，只下载变化行的 embedding
+        reuse_vectors = self._incremental and self._synced_at is not None
+        full = (
+            not reuse_vectors
+            or not self._snapshot.docs
+            or now - self._last_full_sync >= settings.rag_index_full_sync_interval
+        )
+        docs = self._snapshot.docs
+        lexical = self._snapshot.lexical
+        upserts: Dict[Any, np.ndarray] = {}
+        removals: Set[Any] = set()
+        synced_at = self._synced_at
+        fetched: List[Dict] = []
+        row_count = 0
+
+        if full:
+            rows, rows_synced_at = self._fetch(None, with_embeddings=not reuse_vectors)
+            # _fetch 可能发现 updated_at 不可用而切换成全量模式
+            reuse_vectors = reuse_vectors and self._incremental
+            docs = {}
+            self._add_rows(rows, docs, None, upserts, removals, with_embeddings=not reuse_vectors)
+            lexical = LexicalIndex.build((doc_id, document_text(doc)) for doc_id, doc in docs.items())
+            if reuse_vectors:
+                removals |= {doc_id for doc_id in _store_ids(vectors) if doc_id not in docs}
+            else:
+                vectors = ExactVectors.empty()
+                synced_at = rows_synced_at
+                fetched.extend(rows)
+            row_count += len(rows)
+            self._last_full_sync = now
+            self._stats["full_syncs"] += 1
+
+        if reuse_vectors:
+            changed, changed_at = self._fetch(self._synced_at, with_embeddings=True)
+            changed = [row for row in changed if not self._at_cursor(row)]
+            if not full:
+                if not changed:
+                    return
+                # 在副本上修改，发布前正在进行的搜索仍读旧快照
+                docs = dict(docs)
+                lexical = lexical.copy()
+                self._stats["incremental_syncs"] += 1
+            self._add_rows(changed, docs, lexical, upserts, removals, with_embeddings=True)
+            synced_at = changed_at or synced_at
+            fetched.extend(changed)
+            row_count += len(changed)
+
+        vectors = self._apply(vectors, upserts, removals, synced_at)
+        self._advance_cursor(fetched, synced_at)
+        self._stats["rows_synced"] += row_count
+        self._snapshot = _Snapshot(docs, vectors, lexical)
+        print(
+            f"[rag index] {'full' if full else 'incremental'} sync: {row_count} rows, "
+            f"{len(docs)} docs, {len(vectors)} vectors ({type(vectors).__name__})"
+        )
+
+    def _at_cursor(self, row: Dict) -> bool:
+        return row.get("updated_at") == self._synced_at and row.get("id") in self._cursor_ids
+
+    def _advance_cursor(self, rows: List[Dict], synced_at: Optional[str]) -> None:
+        at_cursor = {row.get("id") for row in rows if row.get("updated_at") == synced_at}
+        if synced_at == self._synced_at:
+            self._cursor_ids |= at_cursor
+        else:
+            self._cursor_ids = at_cursor
+        self._synced_at = synced_at
+
+    @staticmethod
+    def _add_rows(
+        rows: List[Dict],
+        docs: Dict[Any, Dict],
+        lexical: Optional[LexicalIndex],
+        upserts: Dict[Any, np.ndarray],
+        removals: Set[Any],
+        with_embeddings: bool,
+    ) -> None:
+        for row in rows:
+            doc_id = row.get("id")
+            # 向量只放进向量库，文档字典里不保留（10 万行的 float 列表会占掉数 GB 内存）
+            embedding = parse_embedding(row.pop("embedding", None))
+            if row.get("deleted_at"):
+                docs.pop(doc_id, None)
+                if lexical is not None:
+                    lexical.remove(doc_id)
+                upserts.pop(doc_id, None)
+                removals.add(doc_id)
+                continue
+            docs[doc_id] = row
+            if lexical is not None:
+                lexical.upsert(doc_id, document_text(row))
+            if not with_embeddings:
+                continue
+            if embedding is not None:
+                upserts[doc_id] = embedding
+                removals.discard(doc_id)
+            else:
+                upserts.pop(doc_id, None)
+                removals.add(doc_id)
+
+    def _apply(
+        self,
+        vectors: VectorStore,
+        upserts: Dict[Any, np.ndarray],
+        removals: Set[Any],
+        synced_at: Optional[str],
+    ) -> VectorStore:
+        if not upserts and not removals:
+            return vectors
+        dim = vectors.dim
+        if dim is None and upserts:
+            # 维度不一致（换过 embedding 模型）的行按缺失处理，只走 BM25
+            lengths: Dict[int, int] = {}
+            for vector in upserts.values():
+                lengths[len(vector)] = lengths.get(len(vector), 0) + 1
+            dim = max(lengths, key=lengths.get)
+        mismatched = [doc_id for doc_id, vector in upserts.items() if len(vector) != dim]
+        for doc_id in mismatched:
+            upserts.pop(doc_id)
+            removals.add(doc_id)
+        vectors = vectors.with_changes(upserts, removals)
+
+        if isinstance(vectors, ExactVectors) and len(vectors) >= settings.rag_ann_min_docs:
+            base = IVFIndex.build(vectors.ids, vectors.matrix, storage=settings.rag_ann_storage)
+            vectors = ANNVectors(base, ExactVectors.empty(), frozenset(), settings.rag_ann_nprobe)
+            self._persist(vectors, synced_at)
+        elif isinstance(vectors, ANNVectors) and vectors.pending_changes > settings.rag_ann_rebuild_fraction * len(vectors.base):
+            vectors = vectors.rebuilt(settings.rag_ann_storage)
+            self._persist(vectors, synced_at)
+        return vectors
+
+    def _persist(self, vectors: ANNVectors, synced_at: Optional[str]) -> None:
+        self._stats["ann_builds"] += 1
+        if not settings.rag_ann_index_path or not synced_at:
+            return
+        try:
+            vectors.base.save(
+                settings.rag_ann_index_path,
+                {"synced_at": synced_at, "model": settings.dashscope_embedding_model},
+            )
+        except Exception as exc:
+            print(f"[rag index] failed to persist ANN index: {exc}")
+
+    def _fetch(self, since: Optional[str], with_embeddings: bool) -> Tuple[List[Dict], Optional[str]]:
+        client = get_supabase_admin_client()
+        columns = DOC_COLUMNS + (", embedding" if with_embeddings else "")
+        if self._incremental:
+            columns += ", updated_at"
+        if self._tombstones:
+            columns += ", deleted_at"
+        rows: List[Dict] = []
+        start = 0
+        while True:
+            query = client.table("rag_documents").select(columns)
+            if self._incremental:
+                # gte：同一时间戳内晚提交的行也能拉到，重复的行直接覆盖
+                if since:
+                    query = query.gte("updated_at", since)
+                query = query.order("updated_at")
+            if self._tombstones and not since:
+                # 全量加载不需要墓碑行；增量同步要靠它们把删除的分块移出索引
+                query = query.filter("deleted_at", "is", "null")
+            try:
+                res = query.range(start, start + PAGE_SIZE - 1).execute()
+            except Exception as exc:
+                if self._tombstones and is_missing_column(exc, "deleted_at"):
+                    print(f"[rag index] deleted_at unavailable, tombstones are not filtered: {exc}")
+                    self._tombstones = False
+                    return self._fetch(since, with_embeddings)
+                # 只有列确实不存在才降级；超时、断线等临时错误直接抛出，ensure_fresh 保留旧快照，下个周期重试
+                if not (self._incremental and is_missing_column(exc, "updated_at")):
+                    raise
+                print(f"[rag index] updated_at unavailable, falling back to full reloads: {exc}")
+                self._incremental = False
+                return self._fetch(None, with_embeddings=True)
+            page = res.data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            start += PAGE_SIZE
+        synced_at = max((row["updated_at"] for row in rows if row.get("updated_at")), default=since)
+        return rows, synced_at
+
+    def search(self, snapshot: _Snapshot, query_vector: List[float], top_k: int) -> List[Tuple[Any, float]]:
+        """Cosine top-k over the snapshot as (doc_id, score); [] when the query does not match the index dimension."""
+        if not snapshot.has_vectors or len(query_vector) != snapshot.dim or top_k <= 0:
+            return []
+        query = normalize_query(query_vector)
+        if query is None:
+            return []
+        started = time.perf_counter()
+        hits = snapshot.vectors.search(query, top_k)
+        self._stats["searches"] += 1
+        self._stats["search_us"] += (time.perf_counter() - started) * 1e6
+        return hits
+
+    def metrics(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        vectors = snapshot.vectors
+        searches = self._stats["searches"]
+        result = {
+            "docs": len(snapshot.docs),
+            "vectors": len(vectors),
+            "vector_bytes": _store_bytes(vectors),
+            "dim": snapshot.dim,
+            "store": "ivf" if isinstance(vectors, ANNVectors) else "exact",
+            "incremental": self._incremental,
+            "synced_at": self._synced_at,
+            **{key: value for key, value in self._stats.items() if key != "search_us"},
+            "search_us_avg": round(self._stats["search_us"] / searches, 1) if searches else None,
+        }
+        if isinstance(vectors, ANNVectors):
+            result["ann"] = {
+                "build_id": vectors.base.meta.get("build_id"),
+                "nlist": vectors.base.meta.get("nlist"),
+                "nprobe": vectors.nprobe,
+                "pending_changes": vectors.pending_changes,
+                "storage": vectors.base.storage,
+            }
+        return result
+
+
+policy_index = PolicyIndex()
+register_metrics("rag_index", policy_index.metrics)
@@ -0,0 +1,208 @@
+"""
+Incremental ingestion of policy documents into rag_documents.
+
+Each source (a Markdown / HTML / text file) is chunked by app/rag/chunking.py,
+giving one row per chunk keyed by its stable chunk_id. Each row stores a
+content_hash of what would be written (title, content, category, metadata).
+On re-ingest:
+- chunks whose hash and embedding are unchanged are skipped entirely: no
+  embedding call, no write;
+- new or changed chunks are embedded and upserted on chunk_id;
+- chunks that no longer exist are tombstoned (deleted_at set) instead of
+  deleted, so the incremental index sync sees them go. Rows of the same
+  source_id inserted by hand before chunking existed are tombstoned too.
+
+Needs migrations/add_rag_documents_chunks.sql.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.core.executors import run_blocking
+from app.core.supabase import get_supabase_admin_client
+from app.rag.chunking import Chunk, chunk_document
+from app.rag.embeddings import embedding_service
+from app.rag.index import policy_index
+from app.rag.lexical import document_text
+
+WRITE_BATCH = 100
+PAGE_SIZE = 1000
+
+
+@dataclass
+class IngestResult:
+    source_id: str
+    chunks: int = 0
+    unchanged: int = 0
+    written: int = 0
+    embedded: int = 0
+    embed_failed: int = 0
+    tombstoned: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{self.source_id}: {self.chunks} chunks, unchanged={self.unchanged} written={self.written} "
+            f"embedded={self.embedded} embed_failed={self.embed_failed} tombstoned={self.tombstoned}"
+        )
+
+
+def content_hash(row: Dict[str, Any]) -> str:
+    payload = json.dumps(
+        [row.get("title"), row.get("content"), row.get("category"), row.get("metadata")],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def chunk_row(
+    chunk: Chunk,
+    source_id: str,
+    title: str,
+    category: Optional[str],
+    metadata: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    # 标题带上章节路径：BM25 和向量都能用到，H1 与文档标题相同时不重复
+    headings = list(chunk.headings)
+    if headings and headings[0] == title:
+        headings = headings[1:]
+    row = {
+        "chunk_id": chunk.chunk_id,
+        "source_id": source_id,
+        "title": " > ".join([title, *headings]),
+        "content": chunk.text,
+        "category": category,
+        # 不放分块序号：前面插入一段会让后面所有分块的哈希都变，全部重新嵌入
+        "metadata": {**(metadata or {}), "headings": list(chunk.headings)},
+    }
+    row["content_hash"] = content_hash(row)
+    return row
+
+
+def _select_all(build) -> List[Dict]:
+    """All rows of build(client) page by page; PostgREST silently caps a single response at its max-rows."""
+    client = get_supabase_admin_client()
+    rows: List[Dict] = []
+    start = 0
+    while True:
+        res = build(client).range(start, start + PAGE_SIZE - 1).execute()
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+    return rows
+
+
+def _existing_chunks(source_id: str) -> Dict[str, Dict[str, Any]]:
+    rows = _select_all(
+        lambda client: client.table("rag_documents")
+        .select("chunk_id, content_hash, deleted_at")
+        .eq("source_id", source_id)
+        .filter("chunk_id", "not.is", "null")
+        .order("chunk_id")
+    )
+    return {row["chunk_id"]: row for row in rows}
+
+
+def _missing_embeddings(source_id: str) -> Set[str]:
+    rows = _select_all(
+        lambda client: client.table("rag_documents")
+        .select("chunk_id")
+        .eq("source_id", source_id)
+        .filter("chunk_id", "not.is", "null")
+        .filter("embedding", "is", "null")
+        .order("chunk_id")
+    )
+    return {row["chunk_id"] for row in rows}
+
+
+def _upsert(rows: List[Dict[str, Any]]) -> None:
+    get_supabase_admin_client().table("rag_documents").upsert(rows, on_conflict="chunk_id").execute()
+
+
+def _tombstone(source_id: str, chunk_ids: List[str]) -> int:
+    now = datetime.now(timezone.utc).isoformat()
+    table = get_supabase_admin_client().table("rag_documents")
+    count = 0
+    for start in range(0, len(chunk_ids), WRITE_BATCH):
+        res = table.update({"deleted_at": now}).in_("chunk_id", chunk_ids[start : start + WRITE_BATCH]).execute()
+        count += len(res.data or [])
+    # 分块入库之前手工插入的整篇文档行：被分块后的内容取代
+    res = (
+        table.update({"deleted_at": now})
+        .eq("source_id", source_id)
+        .filter("chunk_id", "is", "null")
+        .filter("deleted_at", "is", "null")
+        .execute()
+    )
+    return count + len(res.data or [])
+
+
+async def ingest_document(
+    source_id: str,
+    text: str,
+    fmt: str,
+    title: str,
+    category: Optional[str] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    dry_run: bool = False,
+) -> IngestResult:
+    chunks = chunk_document(text, fmt, source_id, settings.rag_chunk_max_chars, settings.rag_chunk_overlap)
+    rows = [chunk_row(chunk, source_id, title, category, metadata) for chunk in chunks]
+    result = IngestResult(source_id=source_id, chunks=len(rows))
+
+    existing = await run_blocking(_existing_chunks, source_id)
+    missing = await run_blocking(_missing_embeddings, source_id) if existing else set()
+
+    to_embed: List[Dict[str, Any]] = []
+    to_write: List[Dict[str, Any]] = []
+    for row in rows:
+        old = existing.get(row["chunk_id"])
+        same = old is not None and old.get("content_hash") == row["content_hash"]
+        if same and not old.get("deleted_at") and row["chunk_id"] not in missing:
+            result.unchanged += 1
+            continue
+        if same and row["chunk_id"] not in missing:
+            # 内容没变、只是之前被删过：恢复即可，向量还在
+            to_write.append({**row, "deleted_at": None})
+            continue
+        to_embed.append(row)
+
+    current_ids = {row["chunk_id"] for row in rows}
+    stale = [chunk_id for chunk_id, old in existing.items() if chunk_id not in current_ids and not old.get("deleted_at")]
+
+    if dry_run:
+        result.written = len(to_write) + len(to_embed)
+        result.embedded = len(to_embed)
+        result.tombstoned = len(stale)
+        return result
+
+    if to_embed:
+        vectors = await embedding_service.embed_documents([document_text(row) for row in to_embed])
+        for row, vector in zip(to_embed, vectors):
+            # 嵌入失败也照常写入（embedding 置空，旧向量不再对应新内容），之后由 rag_backfill.py 补上
+            to_write.append({**row, "embedding": vector, "deleted_at": None})
+            if vector:
+                result.embedded += 1
+            else:
+                result.embed_failed += 1
+
+    # 批量 upsert 要求每行的键一致：恢复的行不带 embedding，单独成批
+    for batch_rows in (
+        [row for row in to_write if "embedding" not in row],
+        [row for row in to_write if "embedding" in row],
+    ):
+        for start in range(0, len(batch_rows), WRITE_BATCH):
+            await run_blocking(_upsert, batch_rows[start : start + WRITE_BATCH])
+    result.written = len(to_write)
+    result.tombstoned = await run_blocking(_tombstone, source_id, stale)
+
+    if result.written or result.tombstoned:
+        policy_index.invalidate()
+    return result
@@ -0,0 +1,177 @@
+"""
+Chinese-aware BM25 over rag_documents.
+
+Text is NFKC-normalized and lower-cased, then split into runs: Latin/digit
+runs become word terms, CJK runs become character unigrams and bigrams (Chinese
+has no spaces, so whole-run tokens almost never match). jieba is optional and
+deliberately not in requirements.txt: when it is importable, its word segments
+of each CJK run are added as extra "w:"-prefixed terms; without it the index is
+built from the n-grams alone, which still match Chinese queries and only lose
+the extra weight that whole words carry.
+
+LexicalIndex keeps an inverted index (term -> {doc_id: tf}) that is updated
+per document, so incremental syncs only touch the terms of changed rows.
+Posting dicts are replaced rather than mutated, so copy() is cheap (it copies
+the term and document tables, not the postings) and an incremental sync can
+update a private copy while searches keep reading the published one.
+
+Queries walk their terms from rarest to most common. Terms with more than
+SCAN_MAX_POSTINGS postings (CJK unigrams and bigrams such as "退" or "订单"
+in a large knowledge base) only add their score to documents an earlier,
+rarer term already matched, instead of scanning the whole list; the list is
+still scanned when no rarer term matched anything. Below that size search is
+exact BM25.
+
+hybrid_fusion merges BM25 and vector hits with weighted reciprocal rank
+fusion. Vector hits under a cosine floor are dropped, and the vector list
+counts for less than BM25, so an embedding's loose nearest neighbours cannot
+push exact keyword matches out of the top results.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import jieba  # optional: word segments on top of n-grams
+except ImportError:
+    jieba = None
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_RUN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+(?:\.[0-9]+)?")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 倒排表超过这个长度的词只给已有候选加分，不整条扫描
+SCAN_MAX_POSTINGS = 2000
+
+
+def tokenize(text: str) -> List[str]:
+    terms: List[str] = []
+    for run in _RUN_RE.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if not _CJK_RE.match(run):
+            terms.append(run)
+            continue
+        terms.extend(run)
+        terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+        if jieba is not None and len(run) > 2:
+            # 分词结果加前缀，避免和二元组重复计数
+            terms.extend(f"w:{word}" for word in jieba.cut(run) if len(word) > 1)
+    return terms
+
+
+def document_text(doc: Dict[str, Any]) -> str:
+    return f"{doc.get('title') or ''}\n{doc.get('content') or ''}"
+
+
+class LexicalIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[Any, int]] = {}
+        self._doc_terms: Dict[Any, Counter] = {}
+        self._doc_lengths: Dict[Any, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[Any, str]]) -> "LexicalIndex":
+        """Bulk-load a new index. Nobody reads it yet, so postings are filled in place
+        (upsert() copies a posting dict per term, which is quadratic for a full load)."""
+        index = cls()
+        for doc_id, text in documents:
+            if doc_id in index._doc_terms:
+                index.upsert(doc_id, text)
+                continue
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                index._postings.setdefault(term, {})[doc_id] = tf
+            index._doc_terms[doc_id] = terms
+            index._doc_lengths[doc_id] = sum(terms.values())
+            index._total_length += index._doc_lengths[doc_id]
+        return index
+
+    def copy(self) -> "LexicalIndex":
+        """Independent index sharing the (never mutated) posting dicts with this one."""
+        index = LexicalIndex()
+        index._postings = dict(self._postings)
+        index._doc_terms = dict(self._doc_terms)
+        index._doc_lengths = dict(self._doc_lengths)
+        index._total_length = self._total_length
+        return index
+
+    def upsert(self, doc_id: Any, text: str) -> None:
+        self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            postings = dict(self._postings.get(term) or {})
+            postings[doc_id] = tf
+            self._postings[term] = postings
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = sum(terms.values())
+        self._total_length += self._doc_lengths[doc_id]
+
+    def remove(self, doc_id: Any) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = dict(self._postings.get(term) or {})
+            postings.pop(doc_id, None)
+            if postings:
+                self._postings[term] = postings
+            else:
+                self._postings.pop(term, None)
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[Any, float]]:
+        """BM25 top-k as (doc_id, score); only docs sharing at least one term are returned."""
+        doc_count = len(self._doc_lengths)
+        if not doc_count or top_k <= 0:
+            return []
+        avg_length = (self._total_length / doc_count) or 1.0
+        scores: Dict[Any, float] = {}
+        terms = [(term, query_tf, self._postings.get(term)) for term, query_tf in Counter(tokenize(query)).items()]
+        for term, query_tf, postings in sorted((t for t in terms if t[2]), key=lambda t: len(t[2])):
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            if scores and len(postings) > SCAN_MAX_POSTINGS:
+                matches = [(doc_id, postings[doc_id]) for doc_id in scores if doc_id in postings]
+            else:
+                matches = postings.items()
+            for doc_id, tf in matches:
+                length = self._doc_lengths.get(doc_id, avg_length)
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (BM25_K1 + 1) / norm
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Any]],
+    k: int = 60,
+    weights: Optional[List[float]] = None,
+) -> List[Tuple[Any, float]]:
+    """Fuse ranked id lists: score = sum over lists of weight / (k + rank)."""
+    fused: Dict[Any, float] = {}
+    for index, ranking in enumerate(rankings):
+        weight = weights[index] if weights else 1.0
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_fusion(
+    bm25_hits: List[Tuple[Any, float]],
+    vector_hits: List[Tuple[Any, float]],
+    vector_weight: float,
+    min_vector_score: float,
+) -> List[Tuple[Any, float]]:
+    """Weighted RRF of BM25 and vector (doc_id, score) hits; vector hits below min_vector_score are ignored."""
+    vector_ids = [doc_id for doc_id, score in vector_hits if score >= min_vector_score]
+    rankings = [ranking for ranking in (vector_ids, [doc_id for doc_id, _ in bm25_hits]) if ranking]
+    weights = [vector_weight] * bool(vector_ids) + [1.0] * bool(bm25_hits)
+    return reciprocal_rank_fusion(rankings, weights=weights)
@@ -0,0 +1,202 @@
+"""
+Compiled return policy.
+
+The return window, auto-refund threshold and item-condition rules are
+extracted from the knowledge base once into a frozen ReturnPolicy, and
+compiled again only when the policy index publishes a new snapshot (i.e.
+rag_documents changed). ReturnPlannerAgent, ReturnFlow and the admin
+endpoints read the same object, so a return check or an admin list no longer
+costs a hybrid search plus a query embedding.
+
+Rules are taken from the top MAX_HITS BM25 hits for the return-policy
+terms: the window only from sentences about returns, the threshold only
+from sentences about refunds. Each value is logged with the sentence it came
+from. When the hits state different values the rule falls back to its
+default (DEFAULT_RETURN_WINDOW_DAYS, or None for the threshold so callers
+use their configured one) rather than guessing. With an empty knowledge base
+MOCK_KB is used, as search_policies does.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.executors import run_blocking
+from app.core.metrics import register_metrics
+from app.rag.bailian import MOCK_KB, _as_hit
+from app.rag.index import policy_index
+
+POLICY_QUERY = "return policy refund threshold window days condition 退货 退款 售后 天内 元 自动退款 完好"
+MAX_HITS = 3
+DEFAULT_RETURN_WINDOW_DAYS = 30
+
+_THRESHOLD_PATTERNS = (
+    re.compile(r"under\s+(\d+(?:\.\d+)?)\s*cny"),
+    re.compile(r"(?:低于|少于|小于|不超过|不满)\s*(\d+(?:\.\d+)?)\s*(?:元|cny|rmb)"),
+)
+_WINDOW_PATTERNS = (
+    re.compile(r"within\s+(\d+)\s*days?"),
+    re.compile(r"(\d+)\s*(?:天|日)\s*(?:内|以内|之内)"),
+)
+# 只在讲退货的句子里找期限，免得把“3-5 天内到账”当成退货期；
+# 金额同理，只认讲退款的句子，免得把“低于 99 元不包邮”当成自动退款门槛
+_RETURN_SENTENCE_RE = re.compile(r"return|退货|退换")
+_REFUND_SENTENCE_RE = re.compile(r"refund|退款")
+_CONDITION_RE = re.compile(r"condition|tags?\b|unused|undamaged|packag|完好|吊牌|未使用|未拆封|包装|配件")
+_SENTENCE_RE = re.compile(r"[^。！？.!?\n]+[。！？.!?]?")
+
+
+@dataclass(frozen=True)
+class ReturnPolicy:
+    return_window_days: int
+    auto_refund_threshold: Optional[float]  # 元；知识库没写时为 None，由调用方决定默认值
+    condition_rules: Tuple[str, ...]
+    hits: Tuple[Dict[str, object], ...]
+    version: str
+    from_kb: bool
+    compiled_at: float
+
+    @property
+    def policy_hits(self) -> List[Dict[str, object]]:
+        return [dict(hit) for hit in self.hits]
+
+
+def extract_auto_refund_threshold(hits: Iterable[Dict[str, Any]]) -> Optional[float]:
+    return _agreed("auto_refund_threshold", _candidates(hits, _REFUND_SENTENCE_RE, _THRESHOLD_PATTERNS))[0]
+
+
+def extract_return_window(hits: Iterable[Dict[str, Any]]) -> Optional[int]:
+    days = _agreed("return_window_days", _candidates(hits, _RETURN_SENTENCE_RE, _WINDOW_PATTERNS))[0]
+    return int(days) if days else None
+
+
+def extract_condition_rules(hits: Iterable[Dict[str, Any]]) -> Tuple[str, ...]:
+    rules: List[str] = []
+    for hit in hits:
+        for sentence in _SENTENCE_RE.findall(str(hit.get("content", ""))):
+            sentence = sentence.strip()
+            if sentence and _CONDITION_RE.search(sentence.lower()) and sentence not in rules:
+                rules.append(sentence)
+    return tuple(rules)
+
+
+def _candidates(hits: Iterable[Dict[str, Any]], sentence_re, patterns) -> List[Tuple[float, str]]:
+    """(value, source sentence) for every pattern match in the sentences selected by sentence_re."""
+    found: List[Tuple[float, str]] = []
+    for hit in hits:
+        for sentence in _SENTENCE_RE.findall(str(hit.get("content", ""))):
+            lowered = sentence.lower()
+            if not sentence_re.search(lowered):
+                continue
+            for pattern in patterns:
+                for value in pattern.findall(lowered):
+                    try:
+                        found.append((float(value), sentence.strip()))
+                    except ValueError:
+                        continue
+    return found
+
+
+def _agreed(name: str, candidates: List[Tuple[float, str]]) -> Tuple[Optional[float], Optional[str]]:
+    """(value, source sentence) when all candidates agree; (None, None) when there are none or they conflict."""
+    values = sorted({value for value, _ in candidates})
+    if not values:
+        return None, None
+    if len(values) > 1:
+        sources = "; ".join(f"{value:g}: {sentence!r}" for value, sentence in candidates)
+        print(f"[return policy] conflicting {name} values, using the default: {sources}")
+        return None, None
+    return candidates[0]
+
+
+def compile_policy(hits: List[Dict[str, object]], from_kb: bool) -> ReturnPolicy:
+    hits = hits[:MAX_HITS]
+    fingerprint = hashlib.sha1(
+        "\x1e".join(f"{hit.get('source_id')}\x1f{hit.get('content')}" for hit in hits).encode("utf-8")
+    ).hexdigest()[:12]
+    window, window_source = _agreed("return_window_days", _candidates(hits, _RETURN_SENTENCE_RE, _WINDOW_PATTERNS))
+    threshold, threshold_source = _agreed(
+        "auto_refund_threshold", _candidates(hits, _REFUND_SENTENCE_RE, _THRESHOLD_PATTERNS)
+    )
+    for name, value, source in (
+        ("return_window_days", window, window_source),
+        ("auto_refund_threshold", threshold, threshold_source),
+    ):
+        if source:
+            print(f"[return policy] {name}={value:g} from {source!r}")
+    return ReturnPolicy(
+        return_window_days=int(window) if window else DEFAULT_RETURN_WINDOW_DAYS,
+        auto_refund_threshold=threshold,
+        condition_rules=extract_condition_rules(hits),
+        hits=tuple(hits),
+        version=fingerprint,
+        from_kb=from_kb,
+        compiled_at=time.time(),
+    )
+
+
+class ReturnPolicySnapshot:
+    def __init__(self):
+        self._policy: Optional[ReturnPolicy] = None
+        self._source: Any = None
+        self._lock = threading.Lock()
+        self._stats = {"compiles": 0, "reads": 0}
+
+    def current(self) -> ReturnPolicy:
+        """The compiled policy for the index snapshot in memory right now (no I/O)."""
+        self._stats["reads"] += 1
+        snapshot = policy_index.snapshot
+        policy = self._policy
+        if policy is not None and self._source is snapshot:
+            return policy
+        with self._lock:
+            if self._policy is None or self._source is not snapshot:
+                self._policy = self._compile(snapshot)
+                self._source = snapshot
+            return self._policy
+
+    async def get(self) -> ReturnPolicy:
+        """current(), after letting the index sync if its refresh interval has passed."""
+        if policy_index.needs_sync():
+            await run_blocking(policy_index.ensure_fresh)
+        return self.current()
+
+    def _compile(self, snapshot) -> ReturnPolicy:
+        self._stats["compiles"] += 1
+        if not snapshot.docs:
+            policy = compile_policy([dict(hit) for hit in MOCK_KB], from_kb=False)
+        else:
+            ranked = snapshot.lexical.search(POLICY_QUERY, MAX_HITS)
+            hits = [_as_hit(snapshot.docs[doc_id], score, 4) for doc_id, score in ranked if doc_id in snapshot.docs]
+            if not hits:
+                # 和 search_policies 一样：没有词命中时退回前几条文档
+                hits = [_as_hit(doc, 0.0, 4) for doc in list(snapshot.docs.values())[:MAX_HITS]]
+            policy = compile_policy(hits, from_kb=True)
+        print(
+            f"[return policy] compiled v{policy.version}: window={policy.return_window_days}d "
+            f"auto_refund_threshold={policy.auto_refund_threshold} conditions={len(policy.condition_rules)} "
+            f"from_kb={policy.from_kb}"
+        )
+        return policy
+
+    def metrics(self) -> Dict[str, Any]:
+        policy = self._policy
+        result: Dict[str, Any] = dict(self._stats)
+        if policy is not None:
+            result.update(
+                version=policy.version,
+                from_kb=policy.from_kb,
+                return_window_days=policy.return_window_days,
+                auto_refund_threshold=policy.auto_refund_threshold,
+                condition_rules=len(policy.condition_rules),
+                compiled_at=policy.compiled_at,
+            )
+        return result
+
+
+return_policy_snapshot = ReturnPolicySnapshot()
+register_metrics("return_policy", return_policy_snapshot.metrics)
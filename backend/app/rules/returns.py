@@ -22,8 +22,9 @@ def evaluate(
     condition_ok: bool,
     requested_amount: int,
     auto_threshold: int,
+    return_window_days: int = 30,
 ) -> Dict[str, object]:
-    within_window = days_since_purchase < 30
+    within_window = days_since_purchase < return_window_days
     needs_approval = requested_amount >= auto_threshold
     return {
         "within_window": within_window,
@@ -4,11 +4,12 @@ from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Tuple
 
 from ..agents import qa
+from ..core.executors import run_blocking
 from ..db.repo import Repository
 from ..rag import bailian
+from ..rag.policy_snapshot import return_policy_snapshot
 from ..integrations.alipay import get_alipay_client
 from ..rules import returns as return_rules
-from ..agents.return_planner import ReturnPlannerAgent
 
 
 @dataclass
@@ -52,20 +53,27 @@ class ReturnFlow:
             reply = qa.render_missing_fields(missing)
             return reply, {"state": "CollectInfo", "missing": missing}
 
-        order = self.repo.get_order(user_id, ctx.order_id)
+        order = await run_blocking(self.repo.get_order, user_id, ctx.order_id)
         if not order:
             reply = "I could not find that order. Please confirm the order number."
             return reply, {"state": "FetchOrder", "order_found": False}
 
-        ctx.policy_hits = self.rag.search_policies("return policy, refund threshold")
-        self.repo.log_event(
+        policy = await return_policy_snapshot.get()
+        ctx.policy_hits = policy.policy_hits
+        await run_blocking(
+            self.repo.log_event,
             trace_id=trace_id,
             event_type="POLICY_HIT",
-            payload={"hits": ctx.policy_hits},
+            payload={
+                "hits": ctx.policy_hits,
+                "policy_version": policy.version,
+                "return_window_days": policy.return_window_days,
+                "condition_rules": list(policy.condition_rules),
+            },
             conversation_id=conversation_id,
             user_id=user_id,
         )
-        threshold = ReturnPlannerAgent._extract_auto_refund_threshold(ctx.policy_hits)
+        threshold = policy.auto_refund_threshold
         if threshold is None:
             threshold_cents = return_rules.approval_threshold()
         else:
@@ -76,6 +84,7 @@ class ReturnFlow:
             condition_ok=bool(ctx.condition_ok),
             requested_amount=ctx.requested_amount or 0,
             auto_threshold=threshold_cents,
+            return_window_days=policy.return_window_days,
         )
 
         if not rules["within_window"] or not rules["condition_ok"]:
@@ -87,7 +96,8 @@ class ReturnFlow:
         refund_amount_cents = ctx.requested_amount or order.get("paid_amount") or 0
         refund_amount_major = refund_amount_cents / 100 if refund_amount_cents else 0
 
-        return_record = self.repo.create_return(
+        return_record = await run_blocking(
+            self.repo.create_return,
             user_id=user_id,
             order_id=ctx.order_id,
             sku=ctx.sku or "",
@@ -101,13 +111,15 @@ class ReturnFlow:
         ctx.return_id = return_record.get("id") or return_record.get("rma_id")
 
         if rules["needs_approval"]:
-            approval = self.repo.create_approval_task(
+            approval = await run_blocking(
+                self.repo.create_approval_task,
                 user_id=user_id,
                 return_id=ctx.return_id or "",
                 reason="Amount exceeds auto-approval threshold",
             )
             ctx.approval_task_id = approval.get("id")
-            self.repo.log_event(
+            await run_blocking(
+                self.repo.log_event,
                 trace_id=trace_id,
                 event_type="APPROVAL_CREATED",
                 payload={"approval_task_id": ctx.approval_task_id},
@@ -127,7 +139,8 @@ class ReturnFlow:
                 refund_result = {"success": False, "error": str(exc)}
 
             if refund_result.get("success"):
-                self.repo.update_return(
+                await run_blocking(
+                    self.repo.update_return,
                     user_id=user_id,
                     return_id=ctx.return_id or "",
                     updates={
@@ -138,7 +151,8 @@ class ReturnFlow:
                     },
                 )
             else:
-                self.repo.update_return(
+                await run_blocking(
+                    self.repo.update_return,
                     user_id=user_id,
                     return_id=ctx.return_id or "",
                     updates={
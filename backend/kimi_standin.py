@@ -0,0 +1,455 @@
+"""
+Local stand-in for the Moonshot/Kimi chat completions API (OpenAI compatible).
+
+Point the backend at it with KIMI_API_BASE=http://127.0.0.1:9100/v1 (any
+KIMI_API_KEY works) to run or load-test the chat endpoints offline.
+
+Modes:
+  synthetic  generate replies locally: streaming SSE, tool_calls chosen from the
+             offered tools by keyword, configurable latency / token rate / errors
+  record     proxy to the real API and append every request/response pair to a
+             cassette (JSONL); streaming responses are recorded chunk by chunk
+  replay     serve responses from a cassette deterministically; identical
+             requests are answered in recorded order
+
+Usage examples (from backend/):
+  python kimi_standin.py
+  python kimi_standin.py --ttft lognormal:800,0.5 --tokens-per-sec 30 --error-rate 0.02 --rate-limit-rate 0.01
+  python kimi_standin.py --mode record --cassette cassettes/kimi.jsonl
+  python kimi_standin.py --mode replay --cassette cassettes/kimi.jsonl --replay-timing recorded
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ORDER_ID_PATTERN = re.compile(r"ORD[-_A-Z0-9]{3,}", re.IGNORECASE)
+
+# 关键词 → 工具名（按顺序匹配，只会选择请求里实际提供的工具）
+TOOL_KEYWORDS = [
+    (("人工", "真人", "投诉", "human"), ("transfer_to_human", "transfer_to_agent")),
+    (("退货", "退款", "退掉", "不想要", "refund", "return"), ("call_return_department",)),
+    (("物流", "快递", "到哪", "发货", "配送", "tracking"), ("call_logistics_department",)),
+    (("订单", "买了", "order"), ("call_order_department",)),
+]
+
+SYNTHETIC_REPLIES = [
+    "您好，我已经帮您查看了相关信息。",
+    "请问还有什么可以帮您的吗？",
+    "如果有任何问题，随时联系我们。",
+    "感谢您的耐心等待，我们会尽快为您处理。",
+]
+
+
+# ---------------------------------------------------------------------------
+# helpers
+# ---------------------------------------------------------------------------
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "\u3000" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """Cassette key: everything that shapes the answer, minus the model name and transport flags."""
+    relevant = {
+        "messages": body.get("messages"),
+        "tools": body.get("tools"),
+        "tool_choice": body.get("tool_choice"),
+        "stream": bool(body.get("stream")),
+    }
+    canonical = json.dumps(relevant, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split text roughly the way a tokenizer would: CJK per character, other text per word."""
+    return re.findall(r"[\u3000-\u9fff\uff00-\uffef]|\s*[^\s\u3000-\u9fff\uff00-\uffef]+|\s+", text)
+
+
+class LatencyDistribution:
+    """Parsed from "fixed:MS", "uniform:LO,HI" or "lognormal:MEDIAN_MS,SIGMA"."""
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(item) for item in params.split(",") if item.strip()]
+        self.kind = kind
+        self.values = values
+        if kind == "fixed" and len(values) == 1:
+            return
+        if kind in {"uniform", "lognormal"} and len(values) == 2:
+            return
+        raise ValueError(f"invalid latency spec: {spec!r}")
+
+    def sample(self, rng: random.Random) -> float:
+        """Seconds."""
+        if self.kind == "fixed":
+            return self.values[0] / 1000
+        if self.kind == "uniform":
+            return rng.uniform(self.values[0], self.values[1]) / 1000
+        median_ms, sigma = self.values
+        return rng.lognormvariate(math.log(max(median_ms, 1.0)), sigma) / 1000
+
+
+def error_response(status: int, message: str, error_type: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"message": message, "type": error_type}})
+
+
+def sse(data: Any) -> str:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return f"data: {payload}\n\n"
+
+
+# ---------------------------------------------------------------------------
+# synthetic replies
+# ---------------------------------------------------------------------------
+
+
+class SyntheticModel:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.ttft = LatencyDistribution(args.ttft)
+        self.rng = random.Random(args.seed)
+
+    def plan(self, body: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """Decide the reply text and tool calls for a request (deterministic per request)."""
+        rng = random.Random(f"{self.args.seed}:{request_key(body)}")
+        messages = body.get("messages") or []
+        last = messages[-1] if messages else {}
+        offered = {tool["function"]["name"] for tool in body.get("tools") or [] if tool.get("function")}
+
+        if last.get("role") == "tool":
+            names = [msg.get("name") or "tool" for msg in messages if msg.get("role") == "tool"]
+            return f"已根据{'、'.join(dict.fromkeys(names))}的结果为您处理。" + rng.choice(SYNTHETIC_REPLIES), []
+
+        text = str(last.get("content") or "")
+        system = " ".join(str(msg.get("content") or "") for msg in messages if msg.get("role") == "system")
+        if not offered and "JSON" in (system + text).upper():
+            return json.dumps(self._intent(text), ensure_ascii=False), []
+
+        order_match = ORDER_ID_PATTERN.search(text)
+        for keywords, tool_names in TOOL_KEYWORDS:
+            if not any(keyword in text.lower() for keyword in keywords):
+                continue
+            name = next((tool for tool in tool_names if tool in offered), None)
+            if not name:
+                continue
+            arguments: Dict[str, Any] = {}
+            if name.startswith("transfer"):
+                arguments["reason"] = "用户要求人工服务"
+            elif order_match:
+                arguments["order_id"] = order_match.group(0).upper()
+            elif name == "call_order_department":
+                arguments["list_all"] = True
+            return "", [
+                {
+                    "id": f"call_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+                }
+            ]
+
+        sentences = rng.randint(1, 3)
+        return "".join(rng.choice(SYNTHETIC_REPLIES) for _ in range(sentences)), []
+
+    @staticmethod
+    def _intent(text: str) -> Dict[str, Any]:
+        intent = "general_question"
+        if any(word in text for word in ("退货", "退款")):
+            intent = "return_request"
+        elif "换" in text:
+            intent = "exchange_request"
+        elif any(word in text for word in ("订单", "物流", "快递")):
+            intent = "order_status"
+        return {"intent": intent, "confidence": 0.8, "emotion": "neutral", "need_human": False, "reason": "stand-in"}
+
+    def usage(self, body: Dict[str, Any], content: str, tool_calls: List[Dict]) -> Dict[str, int]:
+        prompt = sum(estimate_tokens(str(msg.get("content") or "")) + 4 for msg in body.get("messages") or [])
+        prompt += estimate_tokens(json.dumps(body.get("tools") or [], ensure_ascii=False)) if body.get("tools") else 0
+        completion = estimate_tokens(content) + sum(estimate_tokens(call["function"]["arguments"]) + 5 for call in tool_calls)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    def injected_error(self) -> Optional[str]:
+        roll = self.rng.random()
+        for kind, rate in (
+            ("server_error", self.args.error_rate),
+            ("rate_limit", self.args.rate_limit_rate),
+            ("hang", self.args.hang_rate),
+            ("stream_cut", self.args.stream_cut_rate),
+        ):
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    async def respond(self, body: Dict[str, Any]):
+        error = self.injected_error()
+        await asyncio.sleep(self.ttft.sample(self.rng))
+        if error == "server_error":
+            return error_response(500, "injected server error", "server_error")
+        if error == "rate_limit":
+            return error_response(429, "injected rate limit", "rate_limit_reached_error")
+        if error == "hang":
+            await asyncio.sleep(self.args.hang_seconds)
+            return error_response(504, "injected hang", "timeout")
+
+        content, tool_calls = self.plan(body)
+        usage = self.usage(body, content, tool_calls)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model") or "moonshot-v1-8k"
+        finish_reason = "tool_calls" if tool_calls else "stop"
+
+        if not body.get("stream"):
+            await asyncio.sleep(usage["completion_tokens"] / self.args.tokens_per_sec)
+            message: Dict[str, Any] = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage,
+                }
+            )
+
+        return StreamingResponse(
+            self._stream(completion_id, model, content, tool_calls, usage, finish_reason, cut=error == "stream_cut"),
+            media_type="text/event-stream",
+        )
+
+    async def _stream(
+        self,
+        completion_id: str,
+        model: str,
+        content: str,
+        tool_calls: List[Dict],
+        usage: Dict[str, int],
+        finish_reason: str,
+        cut: bool,
+    ) -> AsyncIterator[str]:
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None, extra: Optional[Dict] = None) -> str:
+            choice: Dict[str, Any] = {"index": 0, "delta": delta, "finish_reason": finish}
+            if extra:
+                choice.update(extra)
+            return sse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [choice],
+                }
+            )
+
+        interval = 1.0 / self.args.tokens_per_sec
+        yield chunk({"role": "assistant", "content": ""})
+        pieces = split_tokens(content)
+        for index, piece in enumerate(pieces):
+            if cut and index >= len(pieces) // 2:
+                return  # 模拟连接中断：没有 finish_reason 也没有 [DONE]
+            yield chunk({"content": piece})
+            await asyncio.sleep(interval)
+
+        for index, call in enumerate(tool_calls):
+            # 和 Moonshot 一样：先发 id/name，再分几段发 arguments
+            yield chunk({"tool_calls": [{"index": index, "id": call["id"], "type": "function",
+                                         "function": {"name": call["function"]["name"], "arguments": ""}}]})
+            arguments = call["function"]["arguments"]
+            step = max(1, len(arguments) // 3)
+            for start in range(0, len(arguments), step):
+                if cut:
+                    return
+                yield chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + step]}}]})
+                await asyncio.sleep(interval)
+
+        yield chunk({}, finish_reason, {"usage": usage})
+        yield sse("[DONE]")
+
+
+# ---------------------------------------------------------------------------
+# record / replay
+# ---------------------------------------------------------------------------
+
+
+class Recorder:
+    def __init__(self, args: argparse.Namespace):
+        self.upstream = args.upstream.rstrip("/") + "/chat/completions"
+        self.path = Path(args.cassette)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(180.0, connect=30.0))
+        self.api_key = args.api_key
+
+    def _headers(self, request: Request) -> Dict[str, str]:
+        auth = request.headers.get("authorization") or (f"Bearer {self.api_key}" if self.api_key else "")
+        return {"Authorization": auth, "Content-Type": "application/json"}
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        with self.path.open("a", encoding="utf-8") as handle:
+            handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    async def respond(self, body: Dict[str, Any], request: Request):
+        key = request_key(body)
+        started = time.perf_counter()
+        if not body.get("stream"):
+            response = await self.client.post(self.upstream, json=body, headers=self._headers(request))
+            self._append(
+                {
+                    "key": key,
+                    "request": body,
+                    "status": response.status_code,
+                    "body": response.json() if response.content else None,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+            )
+            return JSONResponse(status_code=response.status_code, content=response.json() if response.content else None)
+
+        upstream_request = self.client.build_request("POST", self.upstream, json=body, headers=self._headers(request))
+        response = await self.client.send(upstream_request, stream=True)
+        if response.status_code >= 400:
+            raw = await response.aread()
+            await response.aclose()
+            data = json.loads(raw) if raw else None
+            self._append({"key": key, "request": body, "status": response.status_code, "body": data})
+            return JSONResponse(status_code=response.status_code, content=data)
+
+        async def relay() -> AsyncIterator[str]:
+            chunks: List[Dict[str, Any]] = []
+            try:
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunks.append({"t_ms": round((time.perf_counter() - started) * 1000, 1), "line": line})
+                    yield line + "\n\n"
+            finally:
+                await response.aclose()
+                self._append({"key": key, "request": body, "status": response.status_code, "stream": chunks})
+
+        return StreamingResponse(relay(), media_type="text/event-stream")
+
+
+class Replayer:
+    def __init__(self, args: argparse.Namespace, fallback: Optional[SyntheticModel]):
+        self.timing = args.replay_timing
+        self.fallback = fallback
+        self.entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.cursor: Dict[str, int] = defaultdict(int)
+        path = Path(args.cassette)
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                self.entries[entry["key"]].append(entry)
+        print(f"[standin] loaded {sum(len(v) for v in self.entries.values())} recordings from {path}")
+
+    async def respond(self, body: Dict[str, Any]):
+        key = request_key(body)
+        recorded = self.entries.get(key)
+        if not recorded:
+            if self.fallback is not None:
+                return await self.fallback.respond(body)
+            return error_response(404, f"no recording for request {key[:12]}", "replay_miss")
+        # 同一请求多次录制时按录制顺序依次返回，循环使用
+        entry = recorded[self.cursor[key] % len(recorded)]
+        self.cursor[key] += 1
+
+        if "stream" not in entry:
+            if self.timing == "recorded" and entry.get("latency_ms"):
+                await asyncio.sleep(entry["latency_ms"] / 1000)
+            return JSONResponse(status_code=entry["status"], content=entry.get("body"))
+
+        async def replay() -> AsyncIterator[str]:
+            previous = 0.0
+            for item in entry["stream"]:
+                if self.timing == "recorded":
+                    await asyncio.sleep(max(item["t_ms"] - previous, 0) / 1000)
+                    previous = item["t_ms"]
+                yield item["line"] + "\n\n"
+
+        return StreamingResponse(replay(), media_type="text/event-stream")
+
+
+# ---------------------------------------------------------------------------
+# app
+# ---------------------------------------------------------------------------
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Kimi stand-in")
+    synthetic = SyntheticModel(args)
+    recorder = Recorder(args) if args.mode == "record" else None
+    replayer = Replayer(args, synthetic if args.replay_miss == "synthetic" else None) if args.mode == "replay" else None
+    stats = {"requests": 0, "streams": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        stats["streams"] += 1 if body.get("stream") else 0
+        if recorder is not None:
+            return await recorder.respond(body, request)
+        if replayer is not None:
+            return await replayer.respond(body)
+        return await synthetic.respond(body)
+
+    @app.get("/v1/models")
+    async def models():
+        names = ["moonshot-v1-8k", "moonshot-v1-32k", "moonshot-v1-128k", "kimi-k2-turbo-preview"]
+        return {"object": "list", "data": [{"id": name, "object": "model", "owned_by": "standin"} for name in names]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {"mode": args.mode, **stats}
+
+    return app
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible Kimi stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ttft", default="lognormal:600,0.4", help="time to first token: fixed:MS | uniform:LO,HI | lognormal:MEDIAN_MS,SIGMA")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of requests that stall for --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--stream-cut-rate", type=float, default=0.0, help="fraction of streams dropped halfway")
+    parser.add_argument("--cassette", default="cassettes/kimi.jsonl")
+    parser.add_argument("--upstream", default="https://api.moonshot.cn/v1")
+    parser.add_argument("--api-key", default=os.getenv("KIMI_API_KEY", ""), help="upstream key for record mode if the client sends none")
+    parser.add_argument("--replay-timing", choices=["recorded", "none"], default="none")
+    parser.add_argument("--replay-miss", choices=["error", "synthetic"], default="error")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    print(f"[standin] mode={args.mode} listening on http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+-- 为 conversations 表添加滚动摘要字段（长对话上下文压缩）
+
+-- 1. 摘要正文：较早消息的增量摘要
+ALTER TABLE conversations
+ADD COLUMN IF NOT EXISTS summary TEXT;
+
+-- 2. 摘要覆盖的消息条数（按 created_at 升序的前 N 条）
+ALTER TABLE conversations
+ADD COLUMN IF NOT EXISTS summary_message_count INTEGER NOT NULL DEFAULT 0;
+
+-- 3. 摘要更新时间
+ALTER TABLE conversations
+ADD COLUMN IF NOT EXISTS summary_updated_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN conversations.summary IS '较早对话的滚动摘要，由后台任务增量维护';
+COMMENT ON COLUMN conversations.summary_message_count IS '摘要已覆盖的消息条数';
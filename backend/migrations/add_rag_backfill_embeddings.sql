@@ -0,0 +1,26 @@
+-- embedding 回填（app/rag/backfill.py）的批量写回：一条语句写一批行，只写 embedding 列
+-- 依赖 add_rag_documents_updated_at.sql
+
+-- 1. p_rows: [{"id": ..., "updated_at": ..., "embedding": [...]}, ...]
+--    只更新 updated_at 仍等于读取时的值的行：嵌入期间被编辑过的行保持原样；返回实际写入的行数
+CREATE OR REPLACE FUNCTION backfill_rag_embeddings(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE sql
+SET search_path = public, pg_temp
+AS $$
+  WITH written AS (
+    UPDATE rag_documents AS d
+    SET embedding = r.embedding
+    FROM jsonb_populate_recordset(NULL::rag_documents, p_rows) AS r
+    WHERE d.id = r.id
+      AND d.updated_at = r.updated_at
+    RETURNING 1
+  )
+  SELECT count(*)::INTEGER FROM written;
+$$;
+
+-- 2. 只给后端的 service_role 调用
+REVOKE EXECUTE ON FUNCTION backfill_rag_embeddings(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION backfill_rag_embeddings(JSONB) TO service_role;
+
+COMMENT ON FUNCTION backfill_rag_embeddings(JSONB) IS 'embedding 回填的批量写回，按 updated_at 跳过嵌入期间被修改的行';
@@ -0,0 +1,16 @@
+-- rag_documents 分块入库（app/rag/ingest.py）：稳定分块 ID、内容哈希、墓碑
+
+-- 1. 分块 ID（<source_id>#<章节>-<首段哈希>）、内容哈希、删除时间；手工插入的旧行 chunk_id 为空
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS chunk_id TEXT;
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE rag_documents ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+
+-- 2. upsert 按 chunk_id 冲突合并（NULL 不参与唯一约束）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rag_documents_chunk_id ON rag_documents (chunk_id);
+
+-- 3. 重新入库时按来源取已有分块
+CREATE INDEX IF NOT EXISTS idx_rag_documents_source_id ON rag_documents (source_id);
+
+COMMENT ON COLUMN rag_documents.chunk_id IS '稳定分块 ID，重新入库时据此比对';
+COMMENT ON COLUMN rag_documents.content_hash IS '标题/内容/分类/元数据的哈希，未变化的分块不重新嵌入';
+COMMENT ON COLUMN rag_documents.deleted_at IS '墓碑：来源中已不存在的分块，检索时排除';
@@ -0,0 +1,24 @@
+-- 为 rag_documents 添加 updated_at，供进程内向量索引（app/rag/index.py）增量同步
+
+-- 1. 更新时间列（已有行取当前时间）
+ALTER TABLE rag_documents
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- 2. 任何更新（包括回填 embedding）都刷新 updated_at
+CREATE OR REPLACE FUNCTION touch_rag_documents_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rag_documents_touch_updated_at ON rag_documents;
+CREATE TRIGGER rag_documents_touch_updated_at
+BEFORE UPDATE ON rag_documents
+FOR EACH ROW EXECUTE FUNCTION touch_rag_documents_updated_at();
+
+-- 3. 增量同步按 updated_at 范围查询
+CREATE INDEX IF NOT EXISTS idx_rag_documents_updated_at ON rag_documents (updated_at);
+
+COMMENT ON COLUMN rag_documents.updated_at IS '最后修改时间，向量索引据此增量同步';
@@ -0,0 +1,100 @@
+"""
+Recall / latency benchmark: IVF ANN index vs exact search on synthetic data.
+
+Vectors are drawn around random cluster centres (roughly how policy chunks
+group by topic). Queries are held out: fresh draws from the same clusters,
+never copies of indexed vectors, so a query's nearest neighbours are not
+handed to the index for free. --spread is the noise around the centres;
+the default is a hard setting where a query's neighbours straddle several
+lists, as with loosely grouped text embeddings. For each vector storage
+(float32 / int8) it reports build time, search-resident vector memory,
+recall@k against exact float32 search and per-query p50/p95 latency for
+every --nprobe.
+
+Usage (from backend/):
+  python rag_ann_bench.py
+  python rag_ann_bench.py --sizes 50000,100000 --nprobe 16,32,64,128
+  python rag_ann_bench.py --storage float32,int8 --spread 2.5
+"""
+import argparse
+import time
+from typing import List
+
+import numpy as np
+
+from app.rag.ann import ExactVectors, IVFIndex, normalize_rows
+
+
+def synthetic(centres: np.ndarray, n: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    labels = rng.integers(0, centres.shape[0], n)
+    noise = rng.standard_normal((n, centres.shape[1])).astype(np.float32)
+    return normalize_rows(centres[labels] + spread * noise)
+
+
+def percentile_us(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) * 1e6
+
+
+def run(
+    n: int, dim: int, queries: int, k: int, nprobes: List[int], storages: List[str], spread: float, seed: int
+) -> None:
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(8, n // 500), dim)).astype(np.float32)
+    matrix = synthetic(centres, n, spread, rng)
+    ids = list(range(n))
+    query_matrix = synthetic(centres, queries, spread, rng)
+
+    exact = ExactVectors(ids, matrix)
+    truth = []
+    exact_times = []
+    for query in query_matrix:
+        started = time.perf_counter()
+        hits = exact.search(query, k)
+        exact_times.append(time.perf_counter() - started)
+        truth.append({doc_id for doc_id, _ in hits})
+    print(
+        f"n={n} dim={dim} spread={spread} | exact float32 {matrix.nbytes / 2**20:.1f}MB "
+        f"p50={percentile_us(exact_times, 50):.0f}us p95={percentile_us(exact_times, 95):.0f}us"
+    )
+
+    for storage in storages:
+        started = time.perf_counter()
+        index = IVFIndex.build(ids, matrix, seed=seed, storage=storage)
+        build_s = time.perf_counter() - started
+        print(
+            f"  ivf {storage:<7} nlist={index.meta['nlist']} build={build_s:.2f}s "
+            f"vectors={index.nbytes / 2**20:.1f}MB ({index.nbytes / n:.0f} B/vector)"
+        )
+        for nprobe in nprobes:
+            times = []
+            found = 0
+            for query, expected in zip(query_matrix, truth):
+                started = time.perf_counter()
+                hits = index.search(query, k, nprobe)
+                times.append(time.perf_counter() - started)
+                found += len(expected & {doc_id for doc_id, _ in hits})
+            print(
+                f"    nprobe={nprobe:<3} recall@{k}={found / (len(truth) * k):.3f} "
+                f"p50={percentile_us(times, 50):.0f}us p95={percentile_us(times, 95):.0f}us"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,50000,100000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", default="16,32,64,128")
+    parser.add_argument("--storage", default="float32,int8")
+    parser.add_argument("--spread", type=float, default=4.0, help="noise around cluster centres; higher = less clustered")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    nprobes = [int(value) for value in args.nprobe.split(",")]
+    storages = args.storage.split(",")
+    for n in (int(value) for value in args.sizes.split(",")):
+        run(n, args.dim, args.queries, args.k, nprobes, storages, args.spread, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,50 @@
 """
 Backfill embeddings for rag_documents using DashScope.
 
+Resumable: progress is checkpointed after every page, so re-running after a
+crash continues where it stopped (--restart starts over from the first row).
+
 Usage (from backend/):
   python rag_backfill.py
+  python rag_backfill.py --limit 1000 --concurrency 8 --rps 20
 """
-from app.rag import bailian
+import argparse
+import asyncio
+
+from app.rag.backfill import BackfillProgress, run_backfill
+from app.rag.embeddings import shutdown_embedding_service
+
+
+def report(progress: BackfillProgress) -> None:
+    print(f"[page {progress.pages}] {progress.summary()}", flush=True)
+
+
+async def run(args: argparse.Namespace) -> BackfillProgress:
+    try:
+        return await run_backfill(
+            limit=args.limit,
+            restart=args.restart,
+            page_size=args.page_size,
+            concurrency=args.concurrency,
+            rps=args.rps,
+            on_progress=report,
+        )
+    finally:
+        await shutdown_embedding_service()
 
 
 def main() -> None:
-    updated = bailian.backfill_embeddings(limit=200)
-    print(f"updated={updated}")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many rows")
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=None, help="DashScope requests in flight")
+    parser.add_argument("--rps", type=float, default=None, help="DashScope requests per second")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+    progress = asyncio.run(run(args))
+    state = "done" if progress.finished else "stopped (re-run to resume)"
+    print(f"{state}: {progress.summary()}, elapsed={progress.elapsed:.1f}s")
+    print(f"updated={progress.embedded}")
 
 
 if __name__ == "__main__":
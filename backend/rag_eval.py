@@ -0,0 +1,218 @@
+"""
+Offline retrieval evaluation for policy search.
+
+Runs the labelled queries in rag_eval_corpus.json against its fixed corpus,
+padded with synthetic filler documents. The queries are in Chinese and
+English and cover return windows, refund thresholds, shipping and item
+condition. For each corpus size and retrieval path it reports recall@k, MRR
+and p50/p95/p99 query latency.
+
+Paths:
+  keyword       BM25 (LexicalIndex)
+  vector-exact  brute-force cosine (ExactVectors)
+  vector-ivf    IVF ANN index (IVFIndex, --nprobe defaults to RAG_ANN_NPROBE);
+                one variant per --storage, suffixed with the storage unless
+                float32 (vector-ivf-int8)
+  hybrid-*      BM25 + vector candidates fused with weighted RRF (hybrid_fusion),
+                as search_policies does; --vector-weight / --min-vector-score
+                default to RAG_HYBRID_VECTOR_WEIGHT / RAG_HYBRID_MIN_VECTOR_SCORE
+
+Use it as the acceptance check when changing retrieval: hybrid should not
+score below keyword on recall@k or MRR.
+
+Embeddings are deterministic fake vectors: signed feature hashing of the
+BM25 terms plus character trigrams. The run needs no network, Supabase or
+API key. Vector-path quality therefore measures the index plumbing, not the
+embedding model. Hashed vectors have no topic clusters, which is the worst
+case for IVF: vector-ivf recall here is a floor, use rag_ann_bench.py to
+tune nprobe.
+
+Usage (from backend/):
+  python rag_eval.py
+  python rag_eval.py --sizes 200,1000,10000,100000 --k 5 --json results.json
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.rag.ann import ExactVectors, IVFIndex, normalize_rows
+from app.rag.lexical import LexicalIndex, document_text, hybrid_fusion, tokenize
+
+CORPUS_PATH = Path(__file__).with_name("rag_eval_corpus.json")
+
+# 填充文档的词表：大多是无关话题，夹杂少量政策词做干扰
+_FILLER_ZH = [
+    "新品上架", "限时折扣", "会员日", "直播间", "优惠券", "满减活动", "店铺公告", "品牌故事", "搭配推荐", "尺码表",
+    "洗涤说明", "产地直发", "用户评价", "晒单有礼", "客服工作时间", "订单", "物流", "售后", "商品", "发货",
+]
+_FILLER_EN = [
+    "new", "arrivals", "seasonal", "sale", "bundle", "coupon", "members", "gift", "card", "style", "guide", "size",
+    "chart", "care", "instructions", "brand", "story", "review", "order", "delivery", "item", "support",
+]
+
+Variant = Callable[[str, np.ndarray, int], List[Any]]
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    features = list(tokenize(text))
+    compact = "".join(text.lower().split())
+    features.extend(f"3:{compact[i : i + 3]}" for i in range(len(compact) - 2))
+    for feature in features:
+        digest = zlib.crc32(feature.encode("utf-8"))
+        vector[digest % dim] += 1.0 if (digest >> 16) & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def filler_documents(count: int, seed: int) -> List[Dict[str, str]]:
+    rng = random.Random(seed)
+    docs = []
+    for i in range(count):
+        if i % 2:
+            words = [rng.choice(_FILLER_EN) for _ in range(rng.randint(15, 40))]
+            docs.append({"id": f"filler-{i}", "title": " ".join(words[:3]), "content": " ".join(words)})
+        else:
+            words = [rng.choice(_FILLER_ZH) for _ in range(rng.randint(8, 20))]
+            docs.append({"id": f"filler-{i}", "title": "".join(words[:2]), "content": "，".join(words) + "。"})
+    return docs
+
+
+def percentile_ms(samples: Sequence[float], q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000
+
+
+def build_variants(
+    docs: List[Dict[str, str]],
+    dim: int,
+    nprobe: int,
+    storages: List[str],
+    seed: int,
+    vector_weight: float,
+    min_vector_score: float,
+) -> Tuple[Dict[str, Variant], Dict[str, float]]:
+    build_s: Dict[str, float] = {}
+    ids = [doc["id"] for doc in docs]
+
+    started = time.perf_counter()
+    lexical = LexicalIndex.build((doc["id"], document_text(doc)) for doc in docs)
+    build_s["keyword"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matrix = normalize_rows(np.stack([fake_embedding(document_text(doc), dim) for doc in docs]))
+    build_s["embed"] = time.perf_counter() - started
+    exact = ExactVectors(ids, matrix)
+
+    def keyword(query: str, vector: np.ndarray, k: int) -> List[Any]:
+        return [doc_id for doc_id, _ in lexical.search(query, k)]
+
+    def vector_path(search: Callable[[np.ndarray, int], List[Tuple[Any, float]]]) -> Variant:
+        def run(query: str, vector: np.ndarray, k: int) -> List[Any]:
+            return [doc_id for doc_id, _ in search(vector, k)]
+
+        return run
+
+    def hybrid(search: Callable[[np.ndarray, int], List[Tuple[Any, float]]]) -> Variant:
+        def run(query: str, vector: np.ndarray, k: int) -> List[Any]:
+            candidates = max(k * 4, 20)
+            fused = hybrid_fusion(lexical.search(query, candidates), search(vector, candidates), vector_weight, min_vector_score)
+            return [doc_id for doc_id, _ in fused[:k]]
+
+        return run
+
+    variants = {"keyword": keyword, "vector-exact": vector_path(exact.search), "hybrid-exact": hybrid(exact.search)}
+    for storage in storages:
+        suffix = "" if storage == "float32" else f"-{storage}"
+        started = time.perf_counter()
+        ivf = IVFIndex.build(ids, matrix, seed=seed, storage=storage)
+        build_s[f"ivf{suffix}"] = time.perf_counter() - started
+
+        def ivf_search(vector: np.ndarray, k: int, ivf: IVFIndex = ivf) -> List[Tuple[Any, float]]:
+            return ivf.search(vector, k, nprobe)
+
+        variants[f"vector-ivf{suffix}"] = vector_path(ivf_search)
+        variants[f"hybrid-ivf{suffix}"] = hybrid(ivf_search)
+    return variants, build_s
+
+
+def evaluate(variant: Variant, queries: List[Dict[str, Any]], vectors: List[np.ndarray], k: int, repeat: int) -> Dict[str, float]:
+    recall = 0.0
+    reciprocal_rank = 0.0
+    times: List[float] = []
+    for query, vector in zip(queries, vectors):
+        relevant = set(query["relevant"])
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ranked = variant(query["query"], vector, k)
+            times.append(time.perf_counter() - started)
+        recall += len(relevant & set(ranked[:k])) / len(relevant)
+        rank = next((i for i, doc_id in enumerate(ranked[:k], start=1) if doc_id in relevant), None)
+        reciprocal_rank += 1.0 / rank if rank else 0.0
+    return {
+        f"recall@{k}": round(recall / len(queries), 4),
+        "mrr": round(reciprocal_rank / len(queries), 4),
+        "p50_ms": round(percentile_ms(times, 50), 3),
+        "p95_ms": round(percentile_ms(times, 95), 3),
+        "p99_ms": round(percentile_ms(times, 99), 3),
+    }
+
+
+def run(size: int, args: argparse.Namespace, corpus: Dict[str, Any]) -> List[Dict[str, Any]]:
+    docs = list(corpus["documents"])
+    docs.extend(filler_documents(max(0, size - len(docs)), args.seed))
+    queries = [q for q in corpus["queries"] if args.lang in ("all", q["lang"])]
+    query_vectors = [fake_embedding(q["query"], args.dim) for q in queries]
+    variants, build_s = build_variants(
+        docs, args.dim, args.nprobe, args.storage, args.seed, args.vector_weight, args.min_vector_score
+    )
+    print(
+        f"\nn={len(docs)} queries={len(queries)} dim={args.dim} | build: "
+        + " ".join(f"{name}={seconds:.2f}s" for name, seconds in build_s.items())
+    )
+    print(f"  {'path':<18}{'recall@' + str(args.k):>10}{'mrr':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = []
+    for name, variant in variants.items():
+        if args.paths and name not in args.paths:
+            continue
+        result = evaluate(variant, queries, query_vectors, args.k, args.repeat)
+        values = list(result.values())
+        print(f"  {name:<18}{values[0]:>10.3f}{values[1]:>8.3f}{values[2]:>10.3f}{values[3]:>10.3f}{values[4]:>10.3f}")
+        rows.append({"size": len(docs), "path": name, **result})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="200,1000,10000,100000")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, default=settings.rag_ann_nprobe)
+    parser.add_argument("--storage", default="float32,int8", help="IVF vector storages to compare")
+    parser.add_argument("--vector-weight", type=float, default=settings.rag_hybrid_vector_weight)
+    parser.add_argument("--min-vector-score", type=float, default=settings.rag_hybrid_min_vector_score)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query")
+    parser.add_argument("--lang", choices=["all", "zh", "en"], default="all")
+    parser.add_argument("--paths", default="", help="comma-separated subset of paths")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="also write results to this file")
+    args = parser.parse_args()
+    args.paths = [path for path in args.paths.split(",") if path]
+    args.storage = [storage for storage in args.storage.split(",") if storage]
+
+    corpus = json.loads(CORPUS_PATH.read_text(encoding="utf-8"))
+    results = []
+    for size in (int(value) for value in args.sizes.split(",")):
+        results.extend(run(size, args, corpus))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Ingest policy documents (Markdown / HTML / text) into rag_documents.
+
+Files are split into chunks. Only new or changed chunks are embedded and
+written, and chunks that disappeared from a file are tombstoned, so
+re-running after a small edit is cheap. A file's source_id is its path
+relative to the directory given on the command line (or its file name).
+
+Usage (from backend/):
+  python rag_ingest.py docs/policies --category returns
+  python rag_ingest.py docs/policies/returns.md --dry-run
+"""
+import argparse
+import asyncio
+from pathlib import Path
+from typing import List, Tuple
+
+from app.rag.chunking import detect_format, document_title
+from app.rag.embeddings import shutdown_embedding_service
+from app.rag.ingest import IngestResult, ingest_document
+
+
+def collect(paths: List[str]) -> List[Tuple[Path, str]]:
+    files: List[Tuple[Path, str]] = []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and detect_format(str(child)):
+                    files.append((child, child.relative_to(path).as_posix()))
+        elif path.is_file() and detect_format(str(path)):
+            files.append((path, path.name))
+        else:
+            print(f"skip {raw}: not a .md/.markdown/.html/.htm/.txt file or directory")
+    return files
+
+
+async def run(args: argparse.Namespace) -> List[IngestResult]:
+    results: List[IngestResult] = []
+    try:
+        for path, source_id in collect(args.paths):
+            fmt = detect_format(str(path))
+            text = path.read_text(encoding="utf-8")
+            title = document_title(text, fmt) or path.stem
+            result = await ingest_document(
+                source_id,
+                text,
+                fmt,
+                title,
+                category=args.category,
+                metadata={"path": source_id, "format": fmt},
+                dry_run=args.dry_run,
+            )
+            print(result.summary(), flush=True)
+            results.append(result)
+    finally:
+        await shutdown_embedding_service()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--category", default=None)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print(
+        f"files={len(results)} chunks={sum(r.chunks for r in results)} "
+        f"unchanged={sum(r.unchanged for r in results)} written={sum(r.written for r in results)} "
+        f"tombstoned={sum(r.tombstoned for r in results)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 测试从 backend/ 或仓库根目录运行都能 import app
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,128 @@
+"""Minimal in-memory stand-in for the supabase-py query builder used by app/rag."""
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from postgrest.exceptions import APIError
+
+
+class FakeQuery:
+    def __init__(self, table: "FakeTable"):
+        self.table = table
+        self.columns: List[str] = []
+        self.filters: List[Any] = []
+        self.order_by = None
+        self.bounds = None
+        self.update_values = None
+        self.count = None
+
+    def select(self, columns: str, count=None):
+        self.columns = [column.strip() for column in columns.split(",")]
+        self.count = count
+        return self
+
+    def eq(self, key, value):
+        self.filters.append(lambda row: row.get(key) == value)
+        return self
+
+    def gte(self, key, value):
+        self.filters.append(lambda row: row.get(key) is not None and row[key] >= value)
+        return self
+
+    def gt(self, key, value):
+        self.filters.append(lambda row: row.get(key) is not None and row[key] > value)
+        return self
+
+    def in_(self, key, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(key) in values)
+        return self
+
+    def filter(self, key, op, value):
+        if (op, value) == ("is", "null"):
+            self.filters.append(lambda row: row.get(key) is None)
+        elif (op, value) == ("not.is", "null"):
+            self.filters.append(lambda row: row.get(key) is not None)
+        else:
+            raise NotImplementedError(op)
+        return self
+
+    def order(self, key, desc=False):
+        self.order_by = key
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count - 1)
+        return self
+
+    def update(self, values):
+        self.update_values = values
+        return self
+
+    def execute(self):
+        self.table.queries.append(self)
+        if self.table.failures:
+            raise self.table.failures.pop(0)
+        rows = [row for row in self.table.rows if all(check(row) for check in self.filters)]
+        if self.update_values is not None:
+            for row in rows:
+                row.update(self.update_values)
+            return SimpleNamespace(data=[dict(row) for row in rows])
+        count = len(rows) if self.count else None
+        if self.order_by:
+            rows.sort(key=lambda row: (row.get(self.order_by) is None, row.get(self.order_by)))
+        if self.bounds:
+            rows = rows[self.bounds[0] : self.bounds[1] + 1]
+        if self.table.max_rows is not None:
+            # 同 PostgREST 的 db-max-rows：超出的行静默丢弃
+            rows = rows[: self.table.max_rows]
+        data = [{column: row.get(column) for column in self.columns} for row in rows]
+        return SimpleNamespace(data=data, count=count)
+
+
+class FakeTable:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.queries: List[FakeQuery] = []
+        self.upserts: List[List[Dict[str, Any]]] = []
+        self.max_rows = None
+        self.failures: List[Exception] = []  # 依次让接下来的 execute() 抛出
+
+    def select(self, columns: str, count=None):
+        return FakeQuery(self).select(columns, count)
+
+    def update(self, values):
+        return FakeQuery(self).update(values)
+
+    def upsert(self, rows, on_conflict=None):
+        self.upserts.append([dict(row) for row in rows])
+        key = on_conflict or "id"
+        for row in rows:
+            existing = next((r for r in self.rows if r.get(key) == row.get(key)), None)
+            if existing is None:
+                self.rows.append(dict(row))
+            else:
+                existing.update(row)
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=[dict(row) for row in rows]))
+
+
+class FakeClient:
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.tables = {name: FakeTable(rows) for name, rows in tables.items()}
+        self.functions: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.rpc_calls: List[str] = []
+
+    def rpc(self, name: str, params: Dict[str, Any]):
+        def execute():
+            self.rpc_calls.append(name)
+            if name not in self.functions:
+                raise APIError({"code": "PGRST202", "message": f"Could not find the function public.{name}"})
+            return SimpleNamespace(data=self.functions[name](params))
+
+        return SimpleNamespace(execute=execute)
+
+    def table(self, name: str) -> FakeTable:
+        return self.tables.setdefault(name, FakeTable([]))
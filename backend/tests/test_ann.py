@@ -0,0 +1,29 @@
+import numpy as np
+
+from app.rag.ann import ANNVectors, ExactVectors, IVFIndex, normalize_rows
+from app.rag.index import parse_embedding
+
+
+def test_parse_embedding_rejects_malformed_values():
+    assert parse_embedding("[0.5, -1, 2e-3]").tolist() == np.array([0.5, -1, 2e-3], dtype=np.float32).tolist()
+    assert parse_embedding([1, 2]).dtype == np.float32
+    for bad in ("[0.1, 0.2, abc, 0.4]", "[0.1, 0.2", "[]", "[[0.1], [0.2]]", "[0.1, NaN]", "", None):
+        assert parse_embedding(bad) is None, bad
+
+
+def test_int8_rebuilds_quantize_from_the_float32_source(tmp_path):
+    rng = np.random.default_rng(0)
+    ids = list(range(400))
+    matrix = normalize_rows(rng.standard_normal((400, 32)))
+    base = IVFIndex.build(ids, matrix, storage="int8")
+    base.save(str(tmp_path), {})
+    loaded = IVFIndex.load(str(tmp_path))
+    assert isinstance(loaded.source, np.memmap)
+    assert loaded.nbytes < matrix.nbytes / 3
+
+    vectors = ANNVectors(loaded, ExactVectors.empty(), frozenset(), nprobe=4)
+    for _ in range(3):
+        vectors = vectors.with_changes({0: matrix[0]}, []).rebuilt("int8")
+    rebuilt_ids, rebuilt = vectors.base.live_items(frozenset())
+    order = np.argsort(rebuilt_ids)
+    np.testing.assert_allclose(rebuilt[order], matrix, atol=1e-6)
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+from postgrest.exceptions import APIError
+
+from app.rag import backfill as backfill_module
+from app.rag.backfill import EmbeddingBackfill
+from app.rag.embeddings import embedding_service
+
+from fake_supabase import FakeClient
+
+
+def row(doc_id, content, updated_at):
+    return {
+        "id": doc_id,
+        "title": f"doc {doc_id}",
+        "content": content,
+        "embedding": None,
+        "updated_at": updated_at,
+        "deleted_at": None,
+    }
+
+
+def backfill_rag_embeddings(table):
+    """migrations/add_rag_backfill_embeddings.sql over the fake table."""
+
+    def run(params):
+        written = 0
+        for update in params["p_rows"]:
+            for existing in table.rows:
+                if existing["id"] == update["id"] and existing.get("updated_at") == update["updated_at"]:
+                    existing["embedding"] = update["embedding"]
+                    written += 1
+        return written
+
+    return run
+
+
+def make_backfill(tmp_path):
+    return EmbeddingBackfill(page_size=10, concurrency=2, rps=0, checkpoint_path=str(tmp_path / "checkpoint.json"))
+
+
+def test_backfill_writes_only_embeddings_and_skips_rows_edited_meanwhile(monkeypatch, tmp_path):
+    client = FakeClient({"rag_documents": [row(i, f"refund rule {i}", "t1") for i in range(1, 4)]})
+    table = client.table("rag_documents")
+    client.functions["backfill_rag_embeddings"] = backfill_rag_embeddings(table)
+    monkeypatch.setattr(backfill_module, "get_supabase_admin_client", lambda: client)
+
+    async def embed_batch(texts):
+        # 管理员在嵌入过程中改了第 2 行
+        table.rows[1].update(content="refund under 80 cny", updated_at="t2")
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(embedding_service, "embed_batch", embed_batch)
+    progress = asyncio.run(make_backfill(tmp_path).run())
+
+    first, second, third = table.rows
+    assert first["embedding"] == third["embedding"] == [1.0, 0.0]
+    assert second["content"] == "refund under 80 cny"
+    assert second["embedding"] is None
+    assert (progress.embedded, progress.stale, progress.finished) == (2, 1, True)
+    # 一批一条语句：没有逐行 UPDATE，也没有带标题/正文的 upsert
+    assert client.rpc_calls == ["backfill_rag_embeddings"]
+    assert not table.upserts
+    assert all(query.update_values is None for query in table.queries)
+
+
+def test_backfill_without_the_rpc_updates_row_by_row_with_the_guard(monkeypatch, tmp_path):
+    client = FakeClient({"rag_documents": [row(1, "return within 30 days", "t1"), row(2, "refund under 50 cny", "t1")]})
+    table = client.table("rag_documents")
+    monkeypatch.setattr(backfill_module, "get_supabase_admin_client", lambda: client)
+
+    async def embed_batch(texts):
+        table.rows[1].update(content="refund under 80 cny", updated_at="t2")
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(embedding_service, "embed_batch", embed_batch)
+    progress = asyncio.run(make_backfill(tmp_path).run())
+
+    assert (progress.embedded, progress.stale) == (1, 1)
+    assert table.rows[1]["embedding"] is None
+    assert all(query.update_values in (None, {"embedding": [1.0, 0.0]}) for query in table.queries)
+
+
+def test_backfill_without_updated_at_writes_by_id(monkeypatch, tmp_path):
+    rows = [row(1, "return within 30 days", None)]
+    del rows[0]["updated_at"]
+    client = FakeClient({"rag_documents": rows})
+    table = client.table("rag_documents")
+    select = table.select
+
+    def missing_column():
+        raise APIError({"code": "42703", "message": "column rag_documents.updated_at does not exist"})
+
+    def select_without_updated_at(columns, count=None):
+        query = select(columns, count)
+        if "updated_at" in columns:
+            # PostgREST 在执行时才报列不存在
+            query.execute = missing_column
+        return query
+
+    monkeypatch.setattr(table, "select", select_without_updated_at)
+    monkeypatch.setattr(backfill_module, "get_supabase_admin_client", lambda: client)
+
+    async def embed_batch(texts):
+        return [[0.0, 1.0] for _ in texts]
+
+    monkeypatch.setattr(embedding_service, "embed_batch", embed_batch)
+    progress = asyncio.run(make_backfill(tmp_path).run())
+
+    assert table.rows[0]["embedding"] == [0.0, 1.0]
+    assert (progress.embedded, progress.stale) == (1, 0)
+
+
+def test_backfill_skips_tombstoned_chunks(monkeypatch, tmp_path):
+    rows = [row(1, "return within 30 days", "t1"), row(2, "old refund rule", "t1")]
+    rows[1]["deleted_at"] = "t1"
+    client = FakeClient({"rag_documents": rows})
+    monkeypatch.setattr(backfill_module, "get_supabase_admin_client", lambda: client)
+    embedded = []
+
+    async def embed_batch(texts):
+        embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr(embedding_service, "embed_batch", embed_batch)
+    progress = asyncio.run(make_backfill(tmp_path).run())
+
+    assert (progress.total, progress.embedded) == (1, 1)
+    assert len(embedded) == 1 and rows[1]["embedding"] is None
+
+
+def test_transient_fetch_error_keeps_the_guards(monkeypatch, tmp_path):
+    client = FakeClient({"rag_documents": [row(1, "return within 30 days", "t1")]})
+    table = client.table("rag_documents")
+    monkeypatch.setattr(backfill_module, "get_supabase_admin_client", lambda: client)
+    backfill = make_backfill(tmp_path)
+
+    table.failures.append(ConnectionError("connection reset"))
+    with pytest.raises(ConnectionError):
+        backfill._fetch_page(None, 10)
+    assert backfill._versioned and backfill._tombstones
+    assert [r["id"] for r in backfill._fetch_page(None, 10)] == [1]
@@ -0,0 +1,62 @@
+from app.rag.chunking import chunk_document
+from app.rag.ingest import chunk_row
+
+SECTIONS = ["退货政策", "退款规则", "运费说明", "Exchanges"]
+
+
+def policy_markdown(paragraphs):
+    lines = ["# 售后政策"]
+    for name, body in zip(SECTIONS, paragraphs):
+        lines.append(f"## {name}")
+        lines.extend(body)
+    return "\n\n".join(lines)
+
+
+def sample_paragraphs():
+    return [
+        [f"{name} 第 {i} 条：签收后请保留包装与发票，客服会在 {i + 1} 个工作日内处理申请并通知结果。" for i in range(30)]
+        for name in SECTIONS
+    ]
+
+
+def rows(paragraphs):
+    chunks = chunk_document(policy_markdown(paragraphs), "markdown", "policy.md", max_chars=300, overlap=50)
+    return {row["chunk_id"]: row["content_hash"] for row in (chunk_row(c, "policy.md", "售后政策", "returns", None) for c in chunks)}
+
+
+def diff(before, after):
+    """(chunks to embed and write, chunks to tombstone), as ingest_document computes them."""
+    written = [chunk_id for chunk_id, digest in after.items() if before.get(chunk_id) != digest]
+    tombstoned = [chunk_id for chunk_id in before if chunk_id not in after]
+    return written, tombstoned
+
+
+def test_editing_one_paragraph_rewrites_at_most_its_neighbourhood():
+    paragraphs = sample_paragraphs()
+    before = rows(paragraphs)
+    assert len(before) > 20
+    # 改写后的段落变长，会挤动所在分块的边界
+    paragraphs[1][15] = "补充说明：" + paragraphs[1][15] * 3
+    written, tombstoned = diff(before, rows(paragraphs))
+    assert 1 <= len(written) <= 3
+    assert len(tombstoned) <= 2
+
+
+def test_inserting_a_paragraph_does_not_renumber_the_section():
+    paragraphs = sample_paragraphs()
+    before = rows(paragraphs)
+    for i in range(3):
+        paragraphs[0].insert(0, f"新增第 {i} 条：定制商品不支持七天无理由退货，请下单前确认尺码与颜色。")
+    written, tombstoned = diff(before, rows(paragraphs))
+    assert 1 <= len(written) <= 3
+    assert len(tombstoned) <= 3
+
+
+def test_chunk_ids_are_unique_and_stable():
+    paragraphs = sample_paragraphs()
+    paragraphs[2] = paragraphs[2] + paragraphs[2][:5]  # 重复段落
+    chunks = chunk_document(policy_markdown(paragraphs), "markdown", "policy.md", max_chars=300, overlap=50)
+    ids = [chunk.chunk_id for chunk in chunks]
+    assert len(ids) == len(set(ids))
+    again = chunk_document(policy_markdown(paragraphs), "markdown", "policy.md", max_chars=300, overlap=50)
+    assert ids == [chunk.chunk_id for chunk in again]
@@ -0,0 +1,23 @@
+from app.rag import ingest as ingest_module
+
+from fake_supabase import FakeClient
+
+
+def test_chunk_lookups_page_past_the_postgrest_row_cap(monkeypatch):
+    rows = [
+        {
+            "chunk_id": f"policy.md#s-{i:02d}",
+            "source_id": "policy.md",
+            "content_hash": str(i),
+            "deleted_at": None,
+            "embedding": None if i % 2 else [1.0],
+        }
+        for i in range(25)
+    ]
+    client = FakeClient({"rag_documents": rows})
+    client.table("rag_documents").max_rows = 4
+    monkeypatch.setattr(ingest_module, "get_supabase_admin_client", lambda: client)
+    monkeypatch.setattr(ingest_module, "PAGE_SIZE", 4)
+
+    assert len(ingest_module._existing_chunks("policy.md")) == 25
+    assert ingest_module._missing_embeddings("policy.md") == {row["chunk_id"] for row in rows if row["embedding"] is None}
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+from app.rag import lexical
+from app.rag.lexical import LexicalIndex, hybrid_fusion, tokenize
+
+
+def test_cjk_text_matches_on_bigrams():
+    terms = tokenize("七天无理由退货")
+    assert "退货" in terms and "七天" in terms
+    index = LexicalIndex.build([(1, "签收后7天内可申请无理由退货"), (2, "现货商品付款后48小时内发货")])
+    assert index.search("退货期限", 2)[0][0] == 1
+
+
+def test_common_terms_only_rescore_existing_candidates(monkeypatch):
+    docs = [(i, "order delivery item") for i in range(50)] + [(100, "holiday return order")]
+    exact = LexicalIndex.build(docs).search("holiday order", 5)
+    monkeypatch.setattr(lexical, "SCAN_MAX_POSTINGS", 10)
+    capped = LexicalIndex.build(docs).search("holiday order", 5)
+    # "order" 的倒排表超过上限：只给命中 "holiday" 的文档加分，分数与完整 BM25 相同
+    assert capped == exact[:1]
+    assert capped[0][0] == 100
+
+    # 没有更稀有的词命中时仍然整条扫描
+    assert len(LexicalIndex.build(docs).search("delivery", 5)) == 5
+
+
+def test_hybrid_fusion_ignores_weak_vector_hits():
+    bm25 = [("refund-rule", 7.0), ("refund-timing", 3.0)]
+    vectors = [("unrelated", 0.31), ("refund-timing", 0.62), ("refund-rule", 0.55)]
+    fused = [doc_id for doc_id, _ in hybrid_fusion(bm25, vectors, vector_weight=0.5, min_vector_score=0.4)]
+    assert fused == ["refund-rule", "refund-timing"]
+
+    # 只有向量命中（例如跨语言查询）时照常返回
+    only_vectors = hybrid_fusion([], vectors, vector_weight=0.5, min_vector_score=0.4)
+    assert [doc_id for doc_id, _ in only_vectors] == ["refund-timing", "refund-rule"]
+
+
+def test_tokenize_falls_back_to_ngrams_without_jieba(monkeypatch):
+    monkeypatch.setattr(lexical, "jieba", None)
+    terms = tokenize("无理由退货")
+    assert "退货" in terms and "无" in terms
+    assert not any(term.startswith("w:") for term in terms)
+
+
+def test_tokenize_adds_jieba_words_when_available(monkeypatch):
+    fake_jieba = SimpleNamespace(cut=lambda run: ["无理由", "退", "货"] if run == "无理由退货" else [run])
+    monkeypatch.setattr(lexical, "jieba", fake_jieba)
+    terms = tokenize("无理由退货 refund")
+    # 单字分词不单独加，n-gram 照常保留
+    assert [term for term in terms if term.startswith("w:")] == ["w:无理由"]
+    assert "退货" in terms and "refund" in terms
+    index = LexicalIndex.build([(1, "签收后7天内可申请无理由退货"), (2, "理由充分时可以退款")])
+    assert index.search("无理由退货", 2)[0][0] == 1
@@ -0,0 +1,54 @@
+import asyncio
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.auth import User, admin_llm_lane, require_admin
+from app.llm.admission import AdmissionController
+from app.llm.usage import get_llm_context
+
+
+async def drain(controller, waiters):
+    """Queue waiters (user, lane) behind a held slot, then release one at a time; returns admission order."""
+    await controller.acquire("holder", "chat")
+    order = []
+
+    async def wait(user, lane):
+        await controller.acquire(user, lane)
+        order.append((user, lane))
+
+    tasks = []
+    for user, lane in waiters:
+        tasks.append(asyncio.create_task(wait(user, lane)))
+        await asyncio.sleep(0)
+    for _ in waiters:
+        controller.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_lanes_are_served_in_priority_order():
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    waiters = [("u1", "background"), ("u2", "anonymous"), ("u3", "chat"), ("u4", "admin")]
+    order = asyncio.run(drain(controller, waiters))
+    assert [lane for _, lane in order] == ["admin", "chat", "anonymous", "background"]
+
+
+def test_users_round_robin_inside_a_lane():
+    controller = AdmissionController(max_concurrency=1, queue_timeout=5)
+    waiters = [("chatty", "chat"), ("chatty", "chat"), ("chatty", "chat"), ("quiet", "chat")]
+    order = asyncio.run(drain(controller, waiters))
+    assert [user for user, _ in order] == ["chatty", "quiet", "chatty", "chatty"]
+
+
+def test_admin_routes_bind_the_admin_lane():
+    app = FastAPI()
+
+    @app.get("/admin/probe", dependencies=[Depends(admin_llm_lane)])
+    async def probe():
+        return {"lane": get_llm_context().lane, "user_id": get_llm_context().user_id}
+
+    app.dependency_overrides[require_admin] = lambda: User(user_id="admin-1", token="", claims={})
+    response = TestClient(app).get("/admin/probe")
+    assert response.json() == {"lane": "admin", "user_id": "admin-1"}
@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.llm.resilience import CircuitBreaker, LLMPolicy, LLMUnavailableError
+from app.llm.usage import set_llm_context
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_enabled", False)
+    monkeypatch.setattr(settings, "llm_max_attempts", 1)
+    monkeypatch.setattr(settings, "llm_breaker_failure_threshold", 2)
+    monkeypatch.setattr(settings, "llm_breaker_reset_seconds", 0.05)
+    monkeypatch.setattr(settings, "llm_stream_idle_timeout", 0.5)
+    return LLMPolicy()
+
+
+def fake_stream(delays, calls):
+    """open_stream stand-in: sleeps delays[i] before yielding chunk i."""
+
+    def open_stream(timeout):
+        calls.append(timeout)
+
+        async def chunks():
+            for index, delay in enumerate(delays):
+                await asyncio.sleep(delay)
+                yield {"index": index}
+
+        return chunks()
+
+    return open_stream
+
+
+async def collect(policy, open_stream, deadline_seconds):
+    set_llm_context(user_id="u1", deadline_seconds=deadline_seconds)
+    return [chunk async for chunk in policy.stream(open_stream, "test.stream")]
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0.05)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # 同一时间只放行一个探测请求
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_open_breaker_fails_fast_without_calling_upstream(policy):
+    sent = []
+
+    async def send(timeout):
+        sent.append(timeout)
+        raise httpx.ConnectError("refused")
+
+    async def run():
+        set_llm_context(user_id="u1")
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await policy.call(send, "test.call")
+        with pytest.raises(LLMUnavailableError) as info:
+            await policy.call(send, "test.call")
+        return info.value
+
+    error = asyncio.run(run())
+    assert error.reason == "circuit_open"
+    assert len(sent) == 2
+
+
+def test_client_errors_do_not_trip_breaker(policy):
+    request = httpx.Request("POST", "http://kimi.test/chat/completions")
+
+    async def send(timeout):
+        raise httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400, request=request))
+
+    async def run():
+        set_llm_context(user_id="u1")
+        for _ in range(3):
+            with pytest.raises(httpx.HTTPStatusError):
+                await policy.call(send, "test.call")
+
+    asyncio.run(run())
+    assert policy.breaker.state == "closed"
+
+
+def test_started_stream_is_not_cut_off_by_request_deadline(policy):
+    calls = []
+    # 首个分片很快，之后的分片加起来超过 0.2s 的截止时间，但每个间隔都在 idle 超时之内
+    chunks = asyncio.run(collect(policy, fake_stream([0, 0.1, 0.1, 0.1], calls), deadline_seconds=0.2))
+    assert [chunk["index"] for chunk in chunks] == [0, 1, 2, 3]
+    assert len(calls) == 1
+
+
+def test_first_chunk_must_arrive_before_deadline(policy):
+    calls = []
+    with pytest.raises(LLMUnavailableError) as info:
+        asyncio.run(collect(policy, fake_stream([0.5], calls), deadline_seconds=0.1))
+    assert info.value.reason == "deadline"
+
+
+def test_stalled_stream_is_abandoned_without_retry(policy, monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_attempts", 3)
+    monkeypatch.setattr(settings, "llm_stream_idle_timeout", 0.05)
+    calls = []
+    received = []
+
+    async def run():
+        set_llm_context(user_id="u1", deadline_seconds=5)
+        async for chunk in policy.stream(fake_stream([0, 0.3], calls), "test.stream"):
+            received.append(chunk)
+
+    with pytest.raises(LLMUnavailableError) as info:
+        asyncio.run(run())
+    assert info.value.reason == "stream_stalled"
+    assert received == [{"index": 0}]
+    assert len(calls) == 1  # 已有文本发出，不能重试或对冲
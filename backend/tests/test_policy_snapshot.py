@@ -0,0 +1,54 @@
+from app.rag.bailian import MOCK_KB
+from app.rag.policy_snapshot import DEFAULT_RETURN_WINDOW_DAYS, compile_policy, extract_auto_refund_threshold
+
+
+def hit(content, source_id="policy"):
+    return {"title": "", "content": content, "source_id": source_id}
+
+
+def test_mock_kb_policy():
+    policy = compile_policy([dict(item) for item in MOCK_KB], from_kb=False)
+    assert policy.return_window_days == 30
+    assert policy.auto_refund_threshold == 50.0
+    assert policy.condition_rules == ("Returned items must be in good condition and include all tags.",)
+
+
+def test_values_only_come_from_matching_sentences(capsys):
+    policy = compile_policy(
+        [
+            hit("订单满99元包邮，低于99元收取运费。退款一般在3天内原路退回。"),
+            hit("签收后15天内可申请退货。低于50元的订单自动退款。"),
+        ],
+        from_kb=True,
+    )
+    assert policy.return_window_days == 15
+    assert policy.auto_refund_threshold == 50.0
+    out = capsys.readouterr().out
+    assert "return_window_days=15 from '签收后15天内可申请退货。'" in out
+    assert "auto_refund_threshold=50 from '低于50元的订单自动退款。'" in out
+
+
+def test_only_top_hits_are_used():
+    hits = [hit("Returns are accepted within 7 days.")] + [hit("Free gift cards.")] * 2
+    hits.append(hit("Orders under 500 cny are refunded automatically."))
+    policy = compile_policy(hits, from_kb=True)
+    assert policy.return_window_days == 7
+    assert policy.auto_refund_threshold is None
+    assert len(policy.hits) == 3
+
+
+def test_conflicting_values_fall_back_to_defaults(capsys):
+    policy = compile_policy(
+        [
+            hit("Returns are accepted within 7 days. Orders under 50 cny are auto-refunded."),
+            hit("Members may return items within 60 days; refunds under 200 cny need no approval."),
+        ],
+        from_kb=True,
+    )
+    assert policy.return_window_days == DEFAULT_RETURN_WINDOW_DAYS
+    assert policy.auto_refund_threshold is None
+    assert "conflicting auto_refund_threshold" in capsys.readouterr().out
+
+
+def test_shipping_threshold_is_not_a_refund_threshold():
+    assert extract_auto_refund_threshold([hit("低于99元的订单需支付运费。")]) is None
@@ -0,0 +1,243 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.agents.qa import AgentRequestContext, QAAgent
+from app.core.config import settings
+
+
+def make_agent(dispatch):
+    agent = QAAgent(
+        return_planner=SimpleNamespace(repo=None),
+        order_agent=SimpleNamespace(order_api=None),
+        repo=None,
+    )
+    agent._dispatch_tool = dispatch
+    return agent
+
+
+def tool_call(call_id, name, **args):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+
+CTX = AgentRequestContext(user_id="u1", conversation_id="c1")
+
+
+@pytest.fixture(autouse=True)
+def fast_tools(monkeypatch):
+    monkeypatch.setattr(settings, "agent_tool_timeout", 0.05)
+    monkeypatch.setattr(settings, "agent_tool_concurrency", 4)
+
+
+def test_timed_out_side_effecting_tool_finishes_in_background_and_is_logged(capsys):
+    finished = asyncio.Event()
+
+    async def dispatch(ctx, name, args):
+        await asyncio.sleep(0.1)
+        finished.set()
+        raise RuntimeError("refund gateway rejected")
+
+    agent = make_agent(dispatch)
+
+    async def run():
+        results, _ = await agent._execute_tools(CTX, [tool_call("t1", "call_return_department", order_id="A1")])
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+        return results
+
+    results = asyncio.run(run())
+    assert "timed out" in json.loads(results[0]["content"])["error"]
+    assert "background call_return_department failed: refund gateway rejected" in capsys.readouterr().out
+
+
+def test_cancelled_turn_lets_side_effecting_tool_finish_in_background(monkeypatch, capsys):
+    monkeypatch.setattr(settings, "agent_tool_timeout", 1)
+    finished = asyncio.Event()
+
+    async def dispatch(ctx, name, args):
+        await asyncio.sleep(0.05)
+        finished.set()
+        return {"refund": "submitted"}, {}
+
+    agent = make_agent(dispatch)
+
+    async def run():
+        calls = [tool_call("t1", "call_return_department", order_id="A1")]
+        turn = asyncio.ensure_future(agent._execute_tools(CTX, calls))
+        await asyncio.sleep(0.01)
+        turn.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await turn
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    out = capsys.readouterr().out
+    assert "turn cancelled, letting call_return_department finish in the background" in out
+    assert "background call_return_department finished" in out
+
+
+def stream_chunks(*deltas, finish_reason="stop"):
+    chunks = [{"choices": [{"delta": delta}]} for delta in deltas]
+    chunks.append({"choices": [{"delta": {}, "finish_reason": finish_reason}]})
+    return chunks
+
+
+def tool_delta(index, arguments, id=None, name=None):
+    call = {"index": index, "function": {"arguments": arguments}}
+    if id:
+        call["id"] = id
+    if name:
+        call["function"]["name"] = name
+    return {"tool_calls": [call]}
+
+
+def fake_llm_stream(monkeypatch, responses, call_sites):
+    """llm_policy.stream replaced by canned chunk lists, one per streamed request."""
+    from app.agents import qa as qa_module
+
+    responses = list(responses)
+
+    def stream(open_stream, call_site, llm_call=None, max_attempts=None):
+        call_sites.append(call_site)
+        chunks = responses.pop(0)
+
+        async def iterate():
+            for chunk in chunks:
+                await asyncio.sleep(0)
+                if chunk is None:  # 流在这里卡住，直到被取消
+                    await asyncio.Event().wait()
+                yield chunk
+
+        return iterate()
+
+    monkeypatch.setattr(qa_module.llm_policy, "stream", stream)
+
+
+async def collect(agent, text="hello"):
+    return [event async for event in agent.chat_stream(CTX, [{"role": "user", "content": text}])]
+
+
+def test_streamed_tool_turn_has_its_own_latency_call_site(monkeypatch):
+    call_sites = []
+    fake_llm_stream(monkeypatch, [stream_chunks({"content": "hi"})], call_sites)
+    events = asyncio.run(collect(make_agent(None)))
+    assert events[-1]["message"] == "hi"
+    # 流式只记首包延迟，不能和 qa.tools 的整次调用延迟混进同一个对冲窗口
+    assert call_sites == ["qa.tools.stream"]
+
+
+def test_interleaved_tool_call_deltas_run_each_tool_with_its_full_arguments(monkeypatch):
+    fake_llm_stream(
+        monkeypatch,
+        [
+            stream_chunks(
+                tool_delta(0, '{"order_id": "OR', id="t0", name="call_order_department"),
+                tool_delta(1, '{"order_id": "ORD2"}', id="t1", name="call_logistics_department"),
+                tool_delta(0, 'D1"}'),
+                finish_reason="tool_calls",
+            ),
+            stream_chunks({"content": "both found"}),
+        ],
+        [],
+    )
+    dispatched = []
+
+    async def dispatch(ctx, name, args):
+        dispatched.append((name, args))
+        return {"order_id": args.get("order_id")}, {}
+
+    events = asyncio.run(collect(make_agent(dispatch)))
+
+    # index 1 先完整，先提前执行；index 0 要等剩下的参数到齐，不能带着半截参数提前跑
+    assert dispatched == [
+        ("call_logistics_department", {"order_id": "ORD2"}),
+        ("call_order_department", {"order_id": "ORD1"}),
+    ]
+    done = events[-1]
+    assert [result["tool_call_id"] for result in done["tool_results"]] == ["t0", "t1"]
+    assert [json.loads(result["content"])["order_id"] for result in done["tool_results"]] == ["ORD1", "ORD2"]
+    assert done["message"] == "both found"
+
+
+def test_cancelling_the_stream_cancels_early_read_only_tools(monkeypatch):
+    monkeypatch.setattr(settings, "agent_tool_timeout", 1)
+    first_chunk = {"choices": [{"delta": tool_delta(0, '{"order_id": "ORD1"}', id="t0", name="call_order_department")}]}
+    fake_llm_stream(monkeypatch, [[first_chunk, None]], [])
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def dispatch(ctx, name, args):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def run():
+        turn = asyncio.ensure_future(collect(make_agent(dispatch)))
+        await asyncio.wait_for(started.wait(), 1)
+        turn.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await turn
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(run())
+
+
+class FakeOrders:
+    """order_agent stand-in counting prefetched lookups against fallback searches."""
+
+    def __init__(self):
+        self.fetched = []
+        self.searched = []
+        self.order_api = SimpleNamespace(get_order=self.get_order)
+
+    def get_order(self, order_id, user_id=None):
+        self.fetched.append(order_id)
+        return {"order_id": order_id, "status": "shipped"}
+
+    def format_order_details(self, order_id, order):
+        return {"orders": [order], "source": "prefetch"}
+
+    def search_orders(self, order_id=None, **kwargs):
+        self.searched.append(order_id)
+        return {"orders": [{"order_id": order_id}], "source": "search"}
+
+
+def run_order_turn(monkeypatch, text, order_id):
+    from app.agents import prefetch as prefetch_module
+
+    fake_llm_stream(
+        monkeypatch,
+        [
+            stream_chunks(
+                tool_delta(0, json.dumps({"order_id": order_id}), id="t0", name="call_order_department"),
+                finish_reason="tool_calls",
+            ),
+            stream_chunks({"content": "ok"}),
+        ],
+        [],
+    )
+    orders = FakeOrders()
+    agent = QAAgent(return_planner=SimpleNamespace(repo=None), order_agent=orders, repo=None)
+    before = dict(prefetch_module._stats)
+    events = asyncio.run(collect(agent, text))
+    delta = {key: prefetch_module._stats[key] - before[key] for key in ("started", "hits", "misses", "used", "wasted")}
+    return orders, json.loads(events[-1]["tool_results"][0]["content"]), delta
+
+
+def test_prefetched_order_is_used_when_the_tool_asks_for_the_same_order(monkeypatch):
+    orders, result, stats = run_order_turn(monkeypatch, "查一下 ord123 到哪了", "ORD123")
+    assert result["source"] == "prefetch"
+    assert orders.fetched == ["ORD123"] and orders.searched == []
+    assert stats == {"started": 1, "hits": 1, "misses": 0, "used": 1, "wasted": 0}
+
+
+def test_prefetch_for_another_order_falls_back_and_counts_as_waste(monkeypatch):
+    orders, result, stats = run_order_turn(monkeypatch, "查一下 ORD123 到哪了", "ORD999")
+    assert result["source"] == "search"
+    assert orders.searched == ["ORD999"]
+    assert stats == {"started": 1, "hits": 0, "misses": 1, "used": 0, "wasted": 1}
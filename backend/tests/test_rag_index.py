@@ -0,0 +1,132 @@
+import pytest
+from postgrest.exceptions import APIError
+
+from app.core.config import settings
+from app.rag import index as index_module
+from app.rag.index import PolicyIndex
+
+from fake_supabase import FakeClient
+
+
+def row(doc_id, content, updated_at, embedding=(1.0, 0.0, 0.0)):
+    return {
+        "id": doc_id,
+        "title": f"doc {doc_id}",
+        "content": content,
+        "category": "returns",
+        "source_id": None,
+        "metadata": {},
+        "embedding": list(embedding) if embedding else None,
+        "updated_at": updated_at,
+        "deleted_at": None,
+    }
+
+
+@pytest.fixture
+def kb(monkeypatch):
+    monkeypatch.setattr(settings, "rag_index_refresh_interval", 0)
+    monkeypatch.setattr(settings, "rag_index_full_sync_interval", 3600)
+    monkeypatch.setattr(settings, "rag_ann_index_path", "")
+    monkeypatch.setattr(settings, "rag_ann_min_docs", 10_000)
+    client = FakeClient(
+        {
+            "rag_documents": [
+                row(1, "return within 30 days", "2025-01-01T00:00:01"),
+                row(2, "refund under 50 cny", "2025-01-01T00:00:02"),
+            ]
+        }
+    )
+    monkeypatch.setattr(index_module, "get_supabase_admin_client", lambda: client)
+    return client.table("rag_documents")
+
+
+def test_refresh_without_changes_keeps_the_snapshot(kb):
+    index = PolicyIndex()
+    first = index.ensure_fresh()
+    assert set(first.docs) == {1, 2}
+    # gte 仍会返回 updated_at 等于游标的那一行，但它已经应用过了
+    assert index.ensure_fresh() is first
+    assert index.ensure_fresh() is first
+    assert index.metrics()["incremental_syncs"] == 0
+
+
+def test_late_row_with_cursor_timestamp_is_picked_up(kb):
+    index = PolicyIndex()
+    first = index.ensure_fresh()
+    kb.rows.append(row(3, "exchange for another size", "2025-01-01T00:00:02"))
+    second = index.ensure_fresh()
+    assert second is not first
+    assert set(second.docs) == {1, 2, 3}
+    assert index.ensure_fresh() is second
+
+
+def test_failed_sync_leaves_published_snapshot_consistent(kb):
+    index = PolicyIndex()
+    before = index.ensure_fresh()
+    lexical_ids = {doc_id for doc_id, _ in before.lexical.search("exchange size return", 10)}
+
+    def broken_apply(*args, **kwargs):
+        raise RuntimeError("ann build failed")
+
+    index._apply = broken_apply
+    kb.rows.append(row(3, "exchange for another size", "2025-01-01T00:00:03"))
+    kb.rows[0].update(deleted_at="2025-01-01T00:00:03", updated_at="2025-01-01T00:00:03")
+    assert index.ensure_fresh() is before
+
+    # 失败的同步不能改动已发布快照的 BM25 索引
+    hits = before.lexical.search("exchange size return", 10)
+    assert {doc_id for doc_id, _ in hits} == lexical_ids
+    assert all(doc_id in before.docs for doc_id, _ in hits)
+    assert len(before.lexical) == len(before.docs) == 2
+
+    del index._apply
+    after = index.ensure_fresh()
+    assert set(after.docs) == {2, 3}
+    assert {doc_id for doc_id, _ in after.lexical.search("exchange size return", 10)} <= set(after.docs)
+
+
+def missing_column(column):
+    return APIError({"code": "42703", "message": f"column rag_documents.{column} does not exist"})
+
+
+def test_transient_error_does_not_disable_incremental_sync(kb):
+    index = PolicyIndex()
+    index._tombstones = False  # 没有 deleted_at 列的部署
+    first = index.ensure_fresh()
+    kb.rows.append(row(3, "exchange for another size", "2025-01-01T00:00:03"))
+    kb.failures.append(ConnectionError("connection reset"))
+    assert index.ensure_fresh() is first
+    assert index._incremental
+
+    second = index.ensure_fresh()
+    assert set(second.docs) == {1, 2, 3}
+    assert index.metrics()["incremental_syncs"] == 1
+
+
+def test_missing_updated_at_column_falls_back_to_full_reloads(kb):
+    index = PolicyIndex()
+    index._tombstones = False
+    kb.failures.append(missing_column("updated_at"))
+    assert set(index.ensure_fresh().docs) == {1, 2}
+    assert not index._incremental
+
+
+def test_transient_error_keeps_tombstoned_docs_hidden(kb, monkeypatch):
+    monkeypatch.setattr(settings, "rag_index_full_sync_interval", 0)
+    kb.rows[0].update(deleted_at="2025-01-01T00:00:01")
+    index = PolicyIndex()
+    first = index.ensure_fresh()
+    assert set(first.docs) == {2}
+
+    kb.failures.append(ConnectionError("connection reset"))
+    assert index.ensure_fresh() is first
+    assert index._tombstones
+    for _ in range(2):
+        assert set(index.ensure_fresh().docs) == {2}
+
+
+def test_missing_deleted_at_column_stops_filtering_tombstones(kb):
+    index = PolicyIndex()
+    kb.failures.append(missing_column("deleted_at"))
+    assert set(index.ensure_fresh().docs) == {1, 2}
+    assert not index._tombstones and index._incremental
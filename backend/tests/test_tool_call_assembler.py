@@ -0,0 +1,38 @@
+import json
+
+from app.llm.kimi import ToolCallAssembler
+
+
+def args_delta(index, arguments, id=None, name=None):
+    delta = {"index": index, "function": {"arguments": arguments}}
+    if id:
+        delta["id"] = id
+    if name:
+        delta["function"]["name"] = name
+    return delta
+
+
+def test_interleaved_deltas_only_emit_complete_calls():
+    assembler = ToolCallAssembler()
+    assert assembler.feed([args_delta(0, '{"order_id": "OR', id="a", name="get_order_details")]) == []
+
+    # index 1 在 index 0 传完之前就开始了，index 0 不能带着半截参数提前交出去
+    emitted = assembler.feed([args_delta(1, '{"order_id": "ORD2"}', id="b", name="get_logistics_info")])
+    assert [call["id"] for call in emitted] == ["b"]
+
+    emitted = assembler.feed([args_delta(0, 'D1"}')])
+    assert [call["id"] for call in emitted] == ["a"]
+    assert json.loads(emitted[0]["function"]["arguments"]) == {"order_id": "ORD1"}
+    assert assembler.finish() == []
+    assert [call["id"] for call in assembler.tool_calls] == ["a", "b"]
+
+
+def test_later_index_first_keeps_index_order_and_finish_flushes_the_rest():
+    assembler = ToolCallAssembler()
+    assembler.feed([args_delta(1, '{"reason": "', name="transfer_to_human")])
+    assembler.feed([args_delta(0, "{}", id="a", name="check_return_policy")])
+    assembler.feed([args_delta(1, "angry")])
+
+    # 参数一直不完整的调用由 finish() 交出，缺 id 时按 index 补
+    assert [call["id"] for call in assembler.finish()] == ["call_1"]
+    assert [call["function"]["name"] for call in assembler.tool_calls] == ["check_return_policy", "transfer_to_human"]
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.api import chat as chat_module
+from app.api.chat import ChatRequest, chat_with_agent
+from app.api.turns import TurnCoalescer, turn_coalescer
+from app.core import supabase as supabase_module
+from app.core.auth import User
+from app.core.config import settings
+from fake_supabase import FakeClient
+
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    monkeypatch.setattr(settings, "chat_coalesce_window", 0.05)
+
+
+def test_two_messages_in_the_window_coalesce_into_one_turn():
+    coalescer = TurnCoalescer()
+
+    async def scenario():
+        first = coalescer.begin("c1")
+        first_settled = asyncio.ensure_future(first.settle())
+        await asyncio.sleep(0.01)
+        second = coalescer.begin("c1")
+        return await first_settled, await second.settle(), second
+
+    first_answers, second_answers, second = asyncio.run(scenario())
+
+    assert first_answers is False
+    assert second_answers is True
+    assert coalescer._current == {"c1": second}
+    second.close()
+    assert coalescer._current == {}
+
+
+def test_message_after_the_window_supersedes_the_streaming_turn():
+    coalescer = TurnCoalescer()
+
+    async def scenario():
+        first = coalescer.begin("c1")
+        answered = await first.settle()
+        coalescer.begin("c1")
+        return answered, first
+
+    answered, first = asyncio.run(scenario())
+
+    assert answered is True
+    assert first.superseded.is_set()
+
+
+def test_turn_is_released_when_setup_fails_before_the_stream(monkeypatch):
+    client = FakeClient({"conversations": [{"id": "c1", "status": "ai", "assigned_agent_id": None}]})
+    monkeypatch.setattr(supabase_module, "get_supabase_admin_client", lambda: client)
+    monkeypatch.setattr(chat_module, "get_qa_agent", lambda: SimpleNamespace())
+
+    def list_messages(conversation_id, user_id):
+        raise RuntimeError("database unavailable")
+
+    repo = SimpleNamespace(list_messages=list_messages)
+    user = User(user_id="u1", token="t", claims={})
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(chat_with_agent(ChatRequest(conversation_id="c1", message="我的订单"), None, user, repo))
+
+    assert "c1" not in turn_coalescer._current